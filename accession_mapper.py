@@ -1,121 +1,373 @@
-import requests
-from Bio import Entrez
-import pandas as pd
+"""
+Resolves protein accessions (UniProt, e.g. Q9SZ66, and NCBI RefSeq, e.g. NP_683293) to Arabidopsis
+gene names and TAIR loci.
+
+Accessions are first looked up in the UniProt idmapping imported into the app database
+(db_manager.add_uniprot_idmapping), which needs no network access; only the accessions it does not
+have are resolved online.
+
+Results are kept in a local SQLite cache (CACHE_FILE), so a run only fetches the accessions it has
+not resolved before, and an interrupted run resumes where it stopped: every batch is written to the
+cache as soon as it arrives. Accessions the services do not know are cached as not found too, and
+are only asked again with --retry-not-found.
+
+UniProt accessions are looked up with the UniProt REST search in batches of UNIPROT_BATCH_SIZE,
+RefSeq accessions with NCBI efetch in batches of NCBI_BATCH_SIZE, parsed with Bio's GenBank parser.
+Requests run concurrently (--concurrency) but are rate limited per service, to stay within NCBI's
+limit of 3 requests per second (10 with an API key). The base URLs can be changed, e.g. to a mirror
+or a local stub server.
+
+Usage:
+    python accession_mapper.py accessions.txt --output accession_mapping.csv
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import re
+import sqlite3
 import time
+from urllib.parse import urlencode
+
+import pandas as pd
+from Bio import SeqIO
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+
+import db
 
 # ----------------------------- Configuration -----------------------------
 
-# Set your email here. NCBI requires an email address for Entrez API usage.
-Entrez.email = "oliver.marketos@gmail.com"  # Replace with your actual email
-
-# List of accession numbers
-accession_numbers = [
-    "Q9SZ66",
-    "Q9LD44",
-    "P47925",
-    "Q9ZNS2",
-    "NP_683293",
-    "Q3E6S8",
-    "Q3E6S8",
-    "Q3E6S8",
-    "Q3E6S8",
-    "Q8GWA1",
-    "NP_974011"
-]
-
-# Output file name
-output_file = "accession_mapping.csv"
-
-# ----------------------------- Helper Functions -----------------------------
-
-def fetch_uniprot_data(accessions):
+# NCBI requires an email address for Entrez API usage.
+EMAIL = "oliver.marketos@gmail.com"
+TOOL = "xerophyta_data_app"
+
+CACHE_FILE = "accession_cache.sqlite"
+
+UNIPROT_URL = "https://rest.uniprot.org"
+NCBI_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+
+UNIPROT_BATCH_SIZE = 100
+NCBI_BATCH_SIZE = 200
+CONCURRENCY = 4
+# requests per second, per service
+UNIPROT_RATE = 10
+NCBI_RATE = 3
+RETRIES = 4
+# seconds before the first retry, doubled for each further one
+BACKOFF = 1.0
+# rate limiting, server errors, and 599: tornado's code for timeouts and closed connections
+RETRY_CODES = (429, 500, 502, 503, 504, 599)
+
+NOT_FOUND = "Not Found"
+IDMAPPING = "UniProt idmapping"
+
+_REFSEQ_PATTERN = re.compile(r"^[ANXWYZ]P_\d+(\.\d+)?$", re.IGNORECASE)
+# TAIR loci, e.g. AT1G01010, ATCG00020, ATMG00010
+_TAIR_LOCUS_PATTERN = re.compile(r"^AT[1-5CM]G\d{5}$", re.IGNORECASE)
+
+# ----------------------------- Cache -----------------------------
+
+
+class AccessionCache():
+    """
+    SQLite table of accession -> (gene name, locus, source); source is NOT_FOUND for accessions
+    that were looked up without a result.
+    """
+
+    def __init__(self, path=CACHE_FILE):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS accessions (
+                accession TEXT PRIMARY KEY,
+                gene_name TEXT,
+                locus TEXT,
+                source TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self.connection.commit()
+
+    def get(self, accessions):
+        """
+        Returns:
+            dict: accession -> (gene_name, locus, source) for the cached accessions
+        """
+        accessions = list(accessions)
+        results = {}
+        # stay below SQLite's bound parameter limit
+        for i in range(0, len(accessions), 900):
+            chunk = accessions[i:i + 900]
+            rows = self.connection.execute(
+                f"SELECT accession, gene_name, locus, source FROM accessions WHERE accession IN ({','.join('?' * len(chunk))})",
+                chunk)
+            results.update((accession, (gene_name, locus, source)) for accession, gene_name, locus, source in rows)
+        return results
+
+    def put(self, results):
+        """
+        Store a dict of accession -> (gene_name, locus, source), replacing earlier results.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO accessions (accession, gene_name, locus, source, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                [(accession, gene_name, locus, source, now) for accession, (gene_name, locus, source) in results.items()])
+
+    def close(self):
+        self.connection.close()
+
+
+# ----------------------------- Fetching -----------------------------
+
+
+class RateLimiter():
     """
-    Fetch data from UniProt for a list of accession numbers.
+    Spaces the start of requests at least 1 / rate seconds apart.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def is_refseq(accession):
+    return bool(_REFSEQ_PATTERN.match(accession))
+
+
+def strip_version(accession):
+    return accession.split(".")[0]
+
+
+def parse_uniprot(data):
+    """
+    Gene names and loci of the entries of a UniProt search result (JSON).
+
+    Returns:
+        dict: accession -> (gene_name, locus, "UniProt")
     """
-    url = "https://rest.uniprot.org/uniprotkb/search"
-    query = " OR ".join(accessions)  # Create OR query for all accessions
-    params = {
-        "query": query + " AND organism:Arabidopsis thaliana",
-        "fields": "accession,gene_names,organism_name",
-        "format": "json",
-        "size": len(accessions)
-    }
-    response = requests.get(url, params=params)
-    if response.status_code != 200:
-        print(f"UniProt API Error {response.status_code}: {response.text}")
-        return {}
-    data = response.json()
     results = {}
     for entry in data.get("results", []):
-        accession = entry.get("primaryAccession", "")
-        gene_names = entry.get("genes", [])
-        gene_name = gene_names[0]["geneName"]["value"] if gene_names else "Not Found"
-        results[accession] = (gene_name, "Arabidopsis thaliana")
+        genes = entry.get("genes", [])
+        gene_name = genes[0].get("geneName", {}).get("value") if genes else None
+        loci = [name["value"] for gene in genes for name in gene.get("orderedLocusNames", [])]
+        locus = next((l.upper() for l in loci if _TAIR_LOCUS_PATTERN.match(l)), loci[0] if loci else None)
+        for accession in [entry.get("primaryAccession")] + entry.get("secondaryAccessions", []):
+            if accession:
+                results[accession] = (gene_name or locus, locus, "UniProt")
     return results
 
-def fetch_ncbi_data(accessions):
+
+def parse_genbank(text):
     """
-    Fetch data from NCBI for a list of RefSeq accession numbers.
+    Gene names and loci of the records of an NCBI efetch result (GenBank / GenPept flat file).
+
+    Returns:
+        dict: accession (without version) -> (gene_name, locus, "NCBI RefSeq")
     """
     results = {}
-    batch_size = 5
-    for i in range(0, len(accessions), batch_size):
-        batch = accessions[i:i+batch_size]
-        ids = ",".join(batch)
+    for record in SeqIO.parse(io.StringIO(text), "genbank"):
+        gene_name = locus = None
+        for feature in record.features:
+            if feature.type not in ("CDS", "gene", "Protein"):
+                continue
+            gene_name = gene_name or next(iter(feature.qualifiers.get("gene", [])), None)
+            locus = locus or next(iter(feature.qualifiers.get("locus_tag", [])), None)
+        results[strip_version(record.id)] = (gene_name or locus, locus.upper() if locus else None, "NCBI RefSeq")
+    return results
+
+
+class AccessionResolver():
+
+    def __init__(self, cache, uniprot_url=UNIPROT_URL, ncbi_url=NCBI_URL, concurrency=CONCURRENCY,
+                 uniprot_rate=UNIPROT_RATE, ncbi_rate=NCBI_RATE, api_key=None, email=EMAIL, log=print,
+                 database=None):
+        """
+        Parameters:
+            cache: an AccessionCache
+            database: a db.DB with the imported UniProt idmapping, consulted before the cache and the services
+            uniprot_url, ncbi_url: base URLs of the UniProt REST API and of NCBI E-utilities
+            concurrency: requests in flight at the same time
+            uniprot_rate, ncbi_rate: maximum requests per second to each service
+            api_key: NCBI API key, which allows 10 instead of 3 requests per second
+        """
+        self.cache = cache
+        self.database = database
+        self.uniprot_url = uniprot_url.rstrip("/")
+        self.ncbi_url = ncbi_url.rstrip("/")
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.uniprot_limiter = RateLimiter(uniprot_rate)
+        self.ncbi_limiter = RateLimiter(ncbi_rate)
+        self.api_key = api_key
+        self.email = email
+        self.log = log
+        # a client of its own, allowing as many connections as requests in flight
+        self.client = AsyncHTTPClient(force_instance=True, max_clients=max(concurrency, 10))
+
+    def close(self):
+        self.client.close()
+
+    async def fetch(self, url, limiter):
+        """
+        GET url, retrying with exponential backoff on rate limiting, server errors, timeouts and
+        connection errors.
+        """
+        for attempt in range(RETRIES + 1):
+            await limiter.wait()
+            async with self.semaphore:
+                try:
+                    response = await self.client.fetch(url, request_timeout=120)
+                    return response.body.decode()
+                except HTTPClientError as e:
+                    if e.code not in RETRY_CODES or attempt == RETRIES:
+                        raise
+                except OSError:
+                    # refused or reset connections are raised as they are, not as a 599
+                    if attempt == RETRIES:
+                        raise
+            await asyncio.sleep(BACKOFF * 2 ** attempt)
+
+    async def fetch_uniprot(self, accessions):
+        query = " OR ".join(f"accession:{accession}" for accession in accessions)
+        params = {
+            "query": f"({query}) AND organism_id:3702",
+            "fields": "accession,gene_names,gene_oln,organism_name",
+            "format": "json",
+            "size": 500,
+        }
+        body = await self.fetch(f"{self.uniprot_url}/uniprotkb/search?{urlencode(params)}", self.uniprot_limiter)
+        found = parse_uniprot(json.loads(body))
+        return {accession: found.get(accession, (None, None, NOT_FOUND)) for accession in accessions}
+
+    async def fetch_ncbi(self, accessions):
+        params = {"db": "protein", "id": ",".join(accessions), "rettype": "gp", "retmode": "text",
+                  "tool": TOOL, "email": self.email}
+        if self.api_key:
+            params["api_key"] = self.api_key
+        body = await self.fetch(f"{self.ncbi_url}/efetch.fcgi?{urlencode(params)}", self.ncbi_limiter)
+        found = parse_genbank(body)
+        return {accession: found.get(strip_version(accession), (None, None, NOT_FOUND)) for accession in accessions}
+
+    async def fetch_batch(self, fetch, batch, progress):
         try:
-            handle = Entrez.efetch(db="protein", id=ids, rettype="gb", retmode="text")
-            records = handle.read()
-            # Basic parsing to extract Gene Name
-            for record in records.split("//\n"):
-                if "VERSION" in record:
-                    acc_line = [line for line in record.split("\n") if line.startswith("VERSION")][0]
-                    accession = acc_line.split()[1]
-                    gene_name = "Not Found"
-                    for line in record.split("\n"):
-                        if "/gene=" in line:
-                            gene_name = line.split("=")[1].strip('"')
-                            break
-                    results[accession] = (gene_name, "NCBI RefSeq")
-            handle.close()
+            results = await fetch(batch)
         except Exception as e:
-            print(f"NCBI API Error: {e}")
-    return results
+            # left out of the cache, so the next run tries these again
+            self.log(f"Failed to fetch {len(batch)} accessions ({batch[0]}, ...): {e}")
+            return {}
+        self.cache.put(results)
+        progress["done"] += len(batch)
+        self.log(f"{progress['done']} / {progress['total']} accessions fetched")
+        return results
+
+    def resolve_local(self, accessions):
+        """
+        Returns:
+            dict: accession -> (gene_name, locus, IDMAPPING) for the accessions in the imported idmapping
+        """
+        if self.database is None:
+            return {}
+        keys = {a: strip_version(a) if is_refseq(a) else a for a in accessions}
+        found = self.database.get_uniprot_accessions(set(keys.values()))
+        return {a: (found[key][1], found[key][0], IDMAPPING) for a, key in keys.items() if key in found}
+
+    async def resolve(self, accessions, retry_not_found=False):
+        """
+        Resolve accessions, fetching only those neither in the idmapping nor in the cache.
+
+        Returns:
+            dict: accession -> (gene_name, locus, source) for every accession; source is NOT_FOUND
+            for accessions that could not be resolved
+        """
+        accessions = list(dict.fromkeys(a.strip() for a in accessions if a and a.strip()))
+        results = self.resolve_local(accessions)
+        local = len(results)
+
+        cached = self.cache.get([a for a in accessions if a not in results])
+        if retry_not_found:
+            cached = {a: result for a, result in cached.items() if result[2] != NOT_FOUND}
+        results.update(cached)
+        missing = [a for a in accessions if a not in results]
+        self.log(f"{local} accessions in the idmapping, {len(cached)} cached, {len(missing)} to fetch")
+
+        refseq = [a for a in missing if is_refseq(a)]
+        uniprot = [a for a in missing if not is_refseq(a)]
+        batches = ([(self.fetch_uniprot, uniprot[i:i + UNIPROT_BATCH_SIZE]) for i in range(0, len(uniprot), UNIPROT_BATCH_SIZE)]
+                   + [(self.fetch_ncbi, refseq[i:i + NCBI_BATCH_SIZE]) for i in range(0, len(refseq), NCBI_BATCH_SIZE)])
+        progress = {"done": 0, "total": len(missing)}
+        for fetched in await asyncio.gather(*(self.fetch_batch(fetch, batch, progress) for fetch, batch in batches)):
+            results.update(fetched)
+
+        return {a: results.get(a, (None, None, NOT_FOUND)) for a in accessions}
+
 
 # ----------------------------- Main Processing -----------------------------
 
-def main():
-    # Separate UniProt and RefSeq accessions
-    uniprot_accessions = [acc for acc in accession_numbers if not acc.startswith("NP_")]
-    ncbi_accessions = [acc for acc in accession_numbers if acc.startswith("NP_")]
-
-    # Fetch data from UniProt
-    print("Fetching data from UniProt...")
-    uniprot_data = fetch_uniprot_data(uniprot_accessions)
-
-    # Fetch data from NCBI
-    print("Fetching data from NCBI...")
-    ncbi_data = fetch_ncbi_data(ncbi_accessions)
-
-    # Compile results
-    compiled_data = []
-    for acc in accession_numbers:
-        if acc in uniprot_data:
-            gene_name, source = uniprot_data[acc]
-        elif acc in ncbi_data:
-            gene_name, source = ncbi_data[acc]
-        else:
-            gene_name, source = "Not Found", "Not Found"
-        compiled_data.append({
-            "Accession Number": acc,
+
+def read_accessions(path):
+    with open(path) as f:
+        return [token for line in f if not line.startswith("#") for token in line.replace(",", " ").split()]
+
+
+def to_dataframe(accessions, results):
+    rows = []
+    for accession in accessions:
+        gene_name, locus, source = results[accession]
+        rows.append({
+            "Accession Number": accession,
             "Source": source,
-            "Gene Name": gene_name
+            "Gene Name": gene_name or NOT_FOUND,
+            "Locus": locus or NOT_FOUND,
         })
+    return pd.DataFrame(rows)
+
+
+async def run(args):
+    cache = AccessionCache(args.cache)
+    database = db.DB(args.database) if not args.no_idmapping and os.path.exists(args.database) else None
+    try:
+        resolver = AccessionResolver(cache, args.uniprot_url, args.ncbi_url, args.concurrency,
+                                     ncbi_rate=10 if args.api_key else NCBI_RATE, api_key=args.api_key,
+                                     email=args.email, database=database)
+        accessions = read_accessions(args.accessions)
+        try:
+            results = await resolver.resolve(accessions, args.retry_not_found)
+        finally:
+            resolver.close()
+    finally:
+        cache.close()
+        if database is not None:
+            database.close()
+
+    df = to_dataframe(accessions, results)
+    df.to_csv(args.output, index=False)
+    print(f"Results saved to {args.output} ({(df['Source'] != NOT_FOUND).sum()} of {len(df)} resolved)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("accessions", help="file of accession numbers, one per line or comma / whitespace separated")
+    parser.add_argument("--output", default="accession_mapping.csv")
+    parser.add_argument("--cache", default=CACHE_FILE, help="SQLite file caching the resolved accessions")
+    parser.add_argument("--database", default=db.DB.DATABASE_NAME, help="app database with the imported UniProt idmapping")
+    parser.add_argument("--no-idmapping", action="store_true", help="resolve everything online (and from the cache)")
+    parser.add_argument("--retry-not-found", action="store_true", help="look up cached not found accessions again")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--email", default=EMAIL, help="contact address sent to NCBI")
+    parser.add_argument("--api-key", help="NCBI API key")
+    parser.add_argument("--uniprot-url", default=UNIPROT_URL)
+    parser.add_argument("--ncbi-url", default=NCBI_URL)
+    asyncio.run(run(parser.parse_args()))
 
-    # Save results to CSV
-    df = pd.DataFrame(compiled_data)
-    df.to_csv(output_file, index=False)
-    print(f"Results saved to {output_file}")
-    print(df)
 
 if __name__ == "__main__":
     main()
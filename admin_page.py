@@ -0,0 +1,48 @@
+import streamlit as st
+
+import query_stats
+
+
+st.title("SQL statement statistics")
+st.caption(f"The last {query_stats.BUFFER_SIZE} statements executed by this server process, over all sessions.")
+
+df = query_stats.records()
+col1, col2, col3 = st.columns(3)
+col1.metric("Statements", len(df))
+col2.metric("Total time (s)", f"{df['duration_ms'].sum() / 1000:.2f}")
+col3.metric("Reruns", df["rerun_id"].nunique())
+
+if st.button("Clear statistics"):
+    query_stats.clear()
+    st.rerun()
+
+st.subheader("Slowest statements")
+st.write("Statement fingerprints (literals and IN lists replaced by ?) by their total time.")
+st.dataframe(
+    query_stats.slowest_fingerprints(),
+    column_config={
+        "total_ms": st.column_config.NumberColumn("Total (ms)", format="%.1f"),
+        "mean_ms": st.column_config.NumberColumn("Mean (ms)", format="%.2f"),
+        "p95_ms": st.column_config.NumberColumn("p95 (ms)", format="%.2f"),
+        "max_ms": st.column_config.NumberColumn("Max (ms)", format="%.2f"),
+    },
+    use_container_width=True,
+    hide_index=True,
+)
+
+st.subheader("N+1 query patterns")
+st.write(f"SELECTs repeated at least {query_stats.N_PLUS_ONE_THRESHOLD} times within one rerun of a page, "
+         "usually a relationship lazy-loaded once per result row.")
+patterns = query_stats.n_plus_one_patterns()
+if patterns.empty:
+    st.write("None detected.")
+else:
+    st.dataframe(
+        patterns,
+        column_config={"total_ms": st.column_config.NumberColumn("Total (ms)", format="%.1f")},
+        use_container_width=True,
+        hide_index=True,
+    )
+
+with st.expander("Most recent statements"):
+    st.dataframe(df.tail(200).iloc[::-1], use_container_width=True, hide_index=True)
@@ -0,0 +1,35 @@
+"""Arabidopsis locus lookup indexes
+
+Adds the expression index on lower(a_thaliana_locus), which answers the case-insensitive locus
+lookups, and the index finding the genes of a homologue in gene_homologue_association. Databases
+created with create_all already have both, hence IF NOT EXISTS (SQLAlchemy does not reflect
+expression indexes, so checkfirst can not be relied on).
+
+Revision ID: 4d7a2e9c1b56
+Revises: 8c4e1f7a92b3
+Create Date: 2026-10-19 05:02:17.284611
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d7a2e9c1b56'
+down_revision: Union[str, None] = '8c4e1f7a92b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.text('CREATE INDEX IF NOT EXISTS ix_arabidopsis_homologues_locus_lower '
+                       'ON arabidopsis_homologues (lower(a_thaliana_locus))'))
+    op.execute(sa.text('CREATE INDEX IF NOT EXISTS ix_gene_homologue_association_homologue '
+                       'ON gene_homologue_association (homologue_id, gene_id)'))
+
+
+def downgrade() -> None:
+    op.execute(sa.text('DROP INDEX IF EXISTS ix_gene_homologue_association_homologue'))
+    op.execute(sa.text('DROP INDEX IF EXISTS ix_arabidopsis_homologues_locus_lower'))
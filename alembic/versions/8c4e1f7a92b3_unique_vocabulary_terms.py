@@ -0,0 +1,70 @@
+"""Unique vocabulary terms
+
+Deduplicates the GO, enzyme_codes and interpro tables, points the annotation association
+tables at the surviving (lowest ID) row of every term and adds unique indexes on the term IDs.
+
+Revision ID: 8c4e1f7a92b3
+Revises: 2be50a4486db
+Create Date: 2026-10-19 04:12:31.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c4e1f7a92b3'
+down_revision: Union[str, None] = '2be50a4486db'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, term ID column, other columns, association table, association column)
+VOCABULARIES = [
+    ('GO', 'go_id', ['go_branch', 'go_name'], 'annotations_go', 'go_id'),
+    ('enzyme_codes', 'enzyme_code', ['enzyme_name'], 'annotations_enzyme_codes', 'enzyme_code_id'),
+    ('interpro', 'interpro_id', ['interpro_go_id', 'interpro_go_name'], 'annotations_interpro', 'interpro_id'),
+]
+
+
+def upgrade() -> None:
+    for table, term_column, other_columns, association, association_column in VOCABULARIES:
+        # map every duplicate row to the first row with the same term ID
+        op.execute(sa.text('DROP TABLE IF EXISTS _term_map'))
+        op.execute(sa.text(f'''
+            CREATE TEMPORARY TABLE _term_map AS
+            SELECT t.id AS old_id, s.new_id
+            FROM "{table}" t
+            JOIN (SELECT {term_column}, MIN(id) AS new_id FROM "{table}" GROUP BY {term_column}) s
+              ON s.{term_column} = t.{term_column}
+            WHERE t.id != s.new_id
+        '''))
+
+        # keep values only a duplicate has (e.g. a name missing on the first row)
+        for column in other_columns:
+            op.execute(sa.text(f'''
+                UPDATE "{table}" SET {column} = (
+                    SELECT MAX(d.{column}) FROM "{table}" d JOIN _term_map m ON m.old_id = d.id
+                    WHERE m.new_id = "{table}".id
+                )
+                WHERE {column} IS NULL AND id IN (SELECT new_id FROM _term_map)
+            '''))
+
+        # rewire the associations; an annotation linked to several copies of a term keeps one link
+        op.execute(sa.text(f'''
+            INSERT OR IGNORE INTO {association} (annotation_id, {association_column})
+            SELECT a.annotation_id, m.new_id
+            FROM {association} a JOIN _term_map m ON m.old_id = a.{association_column}
+        '''))
+        op.execute(sa.text(f'DELETE FROM {association} WHERE {association_column} IN (SELECT old_id FROM _term_map)'))
+        op.execute(sa.text(f'DELETE FROM "{table}" WHERE id IN (SELECT old_id FROM _term_map)'))
+        op.execute(sa.text('DROP TABLE _term_map'))
+
+        op.create_index(f'ix_{table}_{term_column}', table, [term_column], unique=True)
+
+
+def downgrade() -> None:
+    # the removed duplicates are not restored
+    for table, term_column, _, _, _ in VOCABULARIES:
+        op.drop_index(f'ix_{table}_{term_column}', table_name=table)
@@ -0,0 +1,321 @@
+"""
+JSON API for machine clients, served by tornado next to the Streamlit app.
+
+Endpoints (GET with query parameters, or POST with the same keys in a JSON body for long lists):
+
+    /api/genes        gene search with the Gene info page's filters, paginated by cursor
+                      (genes, arabidopsis, terms, species, query, motif, include_child_terms,
+                      substring_match, limit, cursor); with format=ndjson all results are streamed
+    /api/fasta        the coding sequences of the genes matching the same filters, streamed
+    /api/homologues   Arabidopsis loci / common names (q) resolved to Xerophyta genes
+    /api/expression   expression data of genes (genes, or arabidopsis to resolve homologues first),
+                      streamed as newline-delimited JSON
+
+List parameters can be repeated or comma separated (?genes=a,b&genes=c). Cursors are opaque
+strings returned as next_cursor; a page without next_cursor is the last one.
+
+The blocking database work runs on a thread pool, each request with its own db.DB on the shared
+(pooled) engine, so slow requests do not hold up the event loop and no Streamlit rerun is involved.
+
+Usage:
+    python api.py --port 8502 --threads 8 --wal
+"""
+import argparse
+import base64
+import binascii
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.ioloop
+import tornado.web
+from tornado.iostream import StreamClosedError
+
+import db
+import gene_query
+from boolean_query import QuerySyntaxError
+from models import Gene
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# genes (or expression genes) per chunk of a streamed response
+STREAM_CHUNK_SIZE = 500
+
+# results table columns -> JSON keys
+RESULT_KEYS = {column: key for key, column in gene_query.SUMMARY_COLUMNS.items()}
+RESULT_KEYS["Orthologues (other species)"] = "orthologues"
+
+HOMOLOGUE_KEYS = {"Query": "query", "X. elegans gene": "gene_name", "At_Gene": "a_thaliana_locus",
+                  "Common_name": "a_thaliana_common_name"}
+
+executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="api")
+
+
+def with_database(function, *args):
+    """
+    Call function(database, *args) with a database opened (and closed) for this call.
+    """
+    database = db.DB(pooled=True)
+    try:
+        return function(database, *args)
+    finally:
+        database.close()
+
+
+def encode_cursor(last_gene_id):
+    return base64.urlsafe_b64encode(json.dumps({"after": last_gene_id}).encode()).decode()
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["after"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise tornado.web.HTTPError(400, reason="Invalid cursor")
+
+
+def records(df, keys):
+    """
+    JSON array of the rows of df, with the columns renamed to keys.
+    """
+    return df[list(keys)].rename(columns=keys).to_json(orient="records")
+
+
+def ndjson(df):
+    """
+    Newline-delimited JSON of the rows of df, ending with a newline (which older pandas versions leave out).
+    """
+    return df.to_json(orient="records", lines=True).rstrip("\n") + "\n"
+
+
+def gene_page(database, filters, after, limit):
+    """
+    One page of the gene search: the results of the first limit matching genes with an ID above after.
+
+    Returns:
+        tuple: (JSON array of the result rows, ID of the last gene or None if this is the last page,
+        list of gene names without any match)
+    """
+    query, unmatched_genes = gene_query.build_gene_query(database, **filters)
+    gene_ids = [gene_id for (gene_id,) in
+                query.with_entities(Gene.id).filter(Gene.id > after).order_by(Gene.id).limit(limit + 1)]
+    last_id = gene_ids[limit - 1] if len(gene_ids) > limit else None
+
+    df = gene_query.results_table(database, gene_ids[:limit])
+    return records(df, RESULT_KEYS), last_id, unmatched_genes
+
+
+def matching_gene_ids(database, filters):
+    query, _ = gene_query.build_gene_query(database, **filters)
+    return [gene_id for (gene_id,) in query.with_entities(Gene.id).order_by(Gene.id)]
+
+
+def gene_chunk(database, gene_ids, output):
+    if output == "fasta":
+        return gene_query.to_fasta(gene_query.load_genes(database, gene_ids)) + "\n"
+    df = gene_query.results_table(database, gene_ids)
+    if df.empty:
+        return ""
+    return ndjson(df[list(RESULT_KEYS)].rename(columns=RESULT_KEYS))
+
+
+def resolve_homologues(database, queries):
+    return records(database.match_homologue_to_Xe_gene(queries), HOMOLOGUE_KEYS)
+
+
+def expression_gene_names(database, genes, arabidopsis):
+    names = list(genes)
+    if arabidopsis:
+        names.extend(gene_name for gene_name, _, _ in database.get_gene_from_arab_homolog(arabidopsis))
+    return list(dict.fromkeys(names))
+
+
+def expression_chunk(database, gene_names):
+    df = database.get_gene_expression_data(gene_names)
+    if df.empty:
+        return ""
+    return ndjson(df)
+
+
+class BaseHandler(tornado.web.RequestHandler):
+
+    def prepare(self):
+        self.body_arguments_json = {}
+        if self.request.method == "POST" and self.request.body:
+            try:
+                self.body_arguments_json = json.loads(self.request.body)
+            except ValueError:
+                raise tornado.web.HTTPError(400, reason="The request body is not valid JSON")
+            if not isinstance(self.body_arguments_json, dict):
+                raise tornado.web.HTTPError(400, reason="The request body must be a JSON object")
+
+    def list_argument(self, name):
+        """
+        A list parameter: a JSON list in a POST body, or repeated and/or comma separated query parameters.
+        """
+        if name in self.body_arguments_json:
+            values = self.body_arguments_json[name]
+            values = [values] if isinstance(values, str) else values
+            return [str(v).strip() for v in values if str(v).strip()]
+        values = [v for argument in self.get_query_arguments(name) for v in argument.split(",")]
+        return list(dict.fromkeys(v.strip() for v in values if v.strip()))
+
+    def value_argument(self, name, default=None):
+        if name in self.body_arguments_json:
+            return self.body_arguments_json[name]
+        return self.get_query_argument(name, default)
+
+    def flag_argument(self, name):
+        value = self.value_argument(name, False)
+        return value is True or str(value).lower() in ("1", "true", "yes")
+
+    def int_argument(self, name, default, maximum):
+        try:
+            value = int(self.value_argument(name, default))
+        except (TypeError, ValueError):
+            raise tornado.web.HTTPError(400, reason=f"{name} must be an integer")
+        if not 1 <= value <= maximum:
+            raise tornado.web.HTTPError(400, reason=f"{name} must be between 1 and {maximum}")
+        return value
+
+    def gene_filters(self):
+        filters = {
+            "species": self.value_argument("species"),
+            "xero_genes": self.list_argument("genes"),
+            "arab_genes": self.list_argument("arabidopsis"),
+            "arab_substring_match": self.flag_argument("substring_match"),
+            "terms": self.list_argument("terms"),
+            "include_child_terms": self.flag_argument("include_child_terms"),
+            "boolean_query_text": self.value_argument("query", "") or "",
+            "motif": self.value_argument("motif", "") or "",
+        }
+        if not (filters["species"] or filters["xero_genes"] or filters["arab_genes"] or filters["terms"]
+                or filters["boolean_query_text"].strip() or filters["motif"].strip()):
+            raise tornado.web.HTTPError(400, reason="No filters given")
+        return filters
+
+    async def run(self, function, *args):
+        """
+        Run function(database, *args) on the worker threads; invalid queries are client errors.
+        """
+        try:
+            return await tornado.ioloop.IOLoop.current().run_in_executor(executor, with_database, function, *args)
+        except (QuerySyntaxError, ValueError) as e:
+            raise tornado.web.HTTPError(400, reason=str(e))
+
+    async def stream(self, content_type, function, chunks, *args):
+        """
+        Write function(database, chunk, *args) for each chunk as soon as it is ready; stop if the client disconnects.
+        """
+        self.set_header("Content-Type", content_type)
+        for chunk in chunks:
+            text = await self.run(function, chunk, *args)
+            if not text:
+                continue
+            self.write(text)
+            try:
+                await self.flush()
+            except StreamClosedError:
+                return
+
+    def write_json(self, text):
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.finish(text)
+
+    def write_error(self, status_code, **kwargs):
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.finish(json.dumps({"error": self._reason, "status": status_code}))
+
+
+class GenesHandler(BaseHandler):
+
+    async def get(self):
+        filters = self.gene_filters()
+        if self.value_argument("format") == "ndjson":
+            gene_ids = await self.run(matching_gene_ids, filters)
+            chunks = [gene_ids[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(gene_ids), STREAM_CHUNK_SIZE)]
+            await self.stream("application/x-ndjson", gene_chunk, chunks, "ndjson")
+            return
+
+        after = decode_cursor(self.value_argument("cursor"))
+        limit = self.int_argument("limit", DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        results, last_id, unmatched_genes = await self.run(gene_page, filters, after, limit)
+        next_cursor = json.dumps(encode_cursor(last_id)) if last_id is not None else "null"
+        # the unmatched inputs are the same on every page, they are reported with the first
+        unmatched = json.dumps(unmatched_genes if not after else [])
+        self.write_json(f'{{"results": {results}, "next_cursor": {next_cursor}, "unmatched_genes": {unmatched}}}')
+
+    post = get
+
+
+class FastaHandler(BaseHandler):
+
+    async def get(self):
+        filters = self.gene_filters()
+        gene_ids = await self.run(matching_gene_ids, filters)
+        chunks = [gene_ids[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(gene_ids), STREAM_CHUNK_SIZE)]
+        await self.stream("text/x-fasta; charset=UTF-8", gene_chunk, chunks, "fasta")
+
+    post = get
+
+
+class HomologuesHandler(BaseHandler):
+
+    async def get(self):
+        queries = self.list_argument("q")
+        if not queries:
+            raise tornado.web.HTTPError(400, reason="No Arabidopsis loci or names given (q)")
+        self.write_json(f'{{"results": {await self.run(resolve_homologues, queries)}}}')
+
+    post = get
+
+
+class ExpressionHandler(BaseHandler):
+
+    async def get(self):
+        genes = self.list_argument("genes")
+        arabidopsis = self.list_argument("arabidopsis")
+        if not (genes or arabidopsis):
+            raise tornado.web.HTTPError(400, reason="No genes or Arabidopsis homologues given")
+        gene_names = await self.run(expression_gene_names, genes, arabidopsis)
+        chunk_size = min(STREAM_CHUNK_SIZE, db.SQL_CHUNK_SIZE)
+        chunks = [gene_names[i:i + chunk_size] for i in range(0, len(gene_names), chunk_size)]
+        await self.stream("application/x-ndjson", expression_chunk, chunks)
+
+    post = get
+
+
+def make_app():
+    return tornado.web.Application([
+        (r"/api/genes", GenesHandler),
+        (r"/api/fasta", FastaHandler),
+        (r"/api/homologues", HomologuesHandler),
+        (r"/api/expression", ExpressionHandler),
+    ])
+
+
+def main():
+    global executor
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--threads", type=int, default=8, help="worker threads running the database queries")
+    parser.add_argument("--database", help=f"SQLite file to serve, default {db.DB.DATABASE_NAME}")
+    parser.add_argument("--wal", action="store_true", help="open the database in write-ahead-log mode (see db.DB.WAL)")
+    args = parser.parse_args()
+
+    # the in-memory indexes (gene names, boolean query) are st.cache_resource loaders, which warn outside the app
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    if args.database:
+        db.DB.DATABASE_NAME = args.database
+    db.DB.WAL = db.DB.WAL or args.wal
+    executor = ThreadPoolExecutor(max_workers=args.threads, thread_name_prefix="api")
+
+    make_app().listen(args.port, args.address)
+    print(f"Serving the API on http://{args.address}:{args.port}/api/")
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == "__main__":
+    main()
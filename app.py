@@ -1,6 +1,21 @@
+import threading
+
 import streamlit as st
 
 
+def prewarm():
+    # imported on this thread, so the first page is not held up by importing pandas and SQLAlchemy either
+    import reference_data
+    reference_data.prewarm()
+
+
+# runs once per server process: load the shared reference data and indexes in the background
+@st.cache_resource(show_spinner=False)
+def start_prewarm():
+    threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
+
+
+
 # entry point app 
 home_page = st.Page("home.py", title="Home") #icon=":material/add_circle:")
 expression_page = st.Page("expression_page.py", title="Expression data",)
@@ -8,7 +23,14 @@ expression_page = st.Page("expression_page.py", title="Expression data",)
 
 # swap out the gene_query_page for the test_page TODO swap the test_page for the gene_query_page at some point
 gene_query_page= st.Page("gene_query_page.py", title="Gene info",)
-pg = st.navigation([home_page,expression_page,gene_query_page])
+pages = [home_page,expression_page,gene_query_page]
+
+# SQL statistics, only listed when the app is opened with ?admin=1
+if "admin" in st.query_params:
+    pages.append(st.Page("admin_page.py", title="SQL statistics", url_path="admin"))
+pg = st.navigation(pages)
 st.set_page_config(page_title="Data explorer",page_icon=":material/edit:",layout="wide")
 
+start_prewarm()
+
 pg.run()
\ No newline at end of file
@@ -0,0 +1,274 @@
+"""
+Command-line batch mode of the Gene info page, for gene lists too large for the app (tens of
+thousands of gene IDs) or whole species.
+
+The same filters as on the page (see gene_query.build_gene_query) are read from files, the matching
+genes are processed in chunks and the annotation table (CSV, TSV or Parquet) and the coding
+sequences (FASTA) are written to disk chunk by chunk, so memory use is bounded by the chunk size
+rather than by the number of results. Which inputs matched nothing is reported on stderr and,
+with --report, per input in a TSV file.
+
+Input files hold one entry per line (or several separated by commas or whitespace, as on the page);
+empty lines and lines starting with # are skipped, and - reads from stdin.
+
+Usage:
+    python batch_query.py --genes gene_ids.txt --output annotations.parquet --fasta cds.fasta
+    python batch_query.py --species "X. elegans" --output x_elegans.tsv
+    python batch_query.py --arabidopsis loci.txt --terms terms.txt --report report.tsv --output results.csv
+"""
+import argparse
+import logging
+import os
+import sys
+
+import pandas as pd
+from sqlalchemy import or_, func
+
+import db
+import gene_query
+from models import Gene, GO, EnzymeCode, InterPro, ArabidopsisHomologue, ArabidopsisSynonym
+
+CHUNK_SIZE = 5000
+
+OUTPUT_FORMATS = {".csv": "csv", ".tsv": "tsv", ".txt": "tsv", ".parquet": "parquet"}
+
+
+def read_inputs(path):
+    """
+    The unique entries of an input file, in file order.
+    """
+    f = sys.stdin if path == "-" else open(path)
+    entries = {}
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            for entry in line.replace(",", " ").split():
+                entries[entry] = None
+    return list(entries)
+
+
+def matching_gene_ids(database, **filters):
+    """
+    Run the page's query for the IDs of the matching genes only, in ID order.
+
+    Returns:
+        tuple: (list of gene IDs, list of gene names without any match)
+    """
+    query, unmatched_genes = gene_query.build_gene_query(database, **filters)
+    gene_ids = [gene_id for (gene_id,) in query.with_entities(Gene.id).order_by(Gene.id)]
+    return gene_ids, unmatched_genes
+
+
+def unmatched_arabidopsis(database, arab_genes, substring_match=False):
+    """
+    The Arabidopsis loci / common names that do not match any homologue.
+    """
+    session = database.session
+    if substring_match:
+        return [a for a in arab_genes if not session.query(
+            session.query(ArabidopsisHomologue).filter(or_(
+                ArabidopsisHomologue.a_thaliana_locus.ilike(f"%{a}%"),
+                ArabidopsisHomologue.a_thaliana_common_name.ilike(f"%{a}%"),
+            )).exists()).scalar()]
+
+    folded = [a.lower() for a in arab_genes]
+    found = set()
+    for i in range(0, len(folded), db.SQL_CHUNK_SIZE):
+        chunk = folded[i:i + db.SQL_CHUNK_SIZE]
+        found.update(locus.lower() for (locus,) in session.query(ArabidopsisHomologue.a_thaliana_locus)
+                     .filter(func.lower(ArabidopsisHomologue.a_thaliana_locus).in_(chunk)))
+        found.update(synonym for (synonym,) in session.query(ArabidopsisSynonym.synonym_folded)
+                     .filter(ArabidopsisSynonym.synonym_folded.in_(chunk)))
+    return [a for a, f in zip(arab_genes, folded) if f not in found]
+
+
+def unmatched_terms(database, terms):
+    """
+    The terms that do not match any GO term, enzyme code or InterPro ID (by ID or name, as on the page).
+    """
+    session = database.session
+    unmatched = []
+    for t in terms:
+        pattern = f"%{t}%"
+        vocabularies = [
+            session.query(GO).filter(GO.go_id.ilike(pattern) | GO.go_name.ilike(pattern)),
+            session.query(EnzymeCode).filter(EnzymeCode.enzyme_code.ilike(pattern) | EnzymeCode.enzyme_name.ilike(pattern)),
+            session.query(InterPro).filter(InterPro.interpro_id.ilike(pattern) | InterPro.interpro_go_name.ilike(pattern)),
+        ]
+        if not any(session.query(q.exists()).scalar() for q in vocabularies):
+            unmatched.append(t)
+    return unmatched
+
+
+class TableWriter():
+    """
+    Writes the results table chunk by chunk as CSV, TSV or Parquet.
+    """
+
+    def __init__(self, path, output_format):
+        self.path = path
+        self.format = output_format
+        self.file = None
+        self.parquet_writer = None
+
+    def write(self, df):
+        df = df.reindex(columns=gene_query.RESULT_COLUMNS)
+        if self.format == "parquet":
+            self._write_parquet(df)
+            return
+        if self.file is None:
+            self.file = open(self.path, "w", newline="")
+            header = True
+        else:
+            header = False
+        df.to_csv(self.file, sep="\t" if self.format == "tsv" else ",", index=False, header=header)
+
+    def _write_parquet(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # a fixed schema, since a column can be all empty in one chunk and filled in the next
+        schema = pa.schema([
+            (column, pa.int64() if column == "Gene ID" else pa.float64() if column == "Annotation e-value" else pa.string())
+            for column in gene_query.RESULT_COLUMNS
+        ])
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(self.path, schema)
+        df = df.astype({"Annotation e-value": "float64"})
+        self.parquet_writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+
+    def close(self):
+        if self.format == "parquet" and self.parquet_writer is None:
+            # no results, still write a file with the columns
+            self._write_parquet(pd.DataFrame(columns=gene_query.RESULT_COLUMNS))
+        elif self.format != "parquet" and self.file is None:
+            self.write(pd.DataFrame(columns=gene_query.RESULT_COLUMNS))
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        if self.file is not None:
+            self.file.close()
+
+
+def run(database, filters, output=None, output_format=None, fasta=None, chunk_size=CHUNK_SIZE, log=sys.stderr):
+    """
+    Write the results of filters (keyword arguments of gene_query.build_gene_query).
+
+    Returns:
+        dict: {"genes": number of matching genes, "unmatched": {input kind: unmatched inputs}}
+    """
+    gene_ids, unmatched_genes = matching_gene_ids(database, **filters)
+    print(f"{len(gene_ids)} genes match", file=log)
+
+    table_writer = TableWriter(output, output_format) if output else None
+    fasta_file = open(fasta, "w") if fasta else None
+    try:
+        for i in range(0, len(gene_ids), chunk_size):
+            chunk = gene_ids[i:i + chunk_size]
+            if table_writer is not None:
+                table_writer.write(gene_query.results_table(database, chunk))
+            if fasta_file is not None:
+                fasta_file.write(gene_query.to_fasta(gene_query.load_genes(database, chunk)) + "\n")
+            # drop the chunk's objects from the session, so memory does not grow with the results
+            database.session.expunge_all()
+            print(f"{min(i + chunk_size, len(gene_ids))} / {len(gene_ids)} genes written", file=log)
+    finally:
+        if table_writer is not None:
+            table_writer.close()
+        if fasta_file is not None:
+            fasta_file.close()
+
+    unmatched = {"gene": unmatched_genes}
+    if filters.get("arab_genes"):
+        unmatched["arabidopsis"] = unmatched_arabidopsis(database, filters["arab_genes"], filters.get("arab_substring_match", False))
+    if filters.get("terms"):
+        unmatched["term"] = unmatched_terms(database, filters["terms"])
+    return {"genes": len(gene_ids), "unmatched": unmatched}
+
+
+def write_report(path, inputs, unmatched):
+    """
+    One line per input: its kind and whether it matched anything in the database.
+    """
+    unmatched = {kind: set(entries) for kind, entries in unmatched.items()}
+    rows = [
+        {"input": entry, "kind": kind, "matched": entry not in unmatched.get(kind, set())}
+        for kind, entries in inputs.items()
+        for entry in entries
+    ]
+    pd.DataFrame(rows, columns=["input", "kind", "matched"]).to_csv(path, sep="\t", index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help=f"SQLite file to query, default {db.DB.DATABASE_NAME}")
+    parser.add_argument("--genes", help="file of Xerophyta gene IDs (wildcards allowed, e.g. Xele.ptg000001l.*)")
+    parser.add_argument("--arabidopsis", help="file of Arabidopsis loci or common names")
+    parser.add_argument("--substring-match", action="store_true", help="match partial Arabidopsis names")
+    parser.add_argument("--terms", help="file of GO terms, enzyme codes or InterPro IDs")
+    parser.add_argument("--include-child-terms", action="store_true", help="also match the descendants of GO IDs")
+    parser.add_argument("--species", help="restrict to one species, e.g. \"X. elegans\"")
+    parser.add_argument("--boolean-query", default="", help="boolean query over the annotation terms")
+    parser.add_argument("--motif", default="", help="nucleotide motif the coding sequence has to contain")
+    parser.add_argument("--output", help="annotation table to write (.csv, .tsv or .parquet)")
+    parser.add_argument("--format", choices=sorted(set(OUTPUT_FORMATS.values())), help="format of --output, by default from its extension")
+    parser.add_argument("--fasta", help="FASTA file of the coding sequences to write")
+    parser.add_argument("--report", help="TSV file listing each input and whether it matched")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="genes processed at a time")
+    args = parser.parse_args()
+
+    if not (args.output or args.fasta or args.report):
+        parser.error("nothing to write, give --output, --fasta and/or --report")
+    output_format = args.format
+    if args.output and output_format is None:
+        output_format = OUTPUT_FORMATS.get(os.path.splitext(args.output)[1].lower())
+        if output_format is None:
+            parser.error(f"cannot tell the format of {args.output}, give --format")
+
+    inputs = {
+        "gene": read_inputs(args.genes) if args.genes else [],
+        "arabidopsis": read_inputs(args.arabidopsis) if args.arabidopsis else [],
+        "term": read_inputs(args.terms) if args.terms else [],
+    }
+    if not any(inputs.values()) and not (args.species or args.boolean_query.strip() or args.motif.strip()):
+        parser.error("no filters given; use --species to export a whole species")
+
+    # the gene name index is cached with st.cache_resource, which warns when used outside the app
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    if args.database:
+        db.DB.DATABASE_NAME = args.database
+    database = db.DB()
+    substring_match = args.substring_match
+    if inputs["arabidopsis"] and not substring_match and not database.has_table(ArabidopsisSynonym):
+        # as on the page, exact name matching needs the synonym table (db_manager.build_arabidopsis_synonyms)
+        print("The Arabidopsis synonyms have not been built, names are matched partially.", file=sys.stderr)
+        substring_match = True
+    filters = {
+        "species": args.species,
+        "xero_genes": inputs["gene"],
+        "arab_genes": inputs["arabidopsis"],
+        "arab_substring_match": substring_match,
+        "terms": inputs["term"],
+        "include_child_terms": args.include_child_terms,
+        "boolean_query_text": args.boolean_query,
+        "motif": args.motif,
+    }
+    try:
+        result = run(database, filters, args.output, output_format, args.fasta, args.chunk_size)
+    finally:
+        database.close()
+
+    for kind, entries in inputs.items():
+        if entries:
+            unmatched = result["unmatched"].get(kind, [])
+            print(f"{kind} inputs: {len(entries) - len(unmatched)} of {len(entries)} matched", file=sys.stderr)
+            if unmatched:
+                preview = ", ".join(unmatched[:10]) + (", ..." if len(unmatched) > 10 else "")
+                print(f"  no match for: {preview}", file=sys.stderr)
+    if args.report:
+        write_report(args.report, inputs, result["unmatched"])
+
+
+if __name__ == "__main__":
+    main()
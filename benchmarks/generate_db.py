@@ -0,0 +1,144 @@
+"""
+Generates a synthetic Xerophyta database for benchmarking, with the schema of models.py and
+roughly the shape of the real data scaled by a factor (1 = about the size of the current database).
+
+Usage:
+    python benchmarks/generate_db.py benchmarks/data/bench_1x.sqlite --scale 1
+"""
+import argparse
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlalchemy as sq
+
+import db
+import db_manager
+import models
+
+SPECIES = [("X. elegans", "Xele"), ("X. humilis", "Xhu"), ("X. schlechteri", "Xsch")]
+
+# sizes at scale 1
+GENES_PER_SPECIES = 25000
+GO_TERMS = 8000
+ENZYME_CODES = 1500
+INTERPRO_IDS = 6000
+ARABIDOPSIS_HOMOLOGUES = 20000
+GENES_PER_CONTIG = 40
+
+# the expression time series of X. elegans: (treatment, time points), 3 replicates each
+EXPRESSION_SAMPLES = [("De", [0, 2, 4, 8, 12, 24, 48, 72]), ("Re", [0, 2, 4, 8, 12, 24, 48, 72])]
+REPLICATES = 3
+
+COMMON_NAMES = ["ABA1", "ZEP", "ABA2", "ABA3", "LOS5", "OXA1", "RD29A", "LTI78", "NPQ2", "LEA", "HSP70", "DREB2A"]
+
+
+def generate(path, scale=1.0, cds_length=1200, seed=0, batch_size=20000, derived=True):
+    """
+    Write a synthetic database to path (replacing it), optionally followed by the derived tables
+    and indexes db_manager builds after an ingest.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    database = db.DB(path)
+    models.Base.metadata.create_all(database.engine)
+    session = database.session
+
+    def insert(model, records):
+        for i in range(0, len(records), batch_size):
+            session.execute(sq.insert(model), records[i:i + batch_size])
+
+    def count(size):
+        return max(1, int(size * scale))
+
+    insert(models.Species, [{"id": i + 1, "name": name} for i, (name, _) in enumerate(SPECIES)])
+    # GO IDs carry the branch prefix of the annotation exports, e.g. "P:GO:0000001"
+    go_branches = [rng.choice("PFC") for _ in range(count(GO_TERMS))]
+    insert(models.GO, [{"id": i + 1, "go_id": f"{branch}:GO:{i + 1:07d}", "go_branch": branch, "go_name": f"biological term {i + 1}"}
+                       for i, branch in enumerate(go_branches)])
+    insert(models.EnzymeCode, [{"id": i + 1, "enzyme_code": f"{i % 7 + 1}.{i % 11 + 1}.{i % 13 + 1}.{i + 1}", "enzyme_name": f"enzyme {i + 1}"}
+                               for i in range(count(ENZYME_CODES))])
+    insert(models.InterPro, [{"id": i + 1, "interpro_id": f"IPR{i + 1:06d}", "interpro_go_name": f"domain {i + 1}"}
+                             for i in range(count(INTERPRO_IDS))])
+    insert(models.ArabidopsisHomologue, [
+        {"id": i + 1,
+         "a_thaliana_locus": f"AT{i % 5 + 1}G{i + 1:05d}",
+         "a_thaliana_common_name": " ".join(rng.sample(COMMON_NAMES, rng.randint(1, 2))) if rng.random() < 0.6 else None}
+        for i in range(count(ARABIDOPSIS_HOMOLOGUES))])
+    session.commit()
+
+    gene_id = annotation_id = 0
+    go_count, enzyme_count, interpro_count = count(GO_TERMS), count(ENZYME_CODES), count(INTERPRO_IDS)
+    homologue_count = count(ARABIDOPSIS_HOMOLOGUES)
+    genes_per_species = count(GENES_PER_SPECIES)
+    for species_id, (_, prefix) in enumerate(SPECIES, start=1):
+        print(f"Generating {genes_per_species} genes of {prefix}")
+        # written per block of genes, so memory stays bounded at any scale
+        for block_start in range(0, genes_per_species, batch_size):
+            genes, annotations, homologue_links = [], [], []
+            go_links, enzyme_links, interpro_links = [], [], []
+            expression = []
+            for i in range(block_start, min(block_start + batch_size, genes_per_species)):
+                gene_id += 1
+                gene_name = f"{prefix}.ptg{i // GENES_PER_CONTIG + 1:06d}l.{i % GENES_PER_CONTIG + 1}"
+                length = max(90, int(rng.gauss(cds_length, cds_length / 3)))
+                genes.append({"id": gene_id, "gene_name": gene_name, "species_id": species_id,
+                              "coding_sequence": "".join(rng.choices("ACGT", k=length))})
+                for homologue_id in rng.sample(range(1, homologue_count + 1), rng.choice([0, 1, 1, 1, 2])):
+                    homologue_links.append({"gene_id": gene_id, "homologue_id": homologue_id})
+
+                if rng.random() < 0.8:
+                    annotation_id += 1
+                    annotations.append({"id": annotation_id, "gene_id": gene_id, "description": f"protein of family {rng.randint(1, 5000)}",
+                                        "e_value": 10 ** -rng.uniform(5, 150)})
+                    go_links += [{"annotation_id": annotation_id, "go_id": t} for t in rng.sample(range(1, go_count + 1), rng.randint(0, 6))]
+                    enzyme_links += [{"annotation_id": annotation_id, "enzyme_code_id": t} for t in rng.sample(range(1, enzyme_count + 1), rng.choice([0, 0, 1]))]
+                    interpro_links += [{"annotation_id": annotation_id, "interpro_id": t} for t in rng.sample(range(1, interpro_count + 1), rng.randint(0, 3))]
+
+                if species_id == 1:
+                    level, phase = rng.uniform(0, 8), rng.uniform(0, 2 * math.pi)
+                    for treatment, times in EXPRESSION_SAMPLES:
+                        for time_point in times:
+                            for replicate in range(1, REPLICATES + 1):
+                                value = max(0.0, level + math.sin(time_point / 12 + phase) + rng.gauss(0, 0.3))
+                                expression.append({
+                                    "id": f"Xe_{treatment}_R{replicate}_T{time_point}_{gene_name}",
+                                    "gene_name": gene_name, "treatment_time": time_point,
+                                    "experiment_time": time_point if treatment == "De" else 72 + time_point,
+                                    "normalised_expression": 2 ** value - 1, "log2_expression": value,
+                                    "species": "Xe", "treatment": treatment, "replicate": replicate})
+
+            insert(models.Gene, genes)
+            insert(models.Annotation, annotations)
+            for table, records in ((models.gene_homologue_association, homologue_links),
+                                   (models.annotations_go, go_links),
+                                   (models.annotations_enzyme_codes, enzyme_links),
+                                   (models.annotations_interpro, interpro_links)):
+                for i in range(0, len(records), batch_size):
+                    session.execute(table.insert(), records[i:i + batch_size])
+            insert(models.Gene_expressions, expression)
+            session.commit()
+    session.close()
+
+    if derived:
+        # the derived tables use the default database of db and db_manager
+        db.DB.DATABASE_NAME = db_manager.DATABASE_NAME = path
+        db_manager.build_arabidopsis_synonyms()
+        db_manager.build_orthogroups()
+        db_manager.build_gene_summary()
+        db_manager.build_kmer_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="SQLite file to write")
+    parser.add_argument("--scale", type=float, default=1.0, help="size relative to the current database")
+    parser.add_argument("--cds-length", type=int, default=1200, help="mean coding sequence length")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-derived", action="store_true", help="skip the summary, synonym, orthogroup and k-mer tables")
+    args = parser.parse_args()
+    generate(args.path, args.scale, args.cds_length, args.seed, derived=not args.no_derived)
@@ -0,0 +1,100 @@
+"""
+Import-time profile of the Streamlit app: for app.py and each page it registers, the module-level
+imports are run in a fresh interpreter with python -X importtime, and the total import time and the
+slowest imported packages are reported.
+
+Pages share one process in the app, so the time of a page is only paid on a cold start if it is the
+first page to import those modules; the "app + page" totals are what a first visit to each page costs.
+
+Usage:
+    python benchmarks/import_profile.py --top 15
+"""
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def module_imports(path):
+    """
+    The modules imported at the top level of a script (imports inside functions are lazy and not counted).
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def app_pages(path):
+    """
+    The page scripts registered with st.Page in app.py.
+    """
+    with open(path) as f:
+        return re.findall(r"st\.Page\(\s*[\"']([\w./]+\.py)[\"']", f.read())
+
+
+def profile_imports(modules):
+    """
+    Import modules in a new interpreter.
+
+    Returns:
+        tuple: (total microseconds, {package: cumulative microseconds} of the packages imported directly
+        by the modules or by the repo's own modules)
+    """
+    code = "; ".join(f"import {module}" for module in modules) or "pass"
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=REPO,
+                             capture_output=True, text=True, check=True)
+    entries = []
+    for line in process.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append((int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+
+    local_modules = {os.path.splitext(name)[0] for name in os.listdir(REPO) if name.endswith(".py")}
+    total = 0
+    packages = {}
+    # -X importtime lists a module after everything it imported, with its nesting depth;
+    # report every top-level package and the packages imported by the repo's modules
+    for i, (cumulative, depth, name) in enumerate(entries):
+        if depth == 0:
+            total += cumulative
+        parent = next((entries[j][2] for j in range(i + 1, len(entries)) if entries[j][1] < depth), None)
+        if depth == 0 or parent in local_modules:
+            top = name.split(".")[0]
+            packages[top] = max(packages.get(top, 0), cumulative)
+    return total, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=10, help="number of packages listed per script")
+    args = parser.parse_args()
+
+    # what the interpreter imports at startup anyway (site, encodings, ...)
+    startup_total, startup_packages = profile_imports([])
+    app_modules = module_imports(os.path.join(REPO, "app.py"))
+    total, packages = profile_imports(app_modules)
+    print(f"app.py: {(total - startup_total) / 1000:.0f} ms")
+
+    for page in app_pages(os.path.join(REPO, "app.py")):
+        modules = module_imports(os.path.join(REPO, page))
+        total, packages = profile_imports(app_modules + modules)
+        print(f"\napp.py + {page}: {(total - startup_total) / 1000:.0f} ms")
+        packages = {name: cumulative for name, cumulative in packages.items() if name not in startup_packages}
+        for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {name:<24} {cumulative / 1000:8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
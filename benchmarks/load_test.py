@@ -0,0 +1,332 @@
+"""
+Load test of the data access layer: N concurrent users (threads or processes) replaying a mix of
+the page queries against one SQLite file, as a single Streamlit server does for many lab members.
+
+Each user repeatedly picks an operation from MIX (gene list searches, Arabidopsis term searches,
+GO term searches and expression data for plots) with inputs drawn from a skewed popularity
+distribution, so some inputs recur across users like they do in practice. Optionally a writer
+holds write transactions at a fixed interval, as an ingest or index rebuild does.
+
+Reported per configuration are the throughput, the latency percentiles and the number of
+"database is locked" errors. The settings under test are
+
+- --pooled: share one engine and connection pool between the DB instances (db.DB.POOLED)
+- --wal: write-ahead-log journal mode (db.DB.WAL)
+- --result-cache: serve repeated inputs from a shared result cache, like the cache_resource
+  loaders of the pages
+
+and --compare runs the baseline, each setting on its own and all of them together.
+
+Usage:
+    python benchmarks/load_test.py --scale 1 --users 16 --duration 30 --writer --compare
+    python benchmarks/load_test.py --database all_xerophyta_species_db.sqlite --users 8 --processes --wal
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from sqlalchemy.exc import OperationalError
+
+import db
+import db_manager
+import expression_data
+import gene_query
+from generate_db import generate
+from run_benchmarks import Fixtures, database_path
+
+# relative frequency of each operation in the replayed traffic
+MIX = {
+    "gene list": 0.35,
+    "arabidopsis terms": 0.2,
+    "GO term search": 0.15,
+    "expression": 0.3,
+}
+
+# entries of the shared result cache (cf. the st.cache_resource loaders of the pages)
+RESULT_CACHE_SIZE = 64
+
+# rows updated per write transaction, and how long the writer keeps the transaction open
+WRITE_ROWS = 2000
+WRITE_HOLD_SECONDS = 0.05
+
+
+def popular(rng, values, k):
+    """
+    k distinct values, favouring those early in the list (Zipf-like), so repeated requests occur.
+    """
+    weights = 1 / np.arange(1, len(values) + 1)
+    chosen = set()
+    while len(chosen) < min(k, len(values)):
+        chosen.update(rng.choices(values, weights=weights, k=k - len(chosen)))
+    return tuple(sorted(chosen))
+
+
+def request(kind, fixtures, rng):
+    """
+    The inputs of one request of kind, as a hashable tuple.
+    """
+    if kind == "gene list":
+        return popular(rng, fixtures.gene_names, rng.choice([5, 20, 100]))
+    if kind == "arabidopsis terms":
+        return popular(rng, fixtures.loci, 3) + popular(rng, fixtures.common_names, 1)
+    if kind == "GO term search":
+        return popular(rng, fixtures.go_ids, 1)
+    return popular(rng, fixtures.elegans_genes, rng.choice([3, 10, 30]))
+
+
+def execute(kind, inputs):
+    """
+    Run one request the way its page does, returning the number of result rows.
+    """
+    if kind == "expression":
+        return len(expression_data.retreive_expression_data(inputs, "Gene_ID"))
+
+    database = db.DB()
+    try:
+        if kind == "gene list":
+            filters = {"xero_genes": inputs}
+        elif kind == "arabidopsis terms":
+            filters = {"arab_genes": inputs}
+        else:
+            filters = {"terms": inputs}
+        gene_ids, _ = gene_query.search_genes(database, **filters)
+        return len(gene_query.results_table(database, gene_ids))
+    finally:
+        database.close()
+
+
+@st.cache_resource(max_entries=RESULT_CACHE_SIZE, show_spinner=False)
+def execute_cached(kind, inputs, db_version):
+    return execute(kind, inputs)
+
+
+def configure(database_name, pooled, wal):
+    db.DB.DATABASE_NAME = db_manager.DATABASE_NAME = database_name
+    db.DB.POOLED = pooled
+    db.DB.WAL = wal
+
+
+def set_journal_mode(database_name, wal):
+    # WAL mode is persistent, so switch back explicitly for the configurations without it
+    connection = sqlite3.connect(database_name)
+    connection.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+    connection.close()
+
+
+def user(user_id, fixtures, settings, start_at, stop_at):
+    """
+    One simulated user, issuing requests back to back between start_at and stop_at.
+
+    Returns:
+        list: (operation, start time, latency in seconds, error) per request
+    """
+    configure(settings["database"], settings["pooled"], settings["wal"])
+    rng = random.Random(settings["seed"] * 1000 + user_id)
+    kinds, weights = list(MIX), list(MIX.values())
+
+    # build the in-memory indexes (gene names, boolean query index) before the clock starts
+    for kind in kinds:
+        execute(kind, request(kind, fixtures, rng))
+    time.sleep(max(0.0, start_at - time.time()))
+
+    results = []
+    while time.time() < stop_at:
+        kind = rng.choices(kinds, weights)[0]
+        inputs = request(kind, fixtures, rng)
+        start = time.perf_counter()
+        error = None
+        try:
+            if settings["result_cache"]:
+                execute_cached(kind, inputs, db.DB.database_version())
+            else:
+                execute(kind, inputs)
+        except OperationalError as e:
+            error = "locked" if "database is locked" in str(e) else "operational"
+        except Exception as e:
+            error = type(e).__name__
+        results.append((kind, time.time(), time.perf_counter() - start, error))
+    return results
+
+
+def writer(settings, stop_event, interval):
+    """
+    Hold a write transaction on the genes table every interval seconds until stop_event is set.
+
+    Returns:
+        tuple: (write transactions committed, writes failed with "database is locked")
+    """
+    connection = sqlite3.connect(settings["database"], timeout=db.DB.BUSY_TIMEOUT, isolation_level=None)
+    max_id = connection.execute("SELECT MAX(id) FROM genes").fetchone()[0]
+    rng = random.Random(settings["seed"])
+    committed = locked = 0
+    while not stop_event.wait(interval):
+        first = rng.randint(1, max(1, max_id - WRITE_ROWS))
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            # rewrite the rows unchanged, which dirties their pages like a real update
+            connection.execute("UPDATE genes SET gene_name = gene_name WHERE id BETWEEN ? AND ?",
+                               (first, first + WRITE_ROWS))
+            time.sleep(WRITE_HOLD_SECONDS)
+            connection.execute("COMMIT")
+            committed += 1
+        except sqlite3.OperationalError as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            if "database is locked" not in str(e):
+                raise
+            locked += 1
+    connection.close()
+    return committed, locked
+
+
+def threaded_users(fixtures, settings, users, start_at, stop_at):
+    """
+    Run all users as threads of one process, sharing its engines and caches like the Streamlit server does.
+    """
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        futures = [executor.submit(user, i, fixtures, settings, start_at, stop_at) for i in range(users)]
+        return [record for future in futures for record in future.result()]
+
+
+def run(fixtures, settings, users, duration, processes=False, writer_interval=None, warmup=15.0):
+    set_journal_mode(settings["database"], settings["wal"])
+    start_at = time.time() + warmup
+    stop_at = start_at + duration
+
+    stop_writer = threading.Event()
+    write_result = [(0, 0)]
+    writer_thread = None
+    if writer_interval:
+        writer_thread = threading.Thread(
+            target=lambda: write_result.__setitem__(0, writer(settings, stop_writer, writer_interval)))
+
+    # the users run in fresh (spawned) processes, so no connections or cached results carry over
+    # from one configuration to the next
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=users if processes else 1, mp_context=context) as executor:
+        if processes:
+            futures = [executor.submit(user, i, fixtures, settings, start_at, stop_at) for i in range(users)]
+        else:
+            futures = [executor.submit(threaded_users, fixtures, settings, users, start_at, stop_at)]
+        if writer_thread is not None:
+            time.sleep(max(0.0, start_at - time.time()))
+            writer_thread.start()
+        results = [record for future in futures for record in future.result()]
+    if writer_thread is not None:
+        stop_writer.set()
+        writer_thread.join()
+
+    df = pd.DataFrame(results, columns=["operation", "time", "latency", "error"])
+    df = df[(df["time"] >= start_at) & (df["time"] <= stop_at)]
+    return summarise(df, duration, write_result[0])
+
+
+def summarise(df, duration, write_result):
+    ok = df[df["error"].isna()]
+    latency_ms = ok["latency"] * 1000
+
+    def percentile(q):
+        return float(np.percentile(latency_ms, q)) if len(latency_ms) else float("nan")
+
+    return {
+        "requests": len(df),
+        "throughput_rps": len(ok) / duration,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": float(latency_ms.max()) if len(latency_ms) else float("nan"),
+        "locked_errors": int((df["error"] == "locked").sum()),
+        "other_errors": int((df["error"].notna() & (df["error"] != "locked")).sum()),
+        "writes": write_result[0],
+        "locked_writes": write_result[1],
+        "per_operation_p95_ms": {
+            operation: float(np.percentile(group["latency"] * 1000, 95))
+            for operation, group in ok.groupby("operation")
+        },
+    }
+
+
+def configurations(args):
+    if not args.compare:
+        return [{"pooled": args.pooled, "wal": args.wal, "result_cache": args.result_cache}]
+    return [
+        {"pooled": False, "wal": False, "result_cache": False},
+        {"pooled": True, "wal": False, "result_cache": False},
+        {"pooled": False, "wal": True, "result_cache": False},
+        {"pooled": False, "wal": False, "result_cache": True},
+        {"pooled": True, "wal": True, "result_cache": True},
+    ]
+
+
+def label(configuration):
+    enabled = [name for name in ("pooled", "wal", "result_cache") if configuration[name]]
+    return "+".join(enabled) or "baseline"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--database", help="SQLite file to test against (it is written to if --writer is given)")
+    target.add_argument("--scale", type=float, default=1, help="generated benchmark database to test against")
+    parser.add_argument("--data-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    parser.add_argument("--users", type=int, nargs="+", default=[8], help="concurrent users, several values for a sweep")
+    parser.add_argument("--processes", action="store_true", help="run the users as processes instead of threads")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds per run")
+    parser.add_argument("--writer", type=float, nargs="?", const=1.0, default=None, metavar="INTERVAL",
+                        help="hold a write transaction every INTERVAL seconds (default 1) during the run")
+    parser.add_argument("--pooled", action="store_true")
+    parser.add_argument("--wal", action="store_true")
+    parser.add_argument("--result-cache", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="compare the baseline with each setting")
+    parser.add_argument("--warmup", type=float, default=15,
+                        help="seconds the users get to build their in-memory indexes before the measurement starts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    database_name = args.database
+    if database_name is None:
+        os.makedirs(args.data_dir, exist_ok=True)
+        database_name = database_path(args.data_dir, args.scale)
+        if not os.path.exists(database_name):
+            print(f"Generating {database_name}")
+            generate(database_name, args.scale)
+
+    configure(database_name, False, False)
+    database = db.DB()
+    fixtures = Fixtures(database, args.seed)
+    database.close()
+    # the samplers are drawn from by every user with its own generator
+    fixtures.rng = None
+
+    results = []
+    for users in args.users:
+        for configuration in configurations(args):
+            settings = {"database": database_name, "seed": args.seed, **configuration}
+            result = run(fixtures, settings, users, args.duration, args.processes, args.writer, args.warmup)
+            result.update({"configuration": label(configuration), "users": users,
+                           "mode": "processes" if args.processes else "threads"})
+            print(f"{label(configuration):<26} {users:>3} users  {result['throughput_rps']:8.1f} req/s  "
+                  f"p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+                  f"locked {result['locked_errors']:>4} (writes {result['writes']}, locked {result['locked_writes']})")
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Benchmarks of the gene query and expression paths against generated databases.
+
+For each scale a database is generated (see generate_db.py) unless it already exists, and every
+scenario is run --iterations times after one warm-up run (which also builds the in-memory
+indexes). Reported are the p50 / p95 latency and the peak Python memory of one extra traced run.
+
+Usage:
+    python benchmarks/run_benchmarks.py --scale 1 --scale 10 --scale 100 --output results.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+import db
+import db_manager
+import expression_data
+import gene_query
+import models
+from generate_db import generate
+
+# the page caches are used outside a Streamlit runtime, which streamlit warns about on every call
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+
+class Fixtures():
+    """
+    Representative inputs sampled once from a database.
+    """
+
+    def __init__(self, database, seed=0):
+        rng = random.Random(seed)
+        session = database.session
+        gene_names = [name for (name,) in session.query(models.Gene.gene_name)]
+        self.gene_names = rng.sample(gene_names, min(2000, len(gene_names)))
+        self.elegans_genes = [name for name in self.gene_names if name.startswith("Xele")]
+        homologues = session.query(models.ArabidopsisHomologue.a_thaliana_locus,
+                                   models.ArabidopsisHomologue.a_thaliana_common_name).all()
+        homologues = rng.sample(homologues, min(2000, len(homologues)))
+        self.loci = [locus for locus, _ in homologues]
+        self.common_names = sorted({name for _, names in homologues for name in db.split_common_names(names)})
+        # without the branch prefix, as users enter them
+        self.go_ids = [go_id for (go_id,) in session.query(db.bare_go_id(models.GO.go_id)).limit(2000)]
+        self.interpro_ids = [ipr for (ipr,) in session.query(models.InterPro.interpro_id).limit(2000)]
+        self.rng = rng
+
+    def sample(self, values, k):
+        return self.rng.sample(values, min(k, len(values)))
+
+
+def gene_page_search(database, fixtures, export=True, **filters):
+    """
+    One search as on the Gene info page: query, results table and the CSV / FASTA downloads.
+    """
+    gene_ids, _ = gene_query.search_genes(database, **filters)
+    df = gene_query.results_table(database, gene_ids)
+    if export:
+        gene_query.to_csv(df)
+        gene_query.to_fasta(gene_query.load_genes(database, gene_ids))
+    return len(gene_ids)
+
+
+SCENARIOS = {
+    "gene list (50)": lambda database, f: gene_page_search(database, f, xero_genes=f.sample(f.gene_names, 50)),
+    "gene list (1000)": lambda database, f: gene_page_search(database, f, xero_genes=f.sample(f.gene_names, 1000)),
+    "gene wildcard": lambda database, f: gene_page_search(database, f, xero_genes=[f.sample(f.gene_names, 1)[0].rsplit(".", 1)[0] + ".*"]),
+    "arabidopsis loci (20)": lambda database, f: gene_page_search(database, f, arab_genes=f.sample(f.loci, 20)),
+    "arabidopsis names (5)": lambda database, f: gene_page_search(database, f, arab_genes=f.sample(f.common_names, 5)),
+    "arabidopsis names, substring (2)": lambda database, f: gene_page_search(database, f, arab_genes=f.sample(f.common_names, 2),
+                                                                             arab_substring_match=True),
+    "GO term search (1)": lambda database, f: gene_page_search(database, f, terms=f.sample(f.go_ids, 1)),
+    "InterPro + species": lambda database, f: gene_page_search(database, f, terms=f.sample(f.interpro_ids, 1), species="X. elegans"),
+    "boolean query": lambda database, f: gene_page_search(
+        database, f, boolean_query_text=" OR ".join(f"go:{go_id}" for go_id in f.sample(f.go_ids, 3)) + ' AND NOT species:"X. humilis"'),
+    "homologue matching (20)": lambda database, f: len(database.match_homologue_to_Xe_gene(f.sample(f.loci, 10) + f.sample(f.common_names, 10))),
+    "expression by gene (20)": lambda database, f: len(expression_data.retreive_expression_data(f.sample(f.elegans_genes, 20), "Gene_ID")),
+    "expression by homologue (10)": lambda database, f: len(expression_data.retreive_expression_data(f.sample(f.loci, 10), "Arab_homolog")),
+}
+
+
+def run_scenario(scenario, database, fixtures, iterations):
+    scenario(database, fixtures)  # warm-up
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        scenario(database, fixtures)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    scenario(database, fixtures)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "peak_memory_mb": peak / 2 ** 20,
+    }
+
+
+def database_path(data_dir, scale):
+    return os.path.join(data_dir, f"bench_{scale:g}x.sqlite")
+
+
+def main(scales, iterations, data_dir, scenario_names=None, output=None):
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+    for scale in scales:
+        path = database_path(data_dir, scale)
+        if not os.path.exists(path):
+            print(f"Generating {path}")
+            generate(path, scale)
+        # the page modules and their caches use the default database
+        db.DB.DATABASE_NAME = db_manager.DATABASE_NAME = path
+
+        database = db.DB()
+        fixtures = Fixtures(database)
+        for name, scenario in SCENARIOS.items():
+            if scenario_names and name not in scenario_names:
+                continue
+            result = {"scale": scale, "scenario": name, **run_scenario(scenario, database, fixtures, iterations)}
+            print(f"{scale:>6g}x  {name:<34} p50 {result['p50_ms']:9.1f} ms  p95 {result['p95_ms']:9.1f} ms  "
+                  f"peak {result['peak_memory_mb']:8.1f} MB")
+            results.append(result)
+            # keep the identity map from growing across scenarios
+            database.session.expunge_all()
+        database.session.close()
+
+    df = pd.DataFrame(results)
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, action="append", help="database scale(s) to run, default 1, 10 and 100")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--data-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"),
+                        help="where the generated databases are kept")
+    parser.add_argument("--scenario", action="append", help=f"run only these scenarios: {', '.join(SCENARIOS)}")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    main(args.scale or [1, 10, 100], args.iterations, args.data_dir, args.scenario, args.output)
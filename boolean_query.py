@@ -0,0 +1,229 @@
+"""
+A small boolean query language over the gene annotations, e.g.
+
+    go:GO:0009414 AND ipr:IPR000719 NOT species:"X. humilis"
+    (at:ABA1 OR at:AT5G67030) AND ec:1.14.*
+
+Supported are AND, OR, NOT (prefix, or infix meaning AND NOT), parentheses, implicit AND between
+adjacent terms and the field prefixes go:, ipr:, ec:, at: and species:. Values may be quoted and
+may contain * and ? wildcards. Bare GO:... and IPR... identifiers do not need a prefix.
+
+Queries are evaluated against per-term posting lists (sorted arrays of gene positions, i.e.
+compressed bitmaps) precomputed from the association tables. Each term is expanded into a gene
+bitmap and the whole expression is resolved with bitwise operations, so only the resulting gene
+IDs ever reach SQL.
+"""
+import fnmatch
+import re
+
+import numpy as np
+import streamlit as st
+
+import db
+
+FIELDS = ["go", "ipr", "ec", "at", "species"]
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|([A-Za-z_]+:"[^"]*")|("[^"]*")|([^\s()]+))')
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+def tokenize(text):
+    """
+    Split a query into tokens: "(", ")", ("op", "AND"|"OR"|"NOT") and ("term", field, value).
+    """
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if not match or match.end() == position:
+            raise QuerySyntaxError(f"Unexpected character at position {position}: {text[position:]}")
+        position = match.end()
+        open_paren, close_paren, quoted_field, quoted, word = match.groups()
+
+        if open_paren:
+            tokens.append("(")
+        elif close_paren:
+            tokens.append(")")
+        elif quoted_field:
+            field, value = quoted_field.split(":", 1)
+            tokens.append(make_term(field, value.strip('"')))
+        elif quoted:
+            raise QuerySyntaxError(f"Quoted value {quoted} needs a field prefix, e.g. species:{quoted}")
+        elif word.upper() in ("AND", "OR", "NOT"):
+            tokens.append(("op", word.upper()))
+        else:
+            tokens.append(parse_term(word))
+    return tokens
+
+
+def parse_term(word):
+    """
+    Turn a bare word into a ("term", field, value) token, inferring the field of unprefixed GO and InterPro IDs.
+    """
+    if ":" in word:
+        field, value = word.split(":", 1)
+        if field.lower() in FIELDS:
+            return make_term(field, value)
+    if re.match(r"^IPR\d+$", word, re.IGNORECASE):
+        return make_term("ipr", word)
+    raise QuerySyntaxError(f"Unknown term {word}, use one of the prefixes {', '.join(f + ':' for f in FIELDS)}")
+
+
+def make_term(field, value):
+    field = field.lower()
+    if field not in FIELDS:
+        raise QuerySyntaxError(f"Unknown field {field}:, expected one of {', '.join(f + ':' for f in FIELDS)}")
+    if not value:
+        raise QuerySyntaxError(f"Missing value after {field}:")
+    value = value.lower()
+    # "GO:0009414" is read as field go with value 0009414
+    if field == "go" and not value.startswith("go:"):
+        value = f"go:{value}"
+    return ("term", field, value)
+
+
+class Parser():
+    """
+    Recursive descent parser producing a nested tuple tree:
+    ("or", a, b), ("and", a, b), ("not", a) and ("term", field, value).
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QuerySyntaxError("Empty query")
+        tree = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError(f"Unexpected {format_token(self.peek())}")
+        return tree
+
+    def parse_or(self):
+        tree = self.parse_and()
+        while self.peek() == ("op", "OR"):
+            self.next()
+            tree = ("or", tree, self.parse_and())
+        return tree
+
+    def parse_and(self):
+        tree = self.parse_unary()
+        while True:
+            token = self.peek()
+            if token == ("op", "AND"):
+                self.next()
+            # "a NOT b" and "a b" both mean AND; NOT itself is handled by parse_unary
+            elif not (token == ("op", "NOT") or token == "(" or (isinstance(token, tuple) and token[0] == "term")):
+                return tree
+            tree = ("and", tree, self.parse_unary())
+
+    def parse_unary(self):
+        token = self.next()
+        if token == ("op", "NOT"):
+            return ("not", self.parse_unary())
+        if token == "(":
+            tree = self.parse_or()
+            if self.next() != ")":
+                raise QuerySyntaxError("Missing closing parenthesis")
+            return tree
+        if isinstance(token, tuple) and token[0] == "term":
+            return token
+        if token is None:
+            raise QuerySyntaxError("Query ends unexpectedly")
+        raise QuerySyntaxError(f"Unexpected {format_token(token)}")
+
+
+def format_token(token):
+    if isinstance(token, tuple):
+        return token[1] if token[0] == "op" else f"{token[1]}:{token[2]}"
+    return token
+
+
+def parse(text):
+    return Parser(tokenize(text)).parse()
+
+
+class TermBitmapIndex():
+
+    def __init__(self, gene_ids, postings):
+        """
+        Parameters:
+            gene_ids: sorted database IDs of all genes; a gene's position in this array is its bit
+            postings: field -> {lower-case term -> sorted np.uint32 array of gene positions}
+        """
+        self.gene_ids = np.asarray(gene_ids)
+        self.postings = postings
+
+    @classmethod
+    def from_pairs(cls, gene_ids, pairs):
+        """
+        Build the index from all gene IDs and, per field, an iterable of (gene_id, term) pairs.
+        """
+        gene_ids = np.unique(np.asarray(gene_ids, dtype=np.int64))
+        postings = {}
+        for field, field_pairs in pairs.items():
+            by_term = {}
+            for gene_id, term in field_pairs:
+                by_term.setdefault(term.lower(), []).append(gene_id)
+            postings[field] = {
+                term: np.unique(np.searchsorted(gene_ids, ids)).astype(np.uint32)
+                for term, ids in by_term.items()
+            }
+        return cls(gene_ids, postings)
+
+    def term_bitmap(self, field, value):
+        bitmap = np.zeros(len(self.gene_ids), dtype=bool)
+        field_postings = self.postings.get(field, {})
+        if any(character in value for character in "*?["):
+            matcher = re.compile(fnmatch.translate(value))
+            for term, positions in field_postings.items():
+                if matcher.match(term):
+                    bitmap[positions] = True
+        elif value in field_postings:
+            bitmap[field_postings[value]] = True
+        return bitmap
+
+    def evaluate_tree(self, tree):
+        kind = tree[0]
+        if kind == "term":
+            return self.term_bitmap(tree[1], tree[2])
+        if kind == "not":
+            return ~self.evaluate_tree(tree[1])
+        if kind == "and":
+            return self.evaluate_tree(tree[1]) & self.evaluate_tree(tree[2])
+        return self.evaluate_tree(tree[1]) | self.evaluate_tree(tree[2])
+
+    def evaluate(self, text):
+        """
+        Evaluate a query string.
+
+        Returns:
+            numpy.ndarray: the database IDs of the matching genes.
+        """
+        return self.gene_ids[self.evaluate_tree(parse(text))]
+
+
+@st.cache_resource(max_entries=1, show_spinner="Preparing boolean query index...")
+def load_term_bitmap_index(db_version):
+    database = db.DB()
+    gene_ids = [gene_id for (gene_id,) in database.session.query(db.models.Gene.id)]
+    pairs = {field: database.get_gene_term_pairs(field) for field in FIELDS}
+    database.session.close()
+    return TermBitmapIndex.from_pairs(gene_ids, pairs)
+
+
+def get_term_bitmap_index():
+    return load_term_bitmap_index(db.DB.database_version())
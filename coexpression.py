@@ -0,0 +1,92 @@
+"""
+Genome-wide co-expression search over the expression time series.
+
+The expression values of every gene are pivoted into a genes x samples matrix which is normalised
+once (centred and scaled to unit length, after ranking for Spearman), so the correlation of one
+gene with all the others is a single float32 matrix-vector product.
+"""
+import numpy as np
+import pandas as pd
+
+METHODS = ["pearson", "spearman"]
+
+# columns identifying one RNA-seq sample in the long-format expression table
+SAMPLE_COLUMNS = ["treatment", "treatment_time", "replicate"]
+
+
+class CoexpressionIndex():
+
+    def __init__(self, gene_names, matrix, method):
+        """
+        Parameters:
+            gene_names: gene names, one per row of matrix
+            matrix: genes x samples array of normalised expression profiles (see normalise_profiles)
+            method: the correlation the matrix was normalised for ("pearson" or "spearman")
+        """
+        self.gene_names = np.asarray(gene_names)
+        self.matrix = matrix
+        self.method = method
+        self.positions = {name: i for i, name in enumerate(self.gene_names)}
+
+    @classmethod
+    def from_expression_data(cls, data, expression_values="log2_expression", method="pearson"):
+        """
+        Build the index from a long-format expression DataFrame (one row per gene and sample).
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown correlation method {method}, expected one of {METHODS}")
+
+        profiles = data.pivot_table(index="gene_name", columns=SAMPLE_COLUMNS,
+                                    values=expression_values, aggfunc="mean")
+        values = profiles.to_numpy(dtype=np.float64)
+
+        # a sample missing for a gene contributes nothing to its correlations
+        row_means = np.nanmean(values, axis=1, keepdims=True)
+        values = np.where(np.isnan(values), row_means, values)
+
+        if method == "spearman":
+            values = pd.DataFrame(values).rank(axis=1).to_numpy(dtype=np.float64)
+
+        return cls(profiles.index, normalise_profiles(values), method)
+
+    def __len__(self):
+        return len(self.gene_names)
+
+    def __contains__(self, gene_name):
+        return gene_name in self.positions
+
+    def top_k(self, gene_name, k=25):
+        """
+        Return the k genes whose profiles correlate most strongly (positively) with gene_name.
+
+        Returns:
+            pandas.DataFrame: columns "Gene Name" and "Correlation", sorted by decreasing correlation.
+        """
+        position = self.positions[gene_name]
+        correlations = self.matrix @ self.matrix[position]
+        # the query gene always correlates perfectly with itself
+        correlations[position] = -np.inf
+
+        k = min(k, len(self) - 1)
+        if k <= 0:
+            return pd.DataFrame({"Gene Name": pd.Series(dtype="string"),
+                                 "Correlation": pd.Series(dtype=np.float32)})
+
+        top = np.argpartition(correlations, -k)[-k:]
+        top = top[np.argsort(correlations[top])[::-1]]
+
+        return pd.DataFrame({
+            "Gene Name": pd.Series(self.gene_names[top], dtype="string"),
+            "Correlation": correlations[top],
+        })
+
+
+def normalise_profiles(values):
+    """
+    Centre each row and scale it to unit length, so the dot product of two rows is their Pearson correlation.
+    Rows without any variation are set to zero (they correlate with nothing).
+    """
+    centred = values - values.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centred, axis=1, keepdims=True)
+    norms[norms == 0] = np.inf
+    return (centred / norms).astype(np.float32)
@@ -1,24 +1,126 @@
+import os
+import re
+import threading
 import sqlalchemy as sq
 from sqlalchemy.orm import sessionmaker
 import models as models
+import query_stats
 import pandas as pd
-from sqlalchemy.orm import joinedload
-from sqlalchemy import or_, func
+from sqlalchemy.orm import joinedload, aliased
+from sqlalchemy import or_, func, event
 from sqlalchemy.exc import SQLAlchemyError
 
+# Arabidopsis gene identifiers, e.g. AT1G01010 (nuclear), ATCG00020 (chloroplast), ATMG00010 (mitochondrial)
+AT_LOCUS_PATTERN = re.compile(r"^AT[1-5CM]G\d{5}$", re.IGNORECASE)
+
+# maximum number of values bound into a single IN (...) clause
+SQL_CHUNK_SIZE = 900
+
+# engines shared by the DB instances of this process when DB.POOLED is set, by (file, WAL, busy timeout)
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def split_common_names(common_names):
+    """
+    Splits the free-text a_thaliana_common_name field (e.g. "ABA1 ZEP, NPQ2") into the individual names.
+    """
+    if not common_names:
+        return []
+    return [name for name in re.split(r"[\s,;]+", common_names) if name]
+
+
+def bare_go_id(column):
+    """
+    SQL expression of a GO ID without the branch prefix of the annotation exports, which store e.g.
+    "P:GO:0008150" while the ontology tables use "GO:0008150". IDs without a prefix are returned unchanged.
+    """
+    return func.substr(column, func.instr(column, "GO:"))
+
+
+def create_engine(database_name, wal=False, busy_timeout=5.0, **pool_options):
+    """
+    Engine for a SQLite file; statements are timed and counted for the admin page (see query_stats).
+    """
+    engine = sq.create_engine(f"sqlite:///{database_name}", echo = False,
+                              connect_args={"factory": query_stats.CountingConnection, "timeout": busy_timeout},
+                              **pool_options)
+    if wal:
+        event.listen(engine, "connect", _enable_wal)
+    return query_stats.instrument(engine)
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # the journal mode is stored in the file, this only writes to it the first time
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # in WAL mode syncing on checkpoints only is still safe against corruption
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 
 class DB():
 
     # DATABASE_NAME = "test_db.sqlite"
     DATABASE_NAME = "all_xerophyta_species_db.sqlite"
-    def __init__(self) -> None:
-        
-        self.engine = sq.create_engine(f"sqlite:///{self.DATABASE_NAME}", echo = False)
-        self.conn = self.engine.connect()
+
+    # Share one engine, and so one connection pool, between all DB instances of the process instead
+    # of opening a new engine (and SQLite connection) for every instance, i.e. on every page rerun.
+    POOLED = os.environ.get("XEROPHYTA_DB_POOLED", "0") == "1"
+    # Put the database into write-ahead-log mode, in which readers are not blocked by a writer
+    # (e.g. an ingest running while the app is served).
+    WAL = os.environ.get("XEROPHYTA_DB_WAL", "0") == "1"
+    # seconds a statement waits for a lock held by another connection before failing with "database is locked"
+    BUSY_TIMEOUT = 5.0
+    # idle connections kept by a shared engine; more are opened (and closed again) under load
+    POOL_SIZE = 16
+
+    def __init__(self, database_name=None, pooled=None, wal=None) -> None:
+        """
+        Parameters:
+            database_name: path of the SQLite file to open, DATABASE_NAME by default
+            pooled, wal: override POOLED and WAL for this instance
+        """
+        self.database_name = database_name or self.DATABASE_NAME
+        self.pooled = self.POOLED if pooled is None else pooled
+        wal = self.WAL if wal is None else wal
+
+        if self.pooled:
+            key = (os.path.abspath(self.database_name), wal, self.BUSY_TIMEOUT)
+            with _engines_lock:
+                if key not in _engines:
+                    _engines[key] = create_engine(self.database_name, wal, self.BUSY_TIMEOUT,
+                                                  pool_size=self.POOL_SIZE, max_overflow=-1)
+                self.engine = _engines[key]
+        else:
+            self.engine = create_engine(self.database_name, wal, self.BUSY_TIMEOUT)
 
         Session = sessionmaker(bind=self.engine)
         self.session = Session()
 
+    def close(self):
+        """
+        Return the connection to the pool, or close the engine if it is not shared.
+        """
+        self.session.close()
+        if not self.pooled:
+            self.engine.dispose()
+
+    @classmethod
+    def database_version(cls):
+        """
+        Returns a token that changes whenever the database file is rewritten (e.g. after an ingest).
+
+        Used as part of the key for the shared caches in the pages, so cached results are
+        invalidated when the underlying data changes.
+        """
+        version = []
+        for path in (cls.DATABASE_NAME, f"{cls.DATABASE_NAME}-wal"):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                version.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(version)
+
     def add_species(self, name):
         species = self.session.query(models.Species).filter_by(name=name).first()
         if not species:
@@ -193,63 +295,374 @@ class DB():
         df = pd.DataFrame(data)
         return df
 
-    def get_gene_from_arab_homolog(self, At_list):
-        
-        result =(self.session.query(models.Gene_info.gene_name, models.Arabidopsis_Homologue.at_locus, models.At_Common_Names.name)
-            .join(models.Gene_info.homologues)  # Join Gene_info with Arabidopsis_Homologue using the relationship
-            .join(models.Arabidopsis_Homologue.common_names)  # Join Arabidopsis_Homologue with At_Common_Names
-            .filter(
-                or_(
-                    func.lower(models.Arabidopsis_Homologue.at_locus).in_([x.lower() for x in At_list]),  # Case-insensitive for homologues
-                    func.lower(models.At_Common_Names.name).in_([x.lower() for x in At_list])  # Case-insensitive for common names
-                )
-            )
+    def get_expression_table(self, expression_values="log2_expression"):
+        """
+        Retrieve one expression column for every gene and sample, e.g. to build genome-wide matrices.
+
+        Parameters:
+            expression_values (str): "log2_expression" or "normalised_expression".
+
+        Returns:
+            pandas.DataFrame: columns gene_name, treatment, treatment_time, replicate and expression_values.
+        """
+        expression = models.Gene_expressions
+        query = self.session.query(
+            expression.gene_name,
+            expression.treatment,
+            expression.treatment_time,
+            expression.replicate,
+            getattr(expression, expression_values).label(expression_values),
+        )
+        return pd.read_sql(query.statement, self.session.connection())
+
+    def has_table(self, model):
+        """
+        Check whether the table of an optional model exists, i.e. whether its data has been loaded by db_manager.
+        """
+        return sq.inspect(self.engine).has_table(model.__tablename__)
+
+    def get_de_contrasts(self, dataset):
+        """
+        Retrieve the contrasts with differential expression results for a dataset.
+        """
+        # the table only exists once results have been loaded (db_manager.add_differential_expression)
+        if not self.has_table(models.DifferentialExpression):
+            return []
+
+        results = (self.session.query(models.DifferentialExpression.contrast)
+            .filter(models.DifferentialExpression.dataset == dataset)
+            .distinct()
+            .order_by(models.DifferentialExpression.contrast)
             .all()
         )
-        return result 
-    
-    def match_homologue_to_Xe_gene(self, At_list):
-       
+        return [contrast for (contrast,) in results]
 
-        # Get the hits from the database
-        hits = self.get_gene_from_arab_homolog(At_list)
+    def get_differentially_expressed_genes(self, dataset, contrast, padj_threshold=0.05, log2fc_threshold=1, direction=None):
+        """
+        Retrieve the genes passing a differential expression threshold, e.g. padj < 0.05 and |log2FC| > 1.
 
-        
-        
-        # # Prepare the results DataFrame
-        results = []
-        for hit in hits:
-            xele_gene, at_gene, common_name = hit
-            # Here we assume that 'at_gene' or 'common_name' is one of the original queries
-            if at_gene.lower() in [x.lower() for x in At_list]:
-                query = at_gene
+        The thresholds are applied in SQL as range conditions, which SQLite answers with a range scan
+        over the (dataset, contrast, padj, ...) or (dataset, contrast, log2_fold_change, ...) index.
+
+        Parameters:
+            dataset (str): the dataset the results belong to.
+            contrast (str): the contrast to filter on.
+            padj_threshold (float): maximum adjusted p-value (exclusive).
+            log2fc_threshold (float): minimum absolute log2 fold change (exclusive).
+            direction (str): "up", "down" or None for both.
+
+        Returns:
+            set: gene names.
+        """
+        de = models.DifferentialExpression
+        query = (self.session.query(de.gene_name)
+            .filter(de.dataset == dataset, de.contrast == contrast, de.padj < padj_threshold)
+        )
+
+        if direction == "up":
+            query = query.filter(de.log2_fold_change > log2fc_threshold)
+        elif direction == "down":
+            query = query.filter(de.log2_fold_change < -log2fc_threshold)
+        else:
+            query = query.filter(or_(de.log2_fold_change > log2fc_threshold,
+                                     de.log2_fold_change < -log2fc_threshold))
+
+        return {gene_name for (gene_name,) in query}
+
+    def go_subtree_query(self, go_ids):
+        """
+        Build a subquery selecting the given GO IDs and all of their descendant terms from the GO closure table.
+
+        The closure holds unprefixed IDs, so compare it with bare_go_id of the annotations' GO IDs, e.g.
+        bare_go_id(models.GO.go_id).in_(database.go_subtree_query(["GO:0009414"])).
+        """
+        closure = models.GOClosure
+        return (sq.select(closure.descendant_id)
+            .where(closure.ancestor_id.in_([go_id.upper() for go_id in go_ids]))
+        )
+
+    def get_term_associations(self, vocabulary, species_id):
+        """
+        Retrieve the distinct gene-term associations of one species, e.g. to build an enrichment background.
+
+        For "GO", annotations are propagated to all ancestor terms through the GO closure table when
+        the ontology has been loaded (a gene annotated with a term is also annotated with its parents).
+
+        Parameters:
+            vocabulary (str): "GO" or "InterPro".
+            species_id (int): the species to retrieve associations for.
+
+        Returns:
+            pandas.DataFrame: columns gene_id, term and name.
+        """
+        annotation = models.Annotation
+        if vocabulary == "GO":
+            if self.has_table(models.GOClosure):
+                closure, term = models.GOClosure, models.GOTerm
+                query = (sq.select(annotation.gene_id, closure.ancestor_id.label("term"), term.name.label("name"))
+                    .join(models.annotations_go, models.annotations_go.c.annotation_id == annotation.id)
+                    .join(models.GO, models.GO.id == models.annotations_go.c.go_id)
+                    .join(closure, closure.descendant_id == bare_go_id(models.GO.go_id))
+                    .join(term, term.go_id == closure.ancestor_id)
+                )
             else:
-                query = common_name
-
-            results.append({
-                'Query': query,  # Add the matching query here for alignment
-                'X. elegans gene': xele_gene,
-                'At_Gene': at_gene,
-                'Common_name': common_name
-            })
-        
-        for gene in At_list:
+                query = (sq.select(annotation.gene_id, bare_go_id(models.GO.go_id).label("term"), models.GO.go_name.label("name"))
+                    .join(models.annotations_go, models.annotations_go.c.annotation_id == annotation.id)
+                    .join(models.GO, models.GO.id == models.annotations_go.c.go_id)
+                )
+        elif vocabulary == "InterPro":
+            query = (sq.select(annotation.gene_id, models.InterPro.interpro_id.label("term"),
+                               models.InterPro.interpro_go_name.label("name"))
+                .join(models.annotations_interpro, models.annotations_interpro.c.annotation_id == annotation.id)
+                .join(models.InterPro, models.InterPro.id == models.annotations_interpro.c.interpro_id)
+            )
+        else:
+            raise ValueError(f"Unknown vocabulary {vocabulary}")
+
+        query = (query
+            .join(models.Gene, models.Gene.id == annotation.gene_id)
+            .where(models.Gene.species_id == species_id)
+            .distinct()
+        )
+        return pd.read_sql(query, self.session.connection())
+
+    def get_gene_term_pairs(self, field):
+        """
+        Retrieve all (gene_id, term) pairs of one searchable field, e.g. to build term -> gene posting lists.
+
+        Parameters:
+            field (str): "go" (GO IDs), "ipr" (InterPro IDs), "ec" (enzyme codes),
+                "at" (Arabidopsis loci and common names) or "species" (full name and species epithet).
+
+        Returns:
+            list: (gene_id, term) tuples.
+        """
+        annotation = models.Annotation
+        if field == "go":
+            # queried as go:GO:0009414, without the annotations' branch prefix
+            query = (sq.select(annotation.gene_id, bare_go_id(models.GO.go_id))
+                .join(models.annotations_go, models.annotations_go.c.annotation_id == annotation.id)
+                .join(models.GO, models.GO.id == models.annotations_go.c.go_id)
+            )
+        elif field == "ipr":
+            query = (sq.select(annotation.gene_id, models.InterPro.interpro_id)
+                .join(models.annotations_interpro, models.annotations_interpro.c.annotation_id == annotation.id)
+                .join(models.InterPro, models.InterPro.id == models.annotations_interpro.c.interpro_id)
+            )
+        elif field == "ec":
+            query = (sq.select(annotation.gene_id, models.EnzymeCode.enzyme_code)
+                .join(models.annotations_enzyme_codes, models.annotations_enzyme_codes.c.annotation_id == annotation.id)
+                .join(models.EnzymeCode, models.EnzymeCode.id == models.annotations_enzyme_codes.c.enzyme_code_id)
+            )
+        elif field == "at":
+            homologue = models.ArabidopsisHomologue
+            query = (sq.select(models.gene_homologue_association.c.gene_id,
+                               homologue.a_thaliana_locus, homologue.a_thaliana_common_name)
+                .join(homologue, homologue.id == models.gene_homologue_association.c.homologue_id)
+            )
+            pairs = []
+            for gene_id, locus, common_names in self.session.execute(query):
+                for term in [locus] + split_common_names(common_names):
+                    if term:
+                        pairs.append((gene_id, term))
+            return pairs
+        elif field == "species":
+            query = sq.select(models.Gene.id, models.Species.name).join(models.Species)
+            pairs = []
+            for gene_id, name in self.session.execute(query):
+                pairs.append((gene_id, name))
+                # "X. humilis" can also be searched as "humilis"
+                pairs.append((gene_id, name.split()[-1]))
+            return pairs
+        else:
+            raise ValueError(f"Unknown field {field}")
+
+        return [tuple(row) for row in self.session.execute(query.distinct()) if row[1]]
+
+    def get_orthologues(self, gene_ids, other_species_only=True):
+        """
+        Retrieve the genes sharing an orthogroup (Arabidopsis homologue) with each of the given genes,
+        from the materialized orthogroup tables.
 
-                    # Search for the string in all values in each dictionary
-            matches = [item for item in results if any(gene.lower() in str(value).lower() for value in item.values())]
+        Returns:
+            dict: gene ID -> sorted list of the names of its orthologues (genes without any are omitted,
+            and the result is empty if the orthogroups have not been built).
+        """
+        if not self.has_table(models.OrthogroupMember):
+            return {}
+
+        query_member = aliased(models.OrthogroupMember)
+        orthologue_member = aliased(models.OrthogroupMember)
+        orthologues = {}
+        gene_ids = list(gene_ids)
+        for i in range(0, len(gene_ids), SQL_CHUNK_SIZE):
+            query = (self.session.query(query_member.gene_id, models.Gene.gene_name)
+                .join(orthologue_member, orthologue_member.orthogroup_id == query_member.orthogroup_id)
+                .join(models.Gene, models.Gene.id == orthologue_member.gene_id)
+                .filter(query_member.gene_id.in_(gene_ids[i:i + SQL_CHUNK_SIZE]))
+                .filter(orthologue_member.gene_id != query_member.gene_id)
+            )
+            if other_species_only:
+                query = query.filter(orthologue_member.species_id != query_member.species_id)
+            for gene_id, gene_name in query:
+                orthologues.setdefault(gene_id, set()).add(gene_name)
 
-            # Check if there are no matches
-            if not matches:
-                results.append({
-                'Query': gene,  # Add the matching query here for alignment
-                'X. elegans gene': '',
-                'At_Gene': '',
-                'Common_name': ''
-            })            
-                
+        return {gene_id: sorted(names) for gene_id, names in orthologues.items()}
 
-        results_df = pd.DataFrame(results)
+    def get_uniprot_accessions(self, accessions):
+        """
+        Look up protein accessions (UniProt, or RefSeq without version) in the imported UniProt idmapping.
 
+        Returns:
+            dict: accession -> (TAIR locus, gene name, UniProt accession) for the accessions found,
+            empty if the idmapping has not been imported
+        """
+        if not self.has_table(models.UniprotAccession):
+            return {}
+
+        mapping = models.UniprotAccession
+        accessions = list(accessions)
+        results = {}
+        for i in range(0, len(accessions), SQL_CHUNK_SIZE):
+            rows = self.session.query(mapping.accession, mapping.a_thaliana_locus, mapping.gene_name, mapping.uniprot_accession) \
+                .filter(mapping.accession.in_(accessions[i:i + SQL_CHUNK_SIZE]))
+            results.update((accession, (locus, gene_name, uniprot_accession)) for accession, locus, gene_name, uniprot_accession in rows)
+        return results
+
+    def get_gene_summary(self, gene_ids):
+        """
+        Retrieve the pre-rendered result rows of the given genes from the gene_summary table.
+
+        Returns:
+            pandas.DataFrame: the gene_summary columns (without id), in the order of gene_ids,
+            or None if the summary table has not been built.
+        """
+        if not self.has_table(models.GeneSummary):
+            return None
+
+        summary = models.GeneSummary
+        columns = [column for column in summary.__table__.columns if column.name != "id"]
+        gene_ids = list(gene_ids)
+        chunks = []
+        for i in range(0, len(gene_ids), SQL_CHUNK_SIZE):
+            statement = sq.select(*columns).where(summary.gene_id.in_(gene_ids[i:i + SQL_CHUNK_SIZE])).order_by(summary.id)
+            chunks.append(pd.read_sql(statement, self.session.connection()))
+
+        df = pd.concat(chunks) if chunks else pd.DataFrame(columns=[column.name for column in columns])
+        order = {gene_id: position for position, gene_id in enumerate(gene_ids)}
+        return df.sort_values("gene_id", key=lambda ids: ids.map(order), kind="stable").reset_index(drop=True)
+
+    def get_gene_descriptions(self, gene_list):
+        """
+        Retrieve the annotation description(s) of a list of genes.
+
+        Returns:
+            dict: gene name -> annotation descriptions joined by "; " (genes without annotation are omitted).
+        """
+        descriptions = {}
+        for i in range(0, len(gene_list), SQL_CHUNK_SIZE):
+            chunk = list(gene_list[i:i + SQL_CHUNK_SIZE])
+            rows = (self.session.query(models.Gene.gene_name, models.Annotation.description)
+                .join(models.Gene.annotations)
+                .filter(models.Gene.gene_name.in_(chunk))
+                .all()
+            )
+            for gene_name, description in rows:
+                if description:
+                    descriptions.setdefault(gene_name, []).append(description)
+
+        return {gene_name: "; ".join(values) for gene_name, values in descriptions.items()}
+
+    def get_gene_from_arab_homolog(self, At_list):
+        """
+        Retrieve the Xerophyta genes linked to a list of Arabidopsis loci and/or common names.
+
+        Loci are resolved with a case-insensitive IN lookup (in chunks, to stay below SQLite's
+        bound parameter limit). Common names are looked up the same way in the synonym table.
+        If that has not been built, the homologue links are read once and each name in the
+        free-text common name string is looked up in a set of the queries.
+
+        Returns:
+            list: (gene_name, a_thaliana_locus, a_thaliana_common_name) tuples.
+        """
+        queries = {x.strip().lower() for x in At_list if x and x.strip()}
+        if not queries:
+            return []
+
+        base_query = (self.session.query(models.Gene.gene_name,
+                                         models.ArabidopsisHomologue.a_thaliana_locus,
+                                         models.ArabidopsisHomologue.a_thaliana_common_name)
+            .join(models.Gene.arabidopsis_homologues)
+        )
+
+        loci = sorted(x for x in queries if AT_LOCUS_PATTERN.match(x))
+        result = []
+        for i in range(0, len(loci), SQL_CHUNK_SIZE):
+            chunk = loci[i:i + SQL_CHUNK_SIZE]
+            result.extend(tuple(row) for row in base_query.filter(
+                func.lower(models.ArabidopsisHomologue.a_thaliana_locus).in_(chunk)))
+
+        names = sorted(queries.difference(loci))
+        if names and self.has_table(models.ArabidopsisSynonym):
+            base_query = base_query.join(models.ArabidopsisSynonym,
+                                         models.ArabidopsisSynonym.homologue_id == models.ArabidopsisHomologue.id)
+            for i in range(0, len(names), SQL_CHUNK_SIZE):
+                chunk = names[i:i + SQL_CHUNK_SIZE]
+                result.extend(tuple(row) for row in base_query.filter(models.ArabidopsisSynonym.synonym_folded.in_(chunk)))
+        elif names:
+            names = set(names)
+            for row in base_query:
+                aliases = [row.a_thaliana_locus] + split_common_names(row.a_thaliana_common_name)
+                if any(alias and alias.lower() in names for alias in aliases):
+                    result.append(tuple(row))
+
+        # a homologue can be hit by both its locus and one of its names
+        return list(dict.fromkeys(result))
+    
+    def match_homologue_to_Xe_gene(self, At_list):
+        """
+        Match each Arabidopsis query (locus or common name) to the Xerophyta genes sharing that homologue.
+
+        The queries are indexed once by their case-folded form, and every alias of every hit
+        (the locus plus each common name) is looked up in that index, so classifying hits and
+        misses is linear in the number of queries and hits.
+
+        Returns:
+            pandas.DataFrame: one row per (query, gene) match in the order the queries were given,
+            plus one row with empty gene columns for every query without a match.
+        """
+        queries = list(dict.fromkeys(x.strip() for x in At_list if x and x.strip()))
+        query_index = {}
+        for query in queries:
+            query_index.setdefault(query.lower(), query)
+
+        # Get the hits from the database
+        hits = self.get_gene_from_arab_homolog(queries)
+
+        matches = {query: [] for query in query_index.values()}
+        for xele_gene, at_gene, common_name in hits:
+            matched_queries = []
+            for alias in [at_gene] + split_common_names(common_name):
+                query = query_index.get(alias.lower()) if alias else None
+                if query is not None and query not in matched_queries:
+                    matched_queries.append(query)
+
+            for query in matched_queries:
+                matches[query].append((xele_gene, at_gene or '', common_name or ''))
+
+        results = {'Query': [], 'X. elegans gene': [], 'At_Gene': [], 'Common_name': []}
+        for query in queries:
+            # duplicates that only differ in case are reported once, under their first spelling
+            if query_index[query.lower()] != query:
+                continue
+            # an empty row marks a query without an exact match
+            for xele_gene, at_gene, common_name in matches[query] or [('', '', '')]:
+                results['Query'].append(query)
+                results['X. elegans gene'].append(xele_gene)
+                results['At_Gene'].append(at_gene)
+                results['Common_name'].append(common_name)
+
+        results_df = pd.DataFrame(results, dtype="string")
 
         return results_df
 
@@ -283,5 +696,5 @@ class DB():
         return results
     
     def get_gene_names(self):
-        results = self.session.query(models.Gene_info.gene_name).all()
+        results = self.session.query(models.Gene.gene_name).all()
         return results
\ No newline at end of file
@@ -13,14 +13,18 @@ Accepted command-line arguments:
 """
 
 import argparse
+import gzip
+import itertools
 import re
 import models as models
 import os
 import sqlalchemy as sq
 import db as db
+import go_ontology
+import sequence_index
+import minhash
 import pandas as pd
 import uuid
-from Bio import SeqIO
 
 # DATABASE_NAME = "xerophyta_db.sqlite"
 # DATABASE_NAME = "test_db.sqlite"
@@ -49,6 +53,9 @@ def create_new_db():
     print("DONE")
 
 def add_gene_sequence_from_fasta(filename, species_id):
+    # Bio is only needed for this ingest step, not by the other tools importing db_manager
+    from Bio import SeqIO
+
     database = db.DB()
     species_name = database.session.query(models.Species).filter_by(id=species_id).first().name
     print(f"Adding gene sequences for {species_name} from {filename}")
@@ -85,11 +92,43 @@ def map_genes_to_ids(species_id):
         gene_dict[gene.gene_name] = gene.id
     return gene_dict
 
+class TermCache():
+    """
+    Interns vocabulary terms (GO, enzyme codes, InterPro) while loading annotations: every term ID
+    maps to exactly one row, looked up in memory instead of with a query (and commit) per term.
+    """
+
+    def __init__(self, session, model, lookup_field):
+        self.session = session
+        self.model = model
+        self.lookup_field = lookup_field
+        self.terms = {getattr(term, lookup_field): term for term in session.query(model)}
+
+    def get(self, values):
+        """
+        Return the row of the term in values (a dict including lookup_field), creating it if it is new.
+        Values missing on an existing row (e.g. its name) are filled in.
+        """
+        term = self.terms.get(values[self.lookup_field])
+        if term is None:
+            term = self.model(**values)
+            self.session.add(term)
+            self.terms[values[self.lookup_field]] = term
+        else:
+            for key, value in values.items():
+                if getattr(term, key) is None:
+                    setattr(term, key, value)
+        return term
+
 def add_gene_annotations(filename, species_id):
     database = db.DB()
     annotations_df = parse_annotations(filename)
     gene_dict = map_genes_to_ids(species_id)
 
+    go_cache = TermCache(database.session, models.GO, "go_id")
+    enzyme_cache = TermCache(database.session, models.EnzymeCode, "enzyme_code")
+    interpro_cache = TermCache(database.session, models.InterPro, "interpro_id")
+
     for _, row in annotations_df.iterrows():
         
         # map SeqName to gene_id
@@ -114,7 +153,7 @@ def add_gene_annotations(filename, species_id):
                 "go_branch": go_id.split(":")[0],  # Extract branch (P, F, or C)
                 "go_name": go_name
             }
-            go_instance = database.create_or_update(models.GO, [go_data], lookup_field="go_id")
+            go_instance = go_cache.get(go_data)
             if go_instance not in annotation_instance.go_ids:
                 annotation_instance.go_ids.append(go_instance)
 
@@ -125,7 +164,7 @@ def add_gene_annotations(filename, species_id):
                 "enzyme_code": enzyme_code,
                 "enzyme_name": enzyme_name
             }
-            enzyme_instance = database.create_or_update(models.EnzymeCode, [enzyme_data], lookup_field="enzyme_code")
+            enzyme_instance = enzyme_cache.get(enzyme_data)
             if enzyme_instance not in annotation_instance.enzyme_codes:
                 annotation_instance.enzyme_codes.append(enzyme_instance)
 
@@ -134,19 +173,339 @@ def add_gene_annotations(filename, species_id):
             interpro_data = {
                 "interpro_id": interpro_id
             }
-            interpro_instance = database.create_or_update(models.InterPro, [interpro_data], lookup_field="interpro_id")
+            interpro_instance = interpro_cache.get(interpro_data)
             if interpro_instance not in annotation_instance.interpro_ids:
                 annotation_instance.interpro_ids.append(interpro_instance)
 
     # Commit all changes at the end
     database.session.commit()
 
+def add_differential_expression(filename, dataset, contrast, batch_size=10000):
+    """
+    Loads a DESeq2 results table (gene names in the first column, then baseMean, log2FoldChange, ..., padj)
+    for one contrast of a dataset. Existing results for the same dataset and contrast are replaced.
+
+    Rows are inserted in bulk (executemany) rather than through create_or_update, as a contrast
+    has a row for every expressed gene.
+    """
+    database = db.DB()
+    models.DifferentialExpression.__table__.create(database.engine, checkfirst=True)
+
+    df = pd.read_csv(filename)
+    df = df.rename(columns={df.columns[0]: "gene_name",
+                            "baseMean": "base_mean",
+                            "log2FoldChange": "log2_fold_change"})
+    df = df[["gene_name", "base_mean", "log2_fold_change", "padj"]]
+
+    df["direction"] = None
+    df.loc[df["log2_fold_change"] > 0, "direction"] = "U"
+    df.loc[df["log2_fold_change"] < 0, "direction"] = "D"
+    df["dataset"] = dataset
+    df["contrast"] = contrast
+
+    # NaN (e.g. padj of genes filtered by DESeq2) is stored as NULL
+    df = df.astype(object).where(df.notna(), None)
+
+    print(f"Adding {len(df)} differential expression results for {dataset}: {contrast}")
+    database.session.query(models.DifferentialExpression).filter_by(dataset=dataset, contrast=contrast).delete()
+
+    records = df.to_dict("records")
+    for i in range(0, len(records), batch_size):
+        database.session.execute(sq.insert(models.DifferentialExpression), records[i:i + batch_size])
+    database.session.commit()
+    print("Done")
+
+def _tair_locus(values):
+    return next((value.upper() for value in values if db.AT_LOCUS_PATTERN.match(value)), None)
+
+def _idmapping_dat_entries(lines, taxon_id):
+    """
+    Parses idmapping.dat (accession, ID type, ID per line, the lines of an entry and its isoforms together).
+
+    Yields:
+        tuple: (UniProt accession, TAIR locus, gene name, RefSeq accessions) of the entries of the taxon
+    """
+    def entry(accession, ids):
+        taxa = ids.get("NCBI_TaxID", [])
+        locus = _tair_locus(ids.get("Araport", []) + ids.get("TAIR", []) + ids.get("Gene_OrderedLocusName", []))
+        # subsets made without the taxon lines are kept if they have a TAIR locus
+        if taxon_id in taxa or (not taxa and locus):
+            return accession, locus, next(iter(ids.get("Gene_Name", [])), None), ids.get("RefSeq", [])
+        return None
+
+    current, ids = None, {}
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) != 3:
+            continue
+        # isoforms (Q9SZ66-2) belong to their entry
+        accession = fields[0].split("-")[0]
+        if accession != current:
+            if current is not None and (result := entry(current, ids)):
+                yield result
+            current, ids = accession, {}
+        if fields[1] in ("NCBI_TaxID", "Araport", "TAIR", "Gene_OrderedLocusName", "Gene_Name", "RefSeq"):
+            ids.setdefault(fields[1], []).append(fields[2])
+    if current is not None and (result := entry(current, ids)):
+        yield result
+
+def _idmapping_selected_entries(lines, taxon_id):
+    """
+    Parses idmapping_selected.tab (one entry per line: UniProtKB-AC, UniProtKB-ID, GeneID, RefSeq, ...,
+    NCBI-taxon in column 13, Ensembl in column 19). The file has no gene names: the entry name
+    (ZEP_ARATH) is used where it is not just the accession (Q9SZ66_ARATH).
+    """
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 19 or fields[12] != taxon_id:
+            continue
+        accession, entry_name = fields[0], fields[1].split("_")[0]
+        locus = _tair_locus(fields[18].split("; "))
+        refseq = [value for value in fields[3].split("; ") if value]
+        yield accession, locus, entry_name if entry_name != accession else None, refseq
+
+def add_uniprot_idmapping(filename, taxon_id="3702", batch_size=50000):
+    """
+    Imports the Arabidopsis accessions of a UniProt idmapping dump (idmapping.dat or idmapping_selected.tab,
+    gzipped or not, the full file or a subset such as ARATH_3702_idmapping.dat.gz) into the
+    uniprot_accessions table, replacing its contents. Each UniProt accession and each RefSeq protein
+    mapped to it gets a row with the entry's TAIR locus and gene name, so accession_mapper resolves
+    them without network access.
+
+    The file is read line by line and inserted in batches, so the full dump (tens of GB) is never held in memory.
+    """
+    database = db.DB()
+    models.UniprotAccession.__table__.create(database.engine, checkfirst=True)
+    database.session.query(models.UniprotAccession).delete()
+    # a RefSeq protein can be mapped to several entries, the last one wins
+    insert = sq.insert(models.UniprotAccession).prefix_with("OR REPLACE")
+
+    opener = gzip.open if filename.endswith(".gz") else open
+    entries = records = 0
+    batch = []
+    with opener(filename, "rt") as f:
+        first_line = f.readline()
+        # idmapping.dat has 3 columns, idmapping_selected.tab 22
+        parse = _idmapping_dat_entries if len(first_line.split("\t")) == 3 else _idmapping_selected_entries
+        for accession, locus, gene_name, refseq in parse(itertools.chain([first_line], f), taxon_id):
+            entries += 1
+            batch.append({"accession": accession, "uniprot_accession": accession,
+                          "a_thaliana_locus": locus, "gene_name": gene_name or locus})
+            for refseq_accession in refseq:
+                batch.append({"accession": refseq_accession.split(".")[0], "uniprot_accession": accession,
+                              "a_thaliana_locus": locus, "gene_name": gene_name or locus})
+            if len(batch) >= batch_size:
+                database.session.execute(insert, batch)
+                records += len(batch)
+                batch = []
+                print(f"{entries} entries imported")
+    if batch:
+        database.session.execute(insert, batch)
+        records += len(batch)
+    database.session.commit()
+    print(f"Added {records} accessions of {entries} UniProt entries (taxon {taxon_id})")
+
+def load_go_ontology(obo_file, batch_size=10000):
+    """
+    Loads the GO terms from a local go-basic.obo file and precomputes the ontology's transitive
+    closure (every ancestor/descendant pair), replacing any previously loaded version.
+    """
+    database = db.DB()
+    for model in (models.GOTerm, models.GOClosure):
+        model.__table__.create(database.engine, checkfirst=True)
+
+    print(f"Parsing {obo_file}")
+    with open(obo_file, "r") as f:
+        terms = go_ontology.parse_obo(f)
+
+    database.session.query(models.GOClosure).delete()
+    database.session.query(models.GOTerm).delete()
+
+    print(f"Adding {len(terms)} GO terms")
+    term_records = [{"go_id": go_id,
+                     "name": term.get("name"),
+                     "namespace": term.get("namespace"),
+                     "is_obsolete": term["is_obsolete"]}
+                    for go_id, term in terms.items()]
+    for i in range(0, len(term_records), batch_size):
+        database.session.execute(sq.insert(models.GOTerm), term_records[i:i + batch_size])
+
+    print("Adding GO closure")
+    batch = []
+    for ancestor, descendant, distance in go_ontology.compute_closure(terms):
+        batch.append({"ancestor_id": ancestor, "descendant_id": descendant, "distance": distance})
+        if len(batch) == batch_size:
+            database.session.execute(sq.insert(models.GOClosure), batch)
+            batch = []
+    if batch:
+        database.session.execute(sq.insert(models.GOClosure), batch)
+
+    database.session.commit()
+    print("Done")
+
+def build_kmer_index():
+    """
+    (Re)builds the k-mer index of all coding sequences used by the motif search. It is saved next to
+    the database file and has to be rebuilt whenever gene sequences are added.
+    """
+    database = db.DB()
+    sequences = database.session.query(models.Gene.id, models.Gene.coding_sequence).order_by(models.Gene.id).yield_per(1000)
+    index = sequence_index.KmerIndex.build(sequences)
+    database.session.close()
+
+    path = sequence_index.index_path(database.database_name)
+    index.save(path)
+    print(f"Saved k-mer index of {len(index.gene_ids)} genes ({len(index.postings)} postings) to {path}")
+
+def build_gene_sketches(workers=None):
+    """
+    (Re)computes the MinHash sketch of every coding sequence, used to find similar genes across species.
+    The sequences are sketched in parallel on a pool of worker processes (one per CPU by default).
+    """
+    database = db.DB()
+    models.GeneSketch.__table__.create(database.engine, checkfirst=True)
+
+    genes = database.session.query(models.Gene.id, models.Gene.species_id, models.Gene.coding_sequence).all()
+    print(f"Sketching {len(genes)} coding sequences")
+    database.session.query(models.GeneSketch).delete()
+
+    count = 0
+    for records in minhash.sketch_genes_parallel(genes, workers=workers):
+        if records:
+            database.session.execute(sq.insert(models.GeneSketch), records)
+        count += len(records)
+    database.session.commit()
+    print(f"Added {count} sketches")
+
+def build_arabidopsis_synonyms(batch_size=10000):
+    """
+    (Re)builds the Arabidopsis synonym table by splitting each homologue's common name field
+    (e.g. "ABA1 ZEP, NPQ2") into its individual names. Run after homologues have been added.
+    """
+    database = db.DB()
+    models.ArabidopsisSynonym.__table__.create(database.engine, checkfirst=True)
+    database.session.query(models.ArabidopsisSynonym).delete()
+
+    records = []
+    homologues = database.session.query(models.ArabidopsisHomologue.id, models.ArabidopsisHomologue.a_thaliana_common_name)
+    for homologue_id, common_names in homologues:
+        folded_names = set()
+        for synonym in db.split_common_names(common_names):
+            if synonym.lower() not in folded_names:
+                folded_names.add(synonym.lower())
+                records.append({"homologue_id": homologue_id, "synonym": synonym, "synonym_folded": synonym.lower()})
+
+    for i in range(0, len(records), batch_size):
+        database.session.execute(sq.insert(models.ArabidopsisSynonym), records[i:i + batch_size])
+    database.session.commit()
+    print(f"Added {len(records)} Arabidopsis synonyms")
+
+def build_orthogroups():
+    """
+    (Re)builds the orthogroup tables from the gene-homologue associations: every Arabidopsis homologue
+    with at least one Xerophyta gene becomes an orthogroup holding those genes, with gene counts per species.
+    Homologues without a locus (e.g. "No Blast Hit") do not form orthogroups. Run after homologues have been added.
+    """
+    database = db.DB()
+    for model in (models.Orthogroup, models.OrthogroupMember, models.OrthogroupSpeciesCount):
+        model.__table__.create(database.engine, checkfirst=True)
+    for model in (models.OrthogroupSpeciesCount, models.OrthogroupMember, models.Orthogroup):
+        database.session.query(model).delete()
+
+    association = models.gene_homologue_association
+    members = (sq.select(association.c.homologue_id, association.c.gene_id, models.Gene.species_id)
+        .join(models.Gene, models.Gene.id == association.c.gene_id)
+        .join(models.ArabidopsisHomologue, models.ArabidopsisHomologue.id == association.c.homologue_id)
+        .where(models.ArabidopsisHomologue.a_thaliana_locus.isnot(None))
+    ).subquery()
+
+    database.session.execute(sq.insert(models.Orthogroup).from_select(
+        ["id", "a_thaliana_locus", "gene_count", "species_count"],
+        sq.select(models.ArabidopsisHomologue.id,
+                  models.ArabidopsisHomologue.a_thaliana_locus,
+                  sq.func.count(members.c.gene_id),
+                  sq.func.count(sq.distinct(members.c.species_id)))
+        .join(members, members.c.homologue_id == models.ArabidopsisHomologue.id)
+        .group_by(models.ArabidopsisHomologue.id)
+    ))
+    database.session.execute(sq.insert(models.OrthogroupMember).from_select(
+        ["orthogroup_id", "gene_id", "species_id"],
+        sq.select(members.c.homologue_id, members.c.gene_id, members.c.species_id)
+    ))
+    database.session.execute(sq.insert(models.OrthogroupSpeciesCount).from_select(
+        ["orthogroup_id", "species_id", "gene_count"],
+        sq.select(members.c.homologue_id, members.c.species_id, sq.func.count(members.c.gene_id))
+        .group_by(members.c.homologue_id, members.c.species_id)
+    ))
+    database.session.commit()
+    print(f"Built {database.session.query(models.Orthogroup).count()} orthogroups")
+
+def _term_strings(association, term_column, model, id_field, name_field):
+    """
+    Subquery of annotation_id -> "id(name); id(name); ..." for one of the term association tables,
+    formatted like the gene query page's results table.
+    """
+    label = getattr(model, id_field) + "(" + sq.func.coalesce(getattr(model, name_field), "None") + ")"
+    return (sq.select(association.c.annotation_id, sq.func.group_concat(label, "; ").label("terms"))
+        .join(model, model.id == association.c[term_column])
+        .group_by(association.c.annotation_id)
+    ).subquery()
+
+def build_gene_summary():
+    """
+    (Re)builds the denormalized gene_summary table read by the gene query page: one row per gene and
+    annotation with the species name, Arabidopsis homologues and GO / enzyme / InterPro terms already
+    rendered as display strings. Run after any change to genes, annotations or homologues.
+    """
+    database = db.DB()
+    models.GeneSummary.__table__.create(database.engine, checkfirst=True)
+    database.session.query(models.GeneSummary).delete()
+
+    go_terms = _term_strings(models.annotations_go, "go_id", models.GO, "go_id", "go_name")
+    enzyme_codes = _term_strings(models.annotations_enzyme_codes, "enzyme_code_id", models.EnzymeCode, "enzyme_code", "enzyme_name")
+    interpro_ids = _term_strings(models.annotations_interpro, "interpro_id", models.InterPro, "interpro_id", "interpro_go_name")
+
+    association = models.gene_homologue_association
+    homologue = models.ArabidopsisHomologue
+    homologues = (sq.select(association.c.gene_id,
+                            sq.func.group_concat(homologue.a_thaliana_locus, ", ").label("loci"),
+                            # "" rather than NULL for homologues without common names, as on the page
+                            sq.func.coalesce(sq.func.group_concat(homologue.a_thaliana_common_name, ", "), "").label("common_names"))
+        .join(homologue, homologue.id == association.c.homologue_id)
+        .group_by(association.c.gene_id)
+    ).subquery()
+
+    rows = (sq.select(models.Gene.id, models.Gene.gene_name, models.Gene.species_id, models.Species.name,
+                      models.Annotation.description, models.Annotation.e_value,
+                      homologues.c.loci, homologues.c.common_names,
+                      go_terms.c.terms, enzyme_codes.c.terms, interpro_ids.c.terms)
+        .outerjoin(models.Species, models.Species.id == models.Gene.species_id)
+        .outerjoin(models.Annotation, models.Annotation.gene_id == models.Gene.id)
+        .outerjoin(homologues, homologues.c.gene_id == models.Gene.id)
+        .outerjoin(go_terms, go_terms.c.annotation_id == models.Annotation.id)
+        .outerjoin(enzyme_codes, enzyme_codes.c.annotation_id == models.Annotation.id)
+        .outerjoin(interpro_ids, interpro_ids.c.annotation_id == models.Annotation.id)
+        .order_by(models.Gene.id, models.Annotation.id)
+    )
+    database.session.execute(sq.insert(models.GeneSummary).from_select(
+        ["gene_id", "gene_name", "species_id", "species_name", "annotation_description", "annotation_e_value",
+         "arab_locus", "arab_common_name", "go_terms", "enzyme_codes", "interpro_ids"],
+        rows
+    ))
+    database.session.commit()
+    print(f"Built gene summary with {database.session.query(models.GeneSummary).count()} rows")
+
 def main(species_name, fasta_file, annotation_file, homologue_file):
     database = db.DB()
     species = database.add_species(species_name) # add species to database
     species_id = species.id
     add_gene_sequence_from_fasta(fasta_file, species_id) # add gene sequences to database from fasta file
     add_gene_annotations( annotation_file, species_id) # add gene annotations to database
+    build_kmer_index() # index the new coding sequences for motif search
+    build_gene_sketches() # sketch the new coding sequences for the cross-species similarity search
+    build_arabidopsis_synonyms() # split the homologues' common names for exact name lookups
+    build_orthogroups() # regroup the genes of all species by their Arabidopsis homologues
+    build_gene_summary() # refresh the pre-rendered rows of the gene query page
 
 if __name__ == "__main__":
     # replace  the following with the appropriate file paths and values
@@ -0,0 +1,177 @@
+"""
+GO / InterPro enrichment analysis of a gene set against the annotated genes of its species.
+
+For each species and vocabulary a sparse gene x term incidence matrix is built once per database
+version. Enrichment of a gene set is then one sparse matrix-vector product (term counts in the
+set), a vectorised hypergeometric test over all terms and a Benjamini-Hochberg correction.
+"""
+import numpy as np
+import pandas as pd
+import streamlit as st
+from scipy import sparse
+from scipy.special import gammaln
+
+import db
+
+VOCABULARIES = ["GO", "InterPro"]
+
+
+class TermIncidence():
+
+    def __init__(self, gene_ids, terms, term_names, matrix):
+        """
+        Parameters:
+            gene_ids: database IDs of the background genes, one per row of matrix
+            terms: term IDs (e.g. GO:0009414), one per column of matrix
+            term_names: term names, one per column of matrix
+            matrix: scipy.sparse CSC matrix, 1 where the gene is annotated with the term
+        """
+        self.gene_ids = np.asarray(gene_ids)
+        self.terms = np.asarray(terms)
+        self.term_names = np.asarray(term_names)
+        self.matrix = matrix
+        self.term_sizes = np.asarray(matrix.sum(axis=0)).ravel()
+        self.positions = pd.Index(self.gene_ids)
+
+    @classmethod
+    def from_associations(cls, associations):
+        """
+        Build the matrix from a DataFrame of (gene_id, term, name) associations (see DB.get_term_associations).
+        """
+        associations = associations.drop_duplicates(["gene_id", "term"])
+        rows, gene_ids = pd.factorize(associations["gene_id"])
+        columns, terms = pd.factorize(associations["term"])
+        names = associations.drop_duplicates("term").set_index("term")["name"].reindex(terms)
+
+        matrix = sparse.csc_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+            shape=(len(gene_ids), len(terms)),
+        )
+        return cls(gene_ids, terms, names.to_numpy(), matrix)
+
+    def __len__(self):
+        return len(self.gene_ids)
+
+    def enrichment(self, gene_ids):
+        """
+        Test every term for over-representation in gene_ids.
+
+        The background is all genes of the species with at least one term of this vocabulary;
+        genes of the set without such a term are left out of the test.
+
+        Returns:
+            pandas.DataFrame: one row per term annotated to at least one gene of the set, sorted by p-value.
+        """
+        rows = self.positions.get_indexer(pd.unique(np.asarray(gene_ids)))
+        rows = rows[rows >= 0]
+
+        background_size = len(self)
+        study_size = len(rows)
+        if study_size == 0:
+            return empty_result()
+
+        selection = np.zeros(background_size, dtype=np.int32)
+        selection[rows] = 1
+        study_counts = self.matrix.T @ selection
+
+        # P(X >= k) for X ~ Hypergeometric(background, term size, study size)
+        p_values = np.ones(len(self.terms))
+        tested = study_counts > 0
+        p_values[tested] = hypergeometric_sf(study_counts[tested], background_size, self.term_sizes[tested], study_size)
+        fdr = benjamini_hochberg(p_values)
+
+        result = pd.DataFrame({
+            "Term": self.terms[tested],
+            "Name": self.term_names[tested],
+            "Genes in set": study_counts[tested],
+            "Set size": study_size,
+            "Genes in background": self.term_sizes[tested],
+            "Background size": background_size,
+            "Fold enrichment": (study_counts[tested] / study_size) / (self.term_sizes[tested] / background_size),
+            "p-value": p_values[tested],
+            "FDR": fdr[tested],
+        })
+        return result.sort_values(["p-value", "Term"]).reset_index(drop=True)
+
+
+def hypergeometric_sf(k, population, successes, draws):
+    """
+    P(X >= k) for X ~ Hypergeometric(population, successes, draws), vectorised over k and successes.
+
+    Above the mode the upper tail P(X >= k) is summed directly; at or below it 1 - P(X < k) is used.
+    Either way the sum starts next to the mode, at the largest probabilities (from log-gamma
+    functions), and walks outwards with the pmf recurrence for all terms at once until the
+    remaining terms no longer change it. This is much faster than scipy.stats.hypergeom.sf, which
+    sums each term's tail separately.
+    """
+    k = np.asarray(k, dtype=float)
+    successes = np.asarray(successes, dtype=float)
+    upper = np.minimum(successes, draws)
+    lower = np.maximum(0, draws - (population - successes))
+    mode = np.floor((draws + 1) * (successes + 1) / (population + 2))
+
+    upper_tail = k > mode
+    i = np.where(upper_tail, k, k - 1)
+    in_support = (i >= lower) & (i <= upper)
+    safe_i = np.clip(i, lower, upper)
+    log_pmf = (log_binomial(successes, safe_i)
+               + log_binomial(population - successes, draws - safe_i)
+               - log_binomial(population, draws))
+    term = np.where(in_support, np.exp(log_pmf), 0.0)
+    total = term.copy()
+
+    active = in_support & np.where(upper_tail, i < upper, i > lower)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        while active.any():
+            step_up = ((successes - i) * (draws - i)) / ((i + 1) * (population - successes - draws + i + 1))
+            step_down = (i * (population - successes - draws + i)) / ((successes - i + 1) * (draws - i + 1))
+            term = np.where(active, term * np.where(upper_tail, step_up, step_down), 0.0)
+            total += term
+            i = i + np.where(upper_tail, 1, -1)
+            # moving away from the mode the terms only shrink
+            active &= np.where(upper_tail, i < upper, i > lower) & (term > total * 1e-16)
+
+    sf = np.where(upper_tail, total, 1.0 - total)
+    return np.clip(np.where(k <= lower, 1.0, sf), 0.0, 1.0)
+
+
+def log_binomial(n, k):
+    return gammaln(n + 1) - gammaln(k + 1) - gammaln(n - k + 1)
+
+
+def benjamini_hochberg(p_values):
+    """
+    Benjamini-Hochberg adjusted p-values (false discovery rate), computed over all values at once.
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    count = len(p_values)
+    if count == 0:
+        return p_values
+    order = np.argsort(p_values)
+    scaled = p_values[order] * count / np.arange(1, count + 1)
+    # enforce monotonicity from the largest p-value down
+    adjusted = np.minimum.accumulate(scaled[::-1])[::-1]
+    result = np.empty(count)
+    result[order] = np.minimum(adjusted, 1.0)
+    return result
+
+
+def empty_result():
+    return pd.DataFrame(columns=["Term", "Name", "Genes in set", "Set size", "Genes in background",
+                                 "Background size", "Fold enrichment", "p-value", "FDR"])
+
+
+@st.cache_resource(max_entries=12, show_spinner="Preparing enrichment analysis...")
+def load_term_incidence(vocabulary, species_id, db_version):
+    database = db.DB()
+    associations = database.get_term_associations(vocabulary, species_id)
+    database.session.close()
+    return TermIncidence.from_associations(associations)
+
+
+def run_enrichment(vocabulary, species_id, gene_ids):
+    """
+    Enrichment of gene_ids (database IDs of genes of one species) for the terms of vocabulary ("GO" or "InterPro").
+    """
+    incidence = load_term_incidence(vocabulary, species_id, db.DB.database_version())
+    return incidence.enrichment(gene_ids)
@@ -0,0 +1,169 @@
+"""
+Expression data retrieval behind the Expression data page, without any Streamlit UI, so it can
+be called from scripts and the benchmarks.
+
+The frames are compact (categorical names, float32 values, the smallest integer types) and the page
+shares them between sessions through frame_cache: a session keeps only a FrameHandle, and a frame
+stays in memory as long as a session holds a handle to it, plus a bounded number of bytes of
+recently released frames for the next session asking for the same genes.
+"""
+import collections
+import threading
+import weakref
+
+import pandas as pd
+
+import db
+
+# columns stored as categories (few distinct values repeated on every row)
+CATEGORICAL_COLUMNS = ["gene_name", "treatment", "species"]
+
+# bytes of frames no session holds any more that are kept for reuse
+IDLE_CACHE_BYTES = 256 * 2**20
+
+
+def normalise_gene_input(text_input):
+    """
+    Splits the sidebar input (comma, space or newline separated) into a sorted tuple of unique names.
+    The tuple is used as the key into the shared expression cache, so the same genes entered in a
+    different order or with different spacing hit the same cache entry.
+    """
+    tokens = text_input.replace(",", " ").split()
+    return tuple(sorted(set(tokens)))
+
+
+def match_genes(input_genes):
+    
+    database = db.DB()
+    return  database.match_homologue_to_Xe_gene(input_genes)
+
+
+def retreive_expression_data(input_genes, gene_input_type, deg_filter=None):
+    """
+    Parameters:
+        input_genes: Xerophyta gene names or Arabidopsis loci/common names
+        gene_input_type: "Gene_ID" or "Arab_homolog"
+        deg_filter: None, or (dataset, contrast, direction, padj threshold, log2fc threshold) to
+            keep only the differentially expressed genes
+    """
+    database = db.DB()
+    input_genes = list(input_genes)
+    
+    if gene_input_type == "Arab_homolog":
+        
+        input_genes = database.get_gene_from_arab_homolog(input_genes)
+        input_genes = [x[0] for x in input_genes]
+
+    if deg_filter is not None:
+        dataset, contrast, direction, padj_threshold, log2fc_threshold = deg_filter
+        degs = database.get_differentially_expressed_genes(dataset, contrast, padj_threshold, log2fc_threshold, direction)
+        input_genes = [gene for gene in input_genes if gene in degs]
+
+    data = database.get_gene_expression_data(input_genes)
+    return compact_expression_frame(data)
+
+
+def compact_expression_frame(df):
+    """
+    Convert an expression frame to compact dtypes: categorical names, float32 expression values,
+    the smallest integer type holding the times and replicates, and the (unique) row IDs as Arrow strings.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype("category")
+        elif column == "id":
+            df[column] = df[column].astype("string[pyarrow]")
+        elif pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype("float32")
+    return df
+
+
+def frame_nbytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+class FrameHandle():
+    """
+    A session's reference to a frame in a FrameCache. The reference is released with release(),
+    or when the handle is garbage collected (e.g. with the session state of a closed session).
+    """
+
+    def __init__(self, cache, key, frame):
+        self.key = key
+        self.frame = frame
+        # the finalizer may run on any thread (or inside the cache's own code, during garbage
+        # collection), so it only queues the key; the cache applies it on its next call
+        self._finalizer = weakref.finalize(self, cache.released.append, key)
+
+    def release(self):
+        self._finalizer()
+
+
+class FrameCache():
+    """
+    Frames shared between sessions, reference counted by their handles. Frames without handles
+    are kept, least recently released first out, while they fit in max_idle_bytes.
+    """
+
+    def __init__(self, max_idle_bytes=IDLE_CACHE_BYTES):
+        self.max_idle_bytes = max_idle_bytes
+        self.lock = threading.Lock()
+        # key -> [frame, handle count, bytes]
+        self.entries = {}
+        # keys of the entries without handles, least recently released first
+        self.idle = collections.OrderedDict()
+        self.released = collections.deque()
+
+    def acquire(self, key, load):
+        """
+        Returns:
+            FrameHandle: a handle on the frame of key, loaded with load() if it is not cached
+        """
+        with self.lock:
+            self._apply_releases()
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry[1] += 1
+                self.idle.pop(key, None)
+                return FrameHandle(self, key, entry[0])
+
+        frame = load()
+        with self.lock:
+            # another session may have loaded it meanwhile, in which case that copy is shared
+            entry = self.entries.setdefault(key, [frame, 0, frame_nbytes(frame)])
+            entry[1] += 1
+            self.idle.pop(key, None)
+            return FrameHandle(self, key, entry[0])
+
+    def stats(self):
+        """
+        Returns:
+            dict: number of frames, frames held by sessions, total bytes and bytes of the idle frames
+        """
+        with self.lock:
+            self._apply_releases()
+            return {
+                "frames": len(self.entries),
+                "held": len(self.entries) - len(self.idle),
+                "bytes": sum(entry[2] for entry in self.entries.values()),
+                "idle_bytes": sum(self.entries[key][2] for key in self.idle),
+            }
+
+    def _apply_releases(self):
+        while self.released:
+            key = self.released.popleft()
+            entry = self.entries[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                self.idle[key] = None
+
+        idle_bytes = sum(self.entries[key][2] for key in self.idle)
+        while idle_bytes > self.max_idle_bytes:
+            key, _ = self.idle.popitem(last=False)
+            idle_bytes -= self.entries.pop(key)[2]
+
+
+frame_cache = FrameCache()
@@ -1,14 +1,14 @@
 import streamlit as st
+from urllib.parse import quote
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import  db
-import plots
+import coexpression
+import expression_data
+import query_stats
+import profiling
 
 
-st.title('Xerophyta Data Explorer')
-st.divider()
-
 ###############################
 # Place holders and tags 
 ###############################
@@ -16,9 +16,14 @@ st.divider()
 options_dataset=["X. elegans time-series"]
 # options_gene_selection = ['Xerophyta GeneID', "Arabidopsis ortholog", "Genes with GO term", "Genes with protein domain"]
 options_gene_selection = ['Xerophyta GeneID', "Arabidopsis ortholog"]
-options_deg = ["show all genes"]
-options_plot_type = ["Genes on single plot", "Genes on separate plot"]
-# options_deg = ["show all genes", "Only display DEGS", "Only display up-regulted DEGs", "Only display down-regulated DEGs"]
+options_plot_type = ["Genes on single plot", "Genes on separate plot", "Clustered heatmap"]
+# maps each DEG filter option to the direction passed to DB.get_differentially_expressed_genes
+options_deg = {
+    "show all genes": None,
+    "Only display DEGs": "both",
+    "Only display up-regulated DEGs": "up",
+    "Only display down-regulated DEGs": "down",
+}
 
 genes_to_plot = ['Xele.ptg000001l.1', 'Xele.ptg000001l.116','Xele.ptg000001l.16']
 place_holder_genes= "Xele.ptg000001l.1, Xele.ptg000001l.116,Xele.ptg000001l.16"
@@ -62,28 +67,82 @@ def instruction_page():
         """
     )
 
-def match_genes(input_genes):
-    
+def shared_frame(name, key, load):
+    """
+    The frame of key from the process-wide expression_data.frame_cache. The session only keeps a
+    handle in st.session_state[name], released when the session asks for another key (or ends),
+    so a frame is held once however many sessions show it.
+    """
+    handle = st.session_state.get(name)
+    if handle is None or handle.key != key:
+        if handle is not None:
+            handle.release()
+        handle = expression_data.frame_cache.acquire(key, load)
+        st.session_state[name] = handle
+    return handle.frame
+
+
+def load_expression_data(gene_key, gene_input_type, deg_filter, db_version):
+    # the database version is part of the key: after an ingest the old frames are released as sessions rerun
+    return shared_frame("expression_handle", (gene_key, gene_input_type, deg_filter, db_version),
+                        lambda: expression_data.retreive_expression_data(gene_key, gene_input_type, deg_filter))
+
+
+@st.cache_data(show_spinner=False)
+def load_de_contrasts(dataset, db_version):
     database = db.DB()
-    return  database.match_homologue_to_Xe_gene(input_genes)
+    return database.get_de_contrasts(dataset)
+
+
+def load_homologue_matches(gene_key, db_version):
+    return shared_frame("homologue_handle", ("homologues", gene_key, db_version),
+                        lambda: expression_data.match_genes(list(gene_key)))
 
 
-def retreive_expression_data():
+@st.cache_resource(max_entries=4, show_spinner="Building co-expression index...")
+def load_coexpression_index(method, expression_values, db_version):
     database = db.DB()
-    input_genes = [item.strip() for item in st.session_state.input_genes.split(',')]
-    
-    if st.session_state.gene_input_type == "Arab_homolog":
-        
-        input_genes = database.get_gene_from_arab_homolog(input_genes)
-        input_genes = [x[0] for x in input_genes]
+    data = database.get_expression_table(expression_values)
+    return coexpression.CoexpressionIndex.from_expression_data(data, expression_values, method)
 
-    data = database.get_gene_expression_data(input_genes)
-    return data
 
+def show_coexpressed_genes(gene_name, method, k, expression_values):
+    st.subheader(f"Genes co-expressed with {gene_name}")
 
+    index = load_coexpression_index(method, expression_values, db.DB.database_version())
+    if gene_name not in index:
+        st.markdown(f"No expression data found for {gene_name}. Please check the spelling of the gene name.")
+        return
+
+    neighbours = index.top_k(gene_name, k)
+    database = db.DB()
+    descriptions = database.get_gene_descriptions(neighbours["Gene Name"].tolist())
+    neighbours["Annotation Description"] = neighbours["Gene Name"].map(descriptions)
+    # link each gene to its annotations on the gene info page
+    neighbours["Gene info"] = [f"gene_query_page?genes={quote(g)}" for g in neighbours["Gene Name"]]
+
+    st.write(f"{method.capitalize()} correlation of {expression_values} across all samples.")
+    st.dataframe(
+        neighbours,
+        column_config={
+            "Correlation": st.column_config.NumberColumn(format="%.3f"),
+            "Gene info": st.column_config.LinkColumn(display_text="Show annotation"),
+        },
+        use_container_width=True,
+        hide_index=True,
+    )
+
+
+def render_figure(figure):
+    # st.pyplot saves the figure to PNG, which is where most of the plotting time goes
+    with profiling.phase("render_plots"):
+        st.pyplot(figure)
 
 
 def generate_plots(data):
+    # matplotlib is only imported once the first plot is generated
+    import plots
+
     st.subheader("Plot")
 
     if st.session_state.plot_type == "Genes on single plot":
@@ -92,12 +151,16 @@ def generate_plots(data):
 
         # Show the first plot in the left column
         with col1:
-            st.pyplot(figures[0])
+            render_figure(figures[0])
 
         # Show the second plot in the right column
         with col2:
-            st.pyplot(figures[1])
+            render_figure(figures[1])
    
+    # one clustered image for all genes, usable for hundreds of genes
+    elif st.session_state.plot_type == "Clustered heatmap":
+        figure = plots.expression_heatmap(data, st.session_state.expression_values)
+        render_figure(figure)
    
     # plot on separate panels
     else:
@@ -121,122 +184,176 @@ def generate_plots(data):
 
                 # Show the first plot in the left column
                 with col1:
-                    st.pyplot(gene_figures[0])
+                    render_figure(gene_figures[0])
 
                 # Show the second plot in the right column
                 with col2:
-                    st.pyplot(gene_figures[1])
+                    render_figure(gene_figures[1])
             else:
                 # If there's only one figure for a gene, show it in full width
-                st.pyplot(gene_figures[0])
+                render_figure(gene_figures[0])
 
-###############################
-#Side Bar
-###############################
 
-if 'generate_clicked' not in st.session_state:
-    st.session_state.generate_clicked = False
+def main():
+    query_stats.tag_page("Expression data")
+    st.title('Xerophyta Data Explorer')
+    st.divider()
 
-if 'gene_input_type' not in st.session_state:
-    st.session_state.gene_input_type = "Gene_ID"
+    ###############################
+    #Side Bar
+    ###############################
 
-st.sidebar.radio(
-    "Select a dataset:",
-    options_dataset, 
-    key="dataset")
+    if 'generate_clicked' not in st.session_state:
+        st.session_state.generate_clicked = False
 
+    if 'gene_input_type' not in st.session_state:
+        st.session_state.gene_input_type = "Gene_ID"
 
-st.sidebar.radio(
-    "Gene selection method:",
-    options_gene_selection,
-    key="gene_selection")
+    st.sidebar.radio(
+        "Select a dataset:",
+        options_dataset, 
+        key="dataset")
 
 
-if st.session_state.gene_selection =="Xerophyta GeneID":
-    st.sidebar.text_area("Enter Xerophyta GeneIDs separated by  a comma, space or each entry on new line.",place_holder_genes, key="input_genes")
-    st.session_state.gene_input_type = "Gene_ID"
+    st.sidebar.radio(
+        "Gene selection method:",
+        options_gene_selection,
+        key="gene_selection")
 
-elif st.session_state.gene_selection =="Arabidopsis ortholog":
-    st.sidebar.text_area("Enter Arabidopsis orthologues separated by a comma, space or each entry on new line.","At4g32010, OXA1", key="input_genes")
-    st.session_state.gene_input_type = "Arab_homolog"
 
-elif st.session_state.gene_selection =="Genes with GO term":
-    st.sidebar.text_input("Enter GO term description or ID separated by  a comma.","jasmonic acid mediated signaling pathway", key="input_genes")
+    if st.session_state.gene_selection =="Xerophyta GeneID":
+        st.sidebar.text_area("Enter Xerophyta GeneIDs separated by  a comma, space or each entry on new line.",place_holder_genes, key="input_genes")
+        st.session_state.gene_input_type = "Gene_ID"
 
-elif st.session_state.gene_selection == "Genes with protein domain":
-    st.sidebar.text_input("Enter protein domains to search for, separated by  a comma.", key="input_genes")
+    elif st.session_state.gene_selection =="Arabidopsis ortholog":
+        st.sidebar.text_area("Enter Arabidopsis orthologues separated by a comma, space or each entry on new line.","At4g32010, OXA1", key="input_genes")
+        st.session_state.gene_input_type = "Arab_homolog"
 
+    elif st.session_state.gene_selection =="Genes with GO term":
+        st.sidebar.text_input("Enter GO term description or ID separated by  a comma.","jasmonic acid mediated signaling pathway", key="input_genes")
 
-# st.sidebar.radio(
-#     "Do you wish to filter gene based on differential expression?",
-#     options_deg,
-#     key="filter_degs")
+    elif st.session_state.gene_selection == "Genes with protein domain":
+        st.sidebar.text_input("Enter protein domains to search for, separated by  a comma.", key="input_genes")
 
-st.sidebar.radio(
-    "Dp you want to plot log2fc or normalised expression values?",
-    ["log2_expression", "normalised_expression"],
-    key="expression_values")
 
-st.sidebar.radio(
-    "How would you like the expression plots to be displayed?",
-    options_plot_type,
-    key="plot_type")
+    de_contrasts = load_de_contrasts(st.session_state.dataset, db.DB.database_version())
 
+    st.sidebar.radio(
+        "Do you wish to filter gene based on differential expression?",
+        list(options_deg),
+        disabled=not de_contrasts,
+        help=None if de_contrasts else "No differential expression results are loaded for this dataset.",
+        key="filter_degs")
 
+    if de_contrasts and options_deg[st.session_state.filter_degs] is not None:
+        st.sidebar.selectbox("Contrast:", de_contrasts, key="deg_contrast")
+        st.sidebar.number_input("Adjusted p-value below:", min_value=0.0, max_value=1.0, value=0.05, step=0.01, format="%.3f", key="deg_padj")
+        st.sidebar.number_input("Absolute log2 fold change above:", min_value=0.0, value=1.0, step=0.5, key="deg_log2fc")
 
-# Sidebar button to trigger generation
-if st.sidebar.button(label="Generate"):
+    st.sidebar.radio(
+        "Dp you want to plot log2fc or normalised expression values?",
+        ["log2_expression", "normalised_expression"],
+        key="expression_values")
 
-    if st.session_state.input_genes:
+    st.sidebar.radio(
+        "How would you like the expression plots to be displayed?",
+        options_plot_type,
+        key="plot_type")
 
-        input_genes = [item.strip() for item in st.session_state.input_genes.split(',')]
 
-        st.session_state.generate_clicked = True
 
-        if st.session_state.gene_input_type == "Arab_homolog":
+    # Sidebar button to trigger generation
+    if st.sidebar.button(label="Generate"):
 
-            matches = match_genes(input_genes)
-            st.session_state.matches = matches
+        if st.session_state.input_genes:
 
-        data = retreive_expression_data()
-        st.session_state.data = data  # Store the data in session state
-   
+            gene_key = expression_data.normalise_gene_input(st.session_state.input_genes)
 
-# Check if the generate button was clicked
-if st.session_state.generate_clicked:
-    data = st.session_state.get('data')  # Retrieve the stored data
-    if st.session_state.gene_input_type == "Arab_homolog": 
-        st.markdown(
-        """
-        #### Retreived data based on _Arabidopsis_ homologues.
-        Table of queries and associated homologues. Empty rows indicate that no exact match to the provided _At_ gene name  was found.
-        """)
-        matches = st.session_state.get('matches') 
-        st.dataframe(matches, use_container_width=True)
+            st.session_state.generate_clicked = True
+
+            deg_filter = None
+            if de_contrasts and options_deg[st.session_state.filter_degs] is not None:
+                deg_filter = (st.session_state.dataset,
+                              st.session_state.deg_contrast,
+                              options_deg[st.session_state.filter_degs],
+                              st.session_state.deg_padj,
+                              st.session_state.deg_log2fc)
+
+            # only the key is stored per session, the data itself lives in the shared cache
+            st.session_state.expression_key = (gene_key, st.session_state.gene_input_type, deg_filter)
+
+
+    st.sidebar.divider()
+    st.sidebar.markdown("**Find co-expressed genes**")
+    st.sidebar.text_input("Xerophyta GeneID", placeholder="e.g. Xele.ptg000001l.116", key="coexpression_gene")
+    st.sidebar.radio(
+        "Correlation:",
+        coexpression.METHODS,
+        format_func=str.capitalize,
+        horizontal=True,
+        key="coexpression_method")
+    st.sidebar.number_input("Number of genes to return", min_value=1, max_value=500, value=25, key="coexpression_k")
+
+    if st.sidebar.button(label="Find co-expressed genes"):
+
+        if st.session_state.coexpression_gene.strip():
+            st.session_state.coexpression_query = (
+                st.session_state.coexpression_gene.strip(),
+                st.session_state.coexpression_method,
+                st.session_state.coexpression_k,
+                st.session_state.expression_values,
+            )
 
 
-    if not data.empty:
+    # Check if the generate button was clicked
+    if st.session_state.generate_clicked:
+        gene_key, gene_input_type, deg_filter = st.session_state.expression_key
+        db_version = db.DB.database_version()
+        with profiling.phase("load_expression_data"):
+            data = load_expression_data(gene_key, gene_input_type, deg_filter, db_version)
 
-        generate_plots(data)  # Display the plots
+        if gene_input_type == "Arab_homolog": 
+            st.markdown(
+            """
+            #### Retreived data based on _Arabidopsis_ homologues.
+            Table of queries and associated homologues. Empty rows indicate that no exact match to the provided _At_ gene name  was found.
+            """)
+            with profiling.phase("homologue_matches"):
+                matches = load_homologue_matches(gene_key, db_version)
+                st.dataframe(matches, use_container_width=True)
 
-        # Option to show raw data
-        show_raw_data_checkbox = st.checkbox("Show raw data", key="show_raw_data")
-        if show_raw_data_checkbox:
-            show_raw_data(data)
+
+        if not data.empty:
+
+            generate_plots(data)  # Display the plots
+
+            # Option to show raw data
+            show_raw_data_checkbox = st.checkbox("Show raw data", key="show_raw_data")
+            if show_raw_data_checkbox:
+                with profiling.phase("raw_data"):
+                    show_raw_data(data)
+        else:
+            st.markdown("""
+                        No matches found. Please check the spelling of the gene names or ensure you're using the correct format.
+                        """)
     else:
-        st.markdown("""
-                    No matches found. Please check the spelling of the gene names or ensure you're using the correct format.
-                    """)
-else:
-    instruction_page()  # Display the instruction page if generate button isn't clicked
+        instruction_page()  # Display the instruction page if generate button isn't clicked
 
 
-###############################
-# End Side Bar
-###############################
+    if 'coexpression_query' in st.session_state:
+        st.divider()
+        with profiling.phase("coexpression"):
+            show_coexpressed_genes(*st.session_state.coexpression_query)
+
+
+    ###############################
+    # End Side Bar
+    ###############################
 
-st.divider()
+    st.divider()
 
-st.caption("To report a bug or suggest a feature, please contact olivermarketos@gmail.com.")
+    st.caption("To report a bug or suggest a feature, please contact olivermarketos@gmail.com.")
 
 
+with profiling.rerun("Expression data"):
+    main()
@@ -0,0 +1,111 @@
+"""
+In-process index of all Xerophyta gene names, used for autocomplete and wildcard expansion
+(e.g. Xele.ptg000001l.*) without querying SQLite.
+
+The names are kept in one list sorted by their case-folded form, so every prefix corresponds to a
+contiguous slice that is found with two binary searches.
+"""
+import bisect
+import fnmatch
+import re
+
+import streamlit as st
+
+import db
+
+WILDCARD_CHARACTERS = "*?["
+
+# sorts after every character that can appear in a gene name, closing a prefix range
+_PREFIX_END = "\U0010ffff"
+
+
+class GeneNameIndex():
+
+    def __init__(self, gene_names):
+        self.names = sorted(set(gene_names), key=str.lower)
+        self.folded = [name.lower() for name in self.names]
+
+    def __len__(self):
+        return len(self.names)
+
+    def _prefix_range(self, prefix):
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.folded, prefix)
+        end = bisect.bisect_right(self.folded, prefix + _PREFIX_END, lo=start)
+        return start, end
+
+    def count(self, prefix):
+        """
+        Number of gene names starting with prefix (case-insensitive).
+        """
+        start, end = self._prefix_range(prefix)
+        return end - start
+
+    def complete(self, prefix, limit=20):
+        """
+        Return up to limit gene names starting with prefix (case-insensitive), in sorted order.
+        """
+        start, end = self._prefix_range(prefix)
+        return self.names[start:min(end, start + limit)]
+
+    def lookup(self, name):
+        """
+        Return the stored spelling of name (case-insensitive exact match), or None if it is not a known gene.
+        """
+        folded = name.lower()
+        position = bisect.bisect_left(self.folded, folded)
+        if position < len(self.folded) and self.folded[position] == folded:
+            return self.names[position]
+        return None
+
+    def expand(self, pattern):
+        """
+        Expand a shell-style wildcard pattern (*, ? and [...]) into the matching gene names.
+
+        Only the names sharing the pattern's literal prefix are tested against the pattern, so
+        e.g. Xele.ptg000001l.* never looks outside the Xele.ptg000001l. range.
+        A pattern without wildcards is treated as an exact (case-insensitive) lookup.
+        """
+        if not is_wildcard(pattern):
+            name = self.lookup(pattern)
+            return [name] if name else []
+
+        literal_prefix = re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+        start, end = self._prefix_range(literal_prefix)
+        matcher = re.compile(fnmatch.translate(pattern.lower()))
+        return [self.names[i] for i in range(start, end) if matcher.match(self.folded[i])]
+
+    def resolve(self, queries):
+        """
+        Resolve a list of gene names and wildcard patterns to stored gene names.
+
+        Returns:
+            tuple: (list of matched gene names without duplicates, list of queries without any match)
+        """
+        matched = {}
+        unmatched = []
+        for query in queries:
+            names = self.expand(query)
+            if not names:
+                unmatched.append(query)
+            for name in names:
+                matched[name] = None
+        return list(matched), unmatched
+
+
+def is_wildcard(pattern):
+    return any(character in pattern for character in WILDCARD_CHARACTERS)
+
+
+# Built once per process and shared by all sessions. The database version is part of the key, so
+# the index is rebuilt after an ingest; max_entries=1 drops the previous version.
+@st.cache_resource(max_entries=1, show_spinner="Loading gene names...")
+def load_gene_name_index(db_version):
+    database = db.DB()
+    gene_names = [gene_name for (gene_name,) in database.get_gene_names()]
+    database.session.close()
+    return GeneNameIndex(gene_names)
+
+
+def get_gene_name_index():
+    return load_gene_name_index(db.DB.database_version())
@@ -0,0 +1,344 @@
+"""
+The gene search behind the Gene info page, without any Streamlit UI: building the filtered gene
+query, the results table and the CSV / FASTA exports. Used by gene_query_page and callable from
+scripts and the benchmarks.
+"""
+from sqlalchemy import or_, bindparam, func, select
+from sqlalchemy.orm import selectinload
+import pandas as pd
+
+import boolean_query
+import db
+import gene_index
+import profiling
+import sequence_index
+from go_ontology import GO_ID_PATTERN
+from models import (
+    Species, Gene, Annotation, GO,
+    EnzymeCode, InterPro, ArabidopsisHomologue, ArabidopsisSynonym
+)
+
+RESULT_COLUMNS = [
+    "Gene ID",
+    "Gene Name",
+    "Species",
+    "Annotation Description",
+    "Annotation e-value",
+    "Arab. Locus",
+    "Arab. Common Name",
+    "GO Terms",
+    "Enzyme Codes",
+    "InterPro IDs",
+    "Orthologues (other species)"
+]
+
+
+def build_gene_query(database, species=None, xero_genes=(), arab_genes=(), arab_substring_match=False,
+                     terms=(), include_child_terms=False, boolean_query_text="", motif=""):
+    """
+    Build the query for the genes matching all of the given filters.
+
+    Parameters:
+        database: a db.DB instance
+        species: species name, or None for all species
+        xero_genes: Xerophyta gene names, wildcards allowed (e.g. Xele.ptg000001l.*)
+        arab_genes: Arabidopsis loci and/or common names
+        arab_substring_match: also match loci and common names containing the arab_genes
+        terms: GO terms, enzyme codes or InterPro IDs (or parts of their names)
+        include_child_terms: also match descendants of the GO IDs in terms
+        boolean_query_text: a boolean query over the annotation terms (see boolean_query)
+        motif: a nucleotide motif the coding sequence has to contain
+
+    Returns:
+        tuple: (query of Gene objects, list of xero_genes without any match)
+
+    Raises:
+        boolean_query.QuerySyntaxError: if the boolean query cannot be parsed
+        ValueError: if the motif is not a nucleotide sequence
+    """
+    session = database.session
+    unmatched_genes = []
+
+    # Build the query
+    query = (
+        session.query(Gene)
+        # Either .outerjoin(Species) or .join(Species, isouter=True)
+        .outerjoin(Species)  
+        .outerjoin(Gene.annotations)
+        .outerjoin(Annotation.go_ids)
+        .outerjoin(Annotation.enzyme_codes)
+        .outerjoin(Annotation.interpro_ids)
+        .outerjoin(Gene.arabidopsis_homologues)
+        .distinct()
+    )
+
+    # (A) Filter by species if chosen
+    if species is not None:
+        query = query.filter(Species.name == species)
+
+    # (B) Filter by Xerophyta gene name(s)
+    # names and wildcard patterns are resolved against the in-memory gene name index,
+    # so the database only sees an exact IN lookup on the unique gene_name column
+    if xero_genes:
+        gene_names, unmatched_genes = gene_index.get_gene_name_index().resolve(xero_genes)
+        # the names are rendered inline, so long gene lists are not limited by SQLite's bound parameter limit
+        query = query.filter(Gene.gene_name.in_(
+            bindparam("gene_names", gene_names, expanding=True, literal_execute=True)
+        ))
+
+    # (C) Filter by Arabidopsis gene/locus
+    # exact matches are indexed lookups of the locus or of one of the homologue's synonyms
+    if arab_genes and not arab_substring_match:
+        folded = [a.lower() for a in arab_genes]
+        # rendered inline like the gene names, so long lists of loci (e.g. from batch_query) fit
+        query = query.filter(
+            or_(
+                func.lower(ArabidopsisHomologue.a_thaliana_locus).in_(
+                    bindparam("arab_loci", folded, expanding=True, literal_execute=True)
+                ),
+                ArabidopsisHomologue.id.in_(
+                    select(ArabidopsisSynonym.homologue_id).where(ArabidopsisSynonym.synonym_folded.in_(
+                        bindparam("arab_synonyms", folded, expanding=True, literal_execute=True)
+                    ))
+                )
+            )
+        )
+    elif arab_genes:
+        query = query.filter(
+            or_(
+                *[
+                    ArabidopsisHomologue.a_thaliana_locus.ilike(f"%{a}%")
+                    for a in arab_genes
+                ],
+                *[
+                    ArabidopsisHomologue.a_thaliana_common_name.ilike(f"%{a}%")
+                    for a in arab_genes
+                ]
+            )
+        )
+
+    # (D) Filter by GO terms, Enzyme codes, InterPro IDs
+    if terms:
+        term_filters = [
+            GO.go_id.ilike(f"%{t}%") |
+            GO.go_name.ilike(f"%{t}%") |
+            EnzymeCode.enzyme_code.ilike(f"%{t}%") |
+            EnzymeCode.enzyme_name.ilike(f"%{t}%") |
+            InterPro.interpro_id.ilike(f"%{t}%") |
+            InterPro.interpro_go_name.ilike(f"%{t}%")
+            for t in terms
+        ]
+        # expand GO IDs to their whole subtree with one lookup in the precomputed closure table
+        go_ids = [t for t in terms if GO_ID_PATTERN.match(t)]
+        if include_child_terms and go_ids:
+            term_filters.append(db.bare_go_id(GO.go_id).in_(database.go_subtree_query(go_ids)))
+
+        query = query.filter(or_(*term_filters))
+
+    # (E) Filter by the boolean query, resolved in memory to a set of gene IDs
+    if boolean_query_text.strip():
+        with profiling.phase("boolean_query"):
+            gene_ids = boolean_query.get_term_bitmap_index().evaluate(boolean_query_text)
+        # the IDs are rendered inline, so large result sets are not limited by SQLite's bound parameter limit
+        query = query.filter(Gene.id.in_(
+            bindparam("boolean_query_ids", [int(i) for i in gene_ids], expanding=True, literal_execute=True)
+        ))
+
+    # (F) Filter by sequence motif, matched against the k-mer index and verified on the candidates
+    if motif.strip():
+        with profiling.phase("motif_search"):
+            motif_genes = sequence_index.find_genes_with_motif(database, sequence_index.get_kmer_index(),
+                                                               "".join(motif.split()))
+        query = query.filter(Gene.gene_name.in_(
+            bindparam("motif_gene_names", motif_genes, expanding=True, literal_execute=True)
+        ))
+
+    return query, unmatched_genes
+
+
+def search_genes(database, **filters):
+    """
+    Run build_gene_query with the given filters, for the IDs of the matching genes only (the rows
+    of the results table are read by results_table, the Gene objects are only needed for the FASTA export).
+
+    Returns:
+        tuple: (list of gene IDs in ID order, list of gene names without any match)
+    """
+    query, unmatched_genes = build_gene_query(database, **filters)
+    with profiling.phase("sql"):
+        gene_ids = [gene_id for (gene_id,) in query.with_entities(Gene.id).order_by(Gene.id)]
+    return gene_ids, unmatched_genes
+
+
+def load_genes(database, gene_ids, with_annotations=False):
+    """
+    The Gene objects of the given IDs, in ID order. with_annotations also loads the relationships
+    build_combined_table reads, per chunk of genes instead of per gene.
+    """
+    gene_ids = list(gene_ids)
+    genes = []
+    for i in range(0, len(gene_ids), db.SQL_CHUNK_SIZE):
+        query = database.session.query(Gene).filter(Gene.id.in_(gene_ids[i:i + db.SQL_CHUNK_SIZE]))
+        if with_annotations:
+            query = query.options(
+                selectinload(Gene.species),
+                selectinload(Gene.arabidopsis_homologues),
+                selectinload(Gene.annotations).selectinload(Annotation.go_ids),
+                selectinload(Gene.annotations).selectinload(Annotation.enzyme_codes),
+                selectinload(Gene.annotations).selectinload(Annotation.interpro_ids),
+            )
+        genes.extend(query.all())
+    return sorted(genes, key=lambda g: g.id)
+
+
+def results_table(database, gene_ids):
+    """
+    The results table of a list of gene IDs, with the RESULT_COLUMNS.
+
+    Rows are read pre-rendered from gene_summary when it has been built; genes without a summary
+    row (all of them if the table has not been built, or genes added since the last build) are
+    assembled from the normalized tables. Orthologues come from one lookup on the materialized
+    orthogroup tables.
+    """
+    with profiling.phase("build_table"):
+        gene_ids = list(gene_ids)
+        df = read_gene_summary(database, gene_ids)
+        if df is None:
+            df = build_combined_table(load_genes(database, gene_ids, with_annotations=True))
+        else:
+            summarized = set(df["Gene ID"])
+            missing = [gene_id for gene_id in gene_ids if gene_id not in summarized]
+            if missing:
+                missing_df = build_combined_table(load_genes(database, missing, with_annotations=True))
+                df = pd.concat([df, missing_df]) if not df.empty else missing_df
+                order = {gene_id: position for position, gene_id in enumerate(gene_ids)}
+                df = df.sort_values("Gene ID", key=lambda ids: ids.map(order), kind="stable").reset_index(drop=True)
+    if df.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    with profiling.phase("orthologues"):
+        orthologues = database.get_orthologues(gene_ids)
+        df["Orthologues (other species)"] = df["Gene ID"].map(lambda gene_id: "; ".join(orthologues.get(gene_id, [])) or None)
+    return df
+
+
+def to_csv(df):
+    with profiling.phase("to_csv"):
+        return df.to_csv(index=False)
+
+
+def to_fasta(genes):
+    """
+    FASTA text with the coding sequence of each gene, headed by its name.
+    """
+    with profiling.phase("fasta"):
+        fasta_entries = []
+        for g in genes:
+            # TODO add the descripton to the file name, or add the Arabidopsis homologue
+            fasta_entries.append(f">{g.gene_name}")
+            fasta_entries.append(g.coding_sequence or "")
+        return "\n".join(fasta_entries)
+
+
+def parse_multi_input(text_input):
+    """
+    Splits the user's input (comma, space, newline) into a list of unique, non-empty strings.
+    """
+    if not text_input.strip():
+        return []
+    # Replace commas/newlines with spaces
+    cleaned = text_input.replace(",", " ").replace("\n", " ")
+    # Split on whitespace
+    tokens = [t.strip() for t in cleaned.split(" ") if t.strip()]
+    # Return unique tokens
+    return list(set(tokens))
+
+
+# gene_summary columns -> results table columns
+SUMMARY_COLUMNS = {
+    "gene_id": "Gene ID",
+    "gene_name": "Gene Name",
+    "species_name": "Species",
+    "annotation_description": "Annotation Description",
+    "annotation_e_value": "Annotation e-value",
+    "arab_locus": "Arab. Locus",
+    "arab_common_name": "Arab. Common Name",
+    "go_terms": "GO Terms",
+    "enzyme_codes": "Enzyme Codes",
+    "interpro_ids": "InterPro IDs",
+}
+
+
+def read_gene_summary(database, gene_ids):
+    """
+    Reads the result rows of the given genes from the gene_summary table, with the same
+    columns as build_combined_table. Returns None if the table has not been built.
+    """
+    summary = database.get_gene_summary(gene_ids)
+    if summary is None:
+        return None
+    df = summary[list(SUMMARY_COLUMNS)].rename(columns=SUMMARY_COLUMNS)
+    return df.drop_duplicates().reset_index(drop=True)
+
+
+def build_combined_table(genes):
+    """
+    Takes a list of Gene objects (with joined relationships)
+    and returns a DataFrame where each row corresponds to one Gene+Annotation combo,
+    with columns for all relevant data (Gene, Annotation, GO, Enzyme, InterPro, etc.).
+    """
+    rows = []
+    for g in genes:
+        if not g.annotations:
+            # No annotation => store minimal gene info
+            rows.append({
+                "Gene ID": g.id,
+                "Gene Name": g.gene_name,
+                "Species": g.species.name if g.species else None,
+                "Annotation Description": None,
+                "Annotation e-value": None,
+                "Arab. Locus": combine_homologues_locus(g.arabidopsis_homologues),
+                "Arab. Common Name": combine_homologues_common(g.arabidopsis_homologues),
+                "GO Terms": None,
+                "Enzyme Codes": None,
+                "InterPro IDs": None,
+            })
+        else:
+            for ann in g.annotations:
+                go_list = [f"{go.go_id}({go.go_name})" for go in ann.go_ids]  
+                enz_list = [f"{ec.enzyme_code}({ec.enzyme_name})" for ec in ann.enzyme_codes]
+                ipr_list = [f"{ip.interpro_id}({ip.interpro_go_name})" for ip in ann.interpro_ids]
+
+                row = {
+                    "Gene ID": g.id,
+                    "Gene Name": g.gene_name,
+                    "Species": g.species.name if g.species else None,
+                    "Annotation Description": ann.description,
+                    "Annotation e-value": ann.e_value,
+                    "Arab. Locus": combine_homologues_locus(g.arabidopsis_homologues),
+                    "Arab. Common Name": combine_homologues_common(g.arabidopsis_homologues),
+                    "GO Terms": "; ".join(go_list) if go_list else None,
+                    "Enzyme Codes": "; ".join(enz_list) if enz_list else None,
+                    "InterPro IDs": "; ".join(ipr_list) if ipr_list else None,
+                }
+                rows.append(row)
+
+    df = pd.DataFrame(rows)
+    df.drop_duplicates(inplace=True)
+    return df
+
+
+def combine_homologues_locus(homologues):
+    """Joins all Arabidopsis homologue locus IDs into a single string."""
+    if not homologues:
+        return None
+    return ", ".join([h.a_thaliana_locus for h in homologues if h.a_thaliana_locus])
+
+
+def combine_homologues_common(homologues):
+    """Joins all Arabidopsis homologue common names into a single string."""
+    if not homologues:
+        return None
+    return ", ".join(
+        [h.a_thaliana_common_name for h in homologues if h.a_thaliana_common_name]
+    )
@@ -1,15 +1,21 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine, or_
-from sqlalchemy.orm import sessionmaker
 from datetime import datetime 
 import db as db  # Your custom db module
-from models import (
-    Base, Species, Gene, Annotation, GO,
-    EnzymeCode, InterPro, ArabidopsisHomologue
-)
+import gene_query
+from gene_query import parse_multi_input
+import gene_index
+import boolean_query
+import reference_data
+import sequence_index
+import minhash
+import query_stats
+import profiling
+from urllib.parse import quote
+from models import Gene, ArabidopsisSynonym, GOClosure
 
 def main():
+    query_stats.tag_page("Gene info")
     st.title("Xerophyta Database Explorer")
     instruction_page()
     # -------------------------
@@ -20,121 +26,115 @@ def main():
     session = database.session
 
     # 1) Species Selection
-    species_list = session.query(Species).all()
-    species_options = ["(Any)"] + [sp.name for sp in species_list]
+    # served from the shared cache, so a rerun does not query the species table
+    species_names = reference_data.get_species()
+    species_options = ["(Any)"] + list(species_names.values())
     selected_species = st.sidebar.selectbox(
         "Select Species (optional):",
         species_options
     )
     
+    # Links from other pages (e.g. the co-expression results) pass genes as ?genes=...
+    # and run the query straight away
+    linked_query = "genes" in st.query_params
+    if linked_query:
+        st.session_state.xero_gene_input = st.query_params["genes"]
+        del st.query_params["genes"]
+
     # 2) Xerophyta Gene Names
     st.sidebar.markdown("**Xerophyta Gene Names** (comma, space, or newline):")
-    xero_gene_input = st.sidebar.text_area("e.g.: Xele.ptg000001l.1, Xele.ptg000001l.116,Xele.ptg000001l.16...")
+    xero_gene_input = st.sidebar.text_area("e.g.: Xele.ptg000001l.1, Xele.ptg000001l.116,Xele.ptg000001l.16...", key="xero_gene_input",
+                                           help="Wildcards are supported, e.g. Xele.ptg000001l.* or Xele.ptg00000?l.1")
+    gene_name_lookup()
+    similar_genes_lookup(database, species_names)
 
     # 3) Arabidopsis Gene/Locus
     st.sidebar.markdown("**Arabidopsis Genes/Loci** (comma, space, or newline):")
     arab_gene_input = st.sidebar.text_area("e.g.: AT1G01010, AT1G01020")
+    synonyms_loaded = reference_data.has_table(ArabidopsisSynonym)
+    arab_substring_match = st.sidebar.checkbox(
+        "Match partial Arabidopsis names",
+        value=not synonyms_loaded,
+        disabled=not synonyms_loaded,
+        help="Also match loci and common names containing the input, e.g. ABA also finds ABA1, ABA2 and ABA3 "
+             "(slower)." if synonyms_loaded else "The Arabidopsis synonyms have not been built, names are matched partially."
+    )
 
     # 4) GO, Enzyme, InterPro
     st.sidebar.markdown("**GO Term(s) / Enzyme Code(s) / InterPro ID(s)** (comma, space, or newline):")
     advanced_input = st.sidebar.text_area("e.g.: GO:0008150, 1.1.1.1, IPR000123")
+    go_closure_loaded = reference_data.has_table(GOClosure)
+    include_child_terms = st.sidebar.checkbox(
+        "Include child GO terms",
+        disabled=not go_closure_loaded,
+        help="Also match genes annotated with any descendant of the GO IDs entered above."
+             if go_closure_loaded else "The GO ontology has not been loaded into the database."
+    )
+
+    # 5) Boolean query over the annotation terms
+    st.sidebar.markdown("**Boolean query** (optional):")
+    boolean_input = st.sidebar.text_area(
+        'e.g.: GO:0009414 AND IPR000719 NOT species:"X. humilis"',
+        help="Combine terms with AND, OR, NOT and parentheses. Terms use the prefixes go:, ipr:, ec:, at: "
+             "and species:, values can be quoted and use * and ? wildcards (e.g. ec:1.14.*)."
+    )
+
+    # 6) Nucleotide motif in the coding sequence
+    st.sidebar.markdown("**Sequence motif** (optional):")
+    motif_input = st.sidebar.text_input(
+        "e.g.: ATGGCGGCTTCTCCGAAGG",
+        help="Genes whose coding sequence contains this motif on either strand. IUPAC codes (e.g. N, R, Y) "
+             f"are allowed; motifs of at least {sequence_index.MIN_MOTIF_LENGTH} unambiguous bases are looked up "
+             "in the k-mer index, shorter ones scan all sequences and are slower."
+    )
 
     # Multi-select for which columns to display
     st.sidebar.markdown("---")
-    all_columns = [
-        "Gene ID",
-        "Gene Name",
-        "Species",
-        "Annotation Description",
-        "Annotation e-value",
-        "Arab. Locus",
-        "Arab. Common Name",
-        "GO Terms",
-        "Enzyme Codes",
-        "InterPro IDs"
-    ]
+    all_columns = gene_query.RESULT_COLUMNS
     selected_columns = st.sidebar.multiselect(
         "Select columns to display in the results table:",
         all_columns,
         default=all_columns  # Show all by default
     )
+    run_enrichment_analysis = st.sidebar.checkbox("Run GO / InterPro enrichment on the results")
 
     # -------------------------
     # QUERY BUTTON
     # -------------------------
-    if st.sidebar.button("Run Query"):
-        # Parse and clean up user inputs
-        xero_genes = parse_multi_input(xero_gene_input)
-        arab_genes = parse_multi_input(arab_gene_input)
-        adv_terms  = parse_multi_input(advanced_input)
-
-        # Build the query
-        query = (
-            session.query(Gene)
-            # Either .outerjoin(Species) or .join(Species, isouter=True)
-            .outerjoin(Species)  
-            .outerjoin(Gene.annotations)
-            .outerjoin(Annotation.go_ids)
-            .outerjoin(Annotation.enzyme_codes)
-            .outerjoin(Annotation.interpro_ids)
-            .outerjoin(Gene.arabidopsis_homologues)
-            .distinct()
-        )
-
-        # (A) Filter by species if chosen
-        if selected_species != "(Any)":
-            query = query.filter(Species.name == selected_species)
-
-        # (B) Filter by Xerophyta gene name(s)
-        if xero_genes:
-            query = query.filter(
-                or_(*[Gene.gene_name.ilike(f"{g}") for g in xero_genes])
-            )
- 
-
-        # (C) Filter by Arabidopsis gene/locus
-        if arab_genes:
-            query = query.filter(
-                or_(
-                    *[
-                        ArabidopsisHomologue.a_thaliana_locus.ilike(f"%{a}%")
-                        for a in arab_genes
-                    ],
-                    *[
-                        ArabidopsisHomologue.a_thaliana_common_name.ilike(f"%{a}%")
-                        for a in arab_genes
-                    ]
-                )
+    if st.sidebar.button("Run Query") or linked_query:
+        # Run the search on the parsed inputs
+        try:
+            gene_ids, unmatched_genes = gene_query.search_genes(
+                database,
+                species=None if selected_species == "(Any)" else selected_species,
+                xero_genes=parse_multi_input(xero_gene_input),
+                arab_genes=parse_multi_input(arab_gene_input),
+                arab_substring_match=arab_substring_match,
+                terms=parse_multi_input(advanced_input),
+                include_child_terms=include_child_terms,
+                boolean_query_text=boolean_input,
+                motif=motif_input,
             )
+        except boolean_query.QuerySyntaxError as e:
+            st.error(f"Could not read the boolean query: {e}")
+            session.close()
+            return
+        except ValueError as e:
+            st.error(str(e))
+            session.close()
+            return
+        if unmatched_genes:
+            st.warning(f"No genes found matching: {', '.join(sorted(unmatched_genes))}")
+
+        df = gene_query.results_table(database, gene_ids)
 
-        # (D) Filter by GO terms, Enzyme codes, InterPro IDs
-        if adv_terms:
-            query = query.filter(
-                or_(
-                    *[
-                        GO.go_id.ilike(f"%{t}%") |
-                        GO.go_name.ilike(f"%{t}%") |
-                        EnzymeCode.enzyme_code.ilike(f"%{t}%") |
-                        EnzymeCode.enzyme_name.ilike(f"%{t}%") |
-                        InterPro.interpro_id.ilike(f"%{t}%") |
-                        InterPro.interpro_go_name.ilike(f"%{t}%")
-                        for t in adv_terms
-                    ]
-                )
-            )
-
-        # Execute
-        results = query.all()
-
-        # Build a combined table for the results
-        df = build_combined_table(results)
-        
         # If user only wants some columns, filter them
         df_filtered = df[selected_columns]
 
         st.subheader("Search Results")
-        st.write(f"Found {len(results)} gene(s).")
-        st.dataframe(df_filtered, use_container_width=True)
+        st.write(f"Found {len(gene_ids)} gene(s).")
+        with profiling.phase("dataframe"):
+            st.dataframe(df_filtered, use_container_width=True)
 
         #-------------------------
         # DOWNLOAD BUTTONS
@@ -142,7 +142,7 @@ def main():
         col1, col2 = st.columns(2)
         
         # Download gene data button
-        csv_data = df_filtered.to_csv(index=False)
+        csv_data = gene_query.to_csv(df_filtered)
         timestamp_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         file_name = f"Xerophyta_gene_query_results_{timestamp_str}.csv"
         
@@ -155,25 +155,8 @@ def main():
             )
 
         # Download FASTA button
-        fasta_entries = []
-        for g in results:
-            # Let’s assume each Gene has .coding_sequence
-            seq = g.coding_sequence or ""
-            # We'll use the first annotation's description if it exists.
-            # If your real models have multiple annotations, adapt the logic below:
-            
-            # TODO add the descripton to the file name, or add the Arabidopsis homologue
-            # desc = g.annotation_description or "No Description"
-
-            # FASTA header: >GeneName description
-            header = f">{g.gene_name}"
-
-            # Build the FASTA entry (header + sequence)
-            fasta_entries.append(header)
-            fasta_entries.append(seq)  # on the next line
-
-        # Join everything with newlines
-        fasta_str = "\n".join(fasta_entries)
+        genes = gene_query.load_genes(database, gene_ids)
+        fasta_str = gene_query.to_fasta(genes)
 
         
         timestamp_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -187,87 +170,107 @@ def main():
                 mime="text/plain",  # or "text/fasta"
             )
 
+        if run_enrichment_analysis:
+            with profiling.phase("enrichment"):
+                show_enrichment(genes, species_names)
+
 
 
     # Cleanup
     session.close()
 
 
-def parse_multi_input(text_input):
+def show_enrichment(genes, species_names):
     """
-    Splits the user's input (comma, space, newline) into a list of unique, non-empty strings.
+    Shows the GO and InterPro terms over-represented in the result genes, tested separately for each species
+    against all annotated genes of that species.
     """
-    if not text_input.strip():
-        return []
-    # Replace commas/newlines with spaces
-    cleaned = text_input.replace(",", " ").replace("\n", " ")
-    # Split on whitespace
-    tokens = [t.strip() for t in cleaned.split(" ") if t.strip()]
-    # Return unique tokens
-    return list(set(tokens))
+    # scipy is only imported once an enrichment is run
+    import enrichment
+
+    st.subheader("Enrichment analysis")
+    st.caption("Hypergeometric test against all annotated genes of the species, with Benjamini-Hochberg FDR.")
+
+    genes_by_species = {}
+    for g in genes:
+        genes_by_species.setdefault(g.species_id, []).append(g.id)
+
+    tabs = st.tabs(enrichment.VOCABULARIES)
+    for vocabulary, tab in zip(enrichment.VOCABULARIES, tabs):
+        with tab:
+            for species_id, gene_ids in sorted(genes_by_species.items(), key=lambda item: species_names[item[0]]):
+                st.markdown(f"**{species_names[species_id]}** ({len(gene_ids)} genes)")
+                result = enrichment.run_enrichment(vocabulary, species_id, gene_ids)
+                if result.empty:
+                    st.write(f"None of these genes have {vocabulary} annotations.")
+                    continue
+                st.dataframe(
+                    result,
+                    column_config={
+                        "Fold enrichment": st.column_config.NumberColumn(format="%.2f"),
+                        "p-value": st.column_config.NumberColumn(format="%.2e"),
+                        "FDR": st.column_config.NumberColumn(format="%.2e"),
+                    },
+                    use_container_width=True,
+                    hide_index=True,
+                )
 
 
-def build_combined_table(genes):
+def gene_name_lookup():
     """
-    Takes a list of Gene objects (with joined relationships)
-    and returns a DataFrame where each row corresponds to one Gene+Annotation combo,
-    with columns for all relevant data (Gene, Annotation, GO, Enzyme, InterPro, etc.).
+    Sidebar autocomplete: lists the gene names starting with the typed prefix, served from the gene name index.
     """
-    rows = []
-    for g in genes:
-        if not g.annotations:
-            # No annotation => store minimal gene info
-            rows.append({
-                "Gene ID": g.id,
-                "Gene Name": g.gene_name,
-                "Species": g.species.name if g.species else None,
-                "Annotation Description": None,
-                "Annotation e-value": None,
-                "Arab. Locus": combine_homologues_locus(g.arabidopsis_homologues),
-                "Arab. Common Name": combine_homologues_common(g.arabidopsis_homologues),
-                "GO Terms": None,
-                "Enzyme Codes": None,
-                "InterPro IDs": None,
-            })
-        else:
-            for ann in g.annotations:
-                go_list = [f"{go.go_id}({go.go_name})" for go in ann.go_ids]  
-                enz_list = [f"{ec.enzyme_code}({ec.enzyme_name})" for ec in ann.enzyme_codes]
-                ipr_list = [f"{ip.interpro_id}({ip.interpro_go_name})" for ip in ann.interpro_ids]
-
-                row = {
-                    "Gene ID": g.id,
-                    "Gene Name": g.gene_name,
-                    "Species": g.species.name if g.species else None,
-                    "Annotation Description": ann.description,
-                    "Annotation e-value": ann.e_value,
-                    "Arab. Locus": combine_homologues_locus(g.arabidopsis_homologues),
-                    "Arab. Common Name": combine_homologues_common(g.arabidopsis_homologues),
-                    "GO Terms": "; ".join(go_list) if go_list else None,
-                    "Enzyme Codes": "; ".join(enz_list) if enz_list else None,
-                    "InterPro IDs": "; ".join(ipr_list) if ipr_list else None,
-                }
-                rows.append(row)
-
-    df = pd.DataFrame(rows)
-    df.drop_duplicates(inplace=True)
-    return df
-
-
-def combine_homologues_locus(homologues):
-    """Joins all Arabidopsis homologue locus IDs into a single string."""
-    if not homologues:
-        return None
-    return ", ".join([h.a_thaliana_locus for h in homologues if h.a_thaliana_locus])
-
-
-def combine_homologues_common(homologues):
-    """Joins all Arabidopsis homologue common names into a single string."""
-    if not homologues:
-        return None
-    return ", ".join(
-        [h.a_thaliana_common_name for h in homologues if h.a_thaliana_common_name]
-    )
+    with st.sidebar.expander("Look up gene names"):
+        prefix = st.text_input("Start of a gene name:", placeholder="e.g. Xele.ptg000001l.11")
+        if prefix.strip():
+            index = gene_index.get_gene_name_index()
+            completions = index.complete(prefix.strip())
+            if completions:
+                st.caption(f"{index.count(prefix.strip())} gene(s) start with {prefix.strip()}")
+                st.code("\n".join(completions), language=None)
+            else:
+                st.caption(f"No gene names start with {prefix.strip()}")
+
+
+def similar_genes_lookup(database, species_names):
+    """
+    Sidebar lookup of the genes in the other species whose coding sequences are most similar to a given gene,
+    served from the MinHash sketch index.
+    """
+    with st.sidebar.expander("Similar genes in other species"):
+        index = minhash.get_sketch_index()
+        if index is None:
+            st.caption("Sequence sketches have not been built for this database.")
+            return
+        gene_input = st.text_input("Gene name:", placeholder="e.g. Xele.ptg000001l.1", key="similar_gene_input")
+        if not gene_input.strip():
+            return
+
+        gene_name = gene_index.get_gene_name_index().lookup(gene_input.strip())
+        gene = database.session.query(Gene.id).filter(Gene.gene_name == gene_name).first() if gene_name else None
+        if gene is None or gene.id not in index:
+            st.caption(f"No coding sequence found for {gene_input.strip()}")
+            return
+
+        similar = index.nearest(gene.id, k=10)
+        if similar.empty:
+            st.caption("No similar genes found in the other species.")
+            return
+        names = dict(database.session.query(Gene.id, Gene.gene_name).filter(Gene.id.in_(similar["gene_id"].tolist())))
+        st.dataframe(
+            pd.DataFrame({
+                "Gene": [f"gene_query_page?genes={quote(names[i])}" for i in similar["gene_id"]],
+                "Species": similar["species_id"].map(species_names),
+                "Similarity": similar["similarity"],
+            }),
+            column_config={
+                "Gene": st.column_config.LinkColumn(display_text=r"genes=(.*)$"),
+                "Similarity": st.column_config.NumberColumn(format="%.2f", help="Estimated k-mer Jaccard similarity"),
+            },
+            use_container_width=True,
+            hide_index=True,
+        )
+
 
 def instruction_page():
 
@@ -286,7 +289,8 @@ def instruction_page():
     )
 
 
-main()
+with profiling.rerun("Gene info"):
+    main()
 
 
 # st.title("Simple Database Explorer")
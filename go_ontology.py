@@ -0,0 +1,79 @@
+"""
+Parsing of the Gene Ontology (go-basic.obo) and computation of its transitive closure.
+
+The closure lists every (ancestor, descendant) pair of the is_a / part_of graph, so "a term and
+all of its child terms" is a single indexed lookup instead of a graph walk per request.
+"""
+import re
+
+GO_ID_PATTERN = re.compile(r"^GO:\d{7}$", re.IGNORECASE)
+
+# relationships followed when propagating annotations up the ontology
+PARENT_RELATIONSHIPS = ("part_of",)
+
+
+def parse_obo(handle):
+    """
+    Parse the [Term] stanzas of an OBO file.
+
+    Parameters:
+        handle: an open text file (or any iterable of lines)
+
+    Returns:
+        dict: GO ID -> {"name", "namespace", "is_obsolete", "parents"} where parents is a set of GO IDs
+    """
+    terms = {}
+    term = None
+    for line in handle:
+        line = line.strip()
+        if line.startswith("["):
+            term = {"parents": set(), "is_obsolete": False} if line == "[Term]" else None
+            continue
+        if term is None or ":" not in line:
+            continue
+
+        tag, value = line.split(":", 1)
+        # drop trailing comments, e.g. "is_a: GO:0008150 ! biological_process"
+        value = value.split(" ! ")[0].strip()
+
+        if tag == "id":
+            terms[value] = term
+        elif tag == "name":
+            term["name"] = value
+        elif tag == "namespace":
+            term["namespace"] = value
+        elif tag == "is_obsolete":
+            term["is_obsolete"] = value == "true"
+        elif tag == "is_a":
+            term["parents"].add(value.split()[0])
+        elif tag == "relationship":
+            relationship, parent = value.split()[:2]
+            if relationship in PARENT_RELATIONSHIPS:
+                term["parents"].add(parent)
+
+    return terms
+
+
+def compute_closure(terms):
+    """
+    Compute the reflexive transitive closure of the term graph.
+
+    Yields:
+        (ancestor, descendant, distance) tuples, where distance is the length of the shortest path
+        (0 for the term itself).
+    """
+    ancestors = {}
+
+    def ancestors_of(go_id):
+        if go_id not in ancestors:
+            found = {go_id: 0}
+            for parent in terms.get(go_id, {}).get("parents", ()):
+                for ancestor, distance in ancestors_of(parent).items():
+                    if distance + 1 < found.get(ancestor, distance + 2):
+                        found[ancestor] = distance + 1
+            ancestors[go_id] = found
+        return ancestors[go_id]
+
+    for go_id in terms:
+        for ancestor, distance in ancestors_of(go_id).items():
+            yield ancestor, go_id, distance
@@ -0,0 +1,173 @@
+"""
+MinHash sketches of the coding sequences, for finding the most similar genes in the other species.
+
+Each gene's CDS is reduced to its set of SHINGLE_LENGTH-mers and sketched with NUM_HASHES
+min-hashes; the fraction of equal min-hashes of two sketches estimates the Jaccard similarity of
+their k-mer sets. Sketches are computed at ingest (in parallel) and stored in the gene_sketches table.
+
+For lookups the sketches are banded (locality sensitive hashing): BANDS bands of ROWS min-hashes
+each, and only genes agreeing with the query on all min-hashes of at least one band are compared.
+With 32 bands of 2 rows, pairs with a similarity of 0.3 are found with ~95% probability, while
+unrelated genes (similarity ~0.01) are rarely candidates.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import db
+import models
+import sequence_index
+
+# short k-mers keep orthologues with a few percent sequence divergence similar
+SHINGLE_LENGTH = 8
+NUM_HASHES = 64
+BANDS = 32
+ROWS = NUM_HASHES // BANDS
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20241108)
+_A = _rng.integers(1, _PRIME, size=NUM_HASHES, dtype=np.int64)
+_B = _rng.integers(0, _PRIME, size=NUM_HASHES, dtype=np.int64)
+
+
+def sketch(sequence):
+    """
+    MinHash signature of the k-mer set of sequence, or None if it has no valid k-mer.
+
+    Returns:
+        numpy.ndarray: NUM_HASHES uint32 values
+    """
+    codes = sequence_index.kmer_codes(sequence or "", SHINGLE_LENGTH)
+    codes = np.unique(codes[codes >= 0])
+    if len(codes) == 0:
+        return None
+    # (a * x + b) mod p for every hash function and k-mer; k-mer codes are < 2**16, so this fits in int64
+    hashes = (_A[:, None] * codes[None, :] + _B[:, None]) % _PRIME
+    return hashes.min(axis=1).astype(np.uint32)
+
+
+def sketch_genes(genes):
+    """
+    Sketch a list of (gene_id, species_id, coding_sequence) tuples.
+
+    Returns:
+        list: {"gene_id", "species_id", "signature"} records (genes without a sketch are left out)
+    """
+    records = []
+    for gene_id, species_id, sequence in genes:
+        signature = sketch(sequence)
+        if signature is not None:
+            records.append({"gene_id": gene_id, "species_id": species_id,
+                            "signature": signature.astype("<u4").tobytes()})
+    return records
+
+
+def sketch_genes_parallel(genes, workers=None, chunk_size=2000):
+    """
+    Sketch an iterable of (gene_id, species_id, coding_sequence) tuples on a pool of processes,
+    yielding lists of records (see sketch_genes) in input order.
+    """
+    genes = list(genes)
+    chunks = [genes[i:i + chunk_size] for i in range(0, len(genes), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(sketch_genes, chunks)
+
+
+class SketchIndex():
+
+    def __init__(self, gene_ids, species_ids, signatures):
+        """
+        Parameters:
+            gene_ids: database IDs of the sketched genes, one per row of signatures
+            species_ids: species ID of each gene
+            signatures: genes x NUM_HASHES uint32 array
+        """
+        self.gene_ids = np.asarray(gene_ids, dtype=np.int64)
+        self.species_ids = np.asarray(species_ids, dtype=np.int64)
+        self.signatures = signatures
+        self.positions = {gene_id: i for i, gene_id in enumerate(self.gene_ids.tolist())}
+
+        # per band, the band keys of all genes in sorted order and the gene positions in that order
+        self.band_keys = []
+        self.band_positions = []
+        for band in range(BANDS):
+            keys = band_keys(signatures[:, band * ROWS:(band + 1) * ROWS])
+            order = np.argsort(keys, kind="stable")
+            self.band_keys.append(keys[order])
+            self.band_positions.append(order)
+
+    def __len__(self):
+        return len(self.gene_ids)
+
+    def __contains__(self, gene_id):
+        return gene_id in self.positions
+
+    def candidates(self, position):
+        """
+        Positions of the genes sharing at least one band with the gene at position (including itself).
+        """
+        signature = self.signatures[position:position + 1]
+        found = []
+        for band in range(BANDS):
+            key = band_keys(signature[:, band * ROWS:(band + 1) * ROWS])[0]
+            start = np.searchsorted(self.band_keys[band], key, side="left")
+            end = np.searchsorted(self.band_keys[band], key, side="right")
+            found.append(self.band_positions[band][start:end])
+        return np.unique(np.concatenate(found))
+
+    def nearest(self, gene_id, k=10, other_species=True):
+        """
+        The k genes most similar to gene_id among the LSH candidates.
+
+        Returns:
+            pandas.DataFrame: columns gene_id, species_id and similarity (estimated Jaccard
+            similarity of the k-mer sets), sorted by decreasing similarity.
+        """
+        position = self.positions[gene_id]
+        candidates = self.candidates(position)
+        candidates = candidates[candidates != position]
+        if other_species:
+            candidates = candidates[self.species_ids[candidates] != self.species_ids[position]]
+
+        similarity = (self.signatures[candidates] == self.signatures[position]).mean(axis=1)
+        top = np.argsort(-similarity, kind="stable")[:k]
+        return pd.DataFrame({
+            "gene_id": self.gene_ids[candidates[top]],
+            "species_id": self.species_ids[candidates[top]],
+            "similarity": similarity[top],
+        })
+
+
+def band_keys(rows):
+    """
+    Hash each row of a genes x ROWS block of min-hashes into one uint64 key.
+    """
+    keys = np.zeros(len(rows), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for column in rows.T:
+            keys = keys * np.uint64(0x100000001B3) ^ column.astype(np.uint64)
+    return keys
+
+
+@st.cache_resource(max_entries=1, show_spinner="Loading sequence sketches...")
+def load_sketch_index(db_version):
+    """
+    The LSH index of all stored sketches, or None if the gene_sketches table has not been built.
+    """
+    database = db.DB()
+    if not database.has_table(models.GeneSketch):
+        database.session.close()
+        return None
+    rows = database.session.query(models.GeneSketch.gene_id, models.GeneSketch.species_id,
+                                  models.GeneSketch.signature).order_by(models.GeneSketch.gene_id).all()
+    database.session.close()
+
+    signatures = np.frombuffer(b"".join(row.signature for row in rows), dtype="<u4")
+    return SketchIndex([row.gene_id for row in rows], [row.species_id for row in rows],
+                       signatures.reshape(len(rows), NUM_HASHES).astype(np.uint32))
+
+
+def get_sketch_index():
+    return load_sketch_index(db.DB.database_version())
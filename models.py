@@ -1,7 +1,7 @@
 """
 Defines all the data models used in the database
 """
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Table, Boolean, Float, CHAR
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Table, Boolean, Float, CHAR, Index, UniqueConstraint, LargeBinary, func
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -42,7 +42,9 @@ Table for storing each of the different species (X. elegans, X. humilis, X. schl
 gene_homologue_association = Table(
      'gene_homologue_association', Base.metadata,
     Column('gene_id', Integer, ForeignKey('genes.id'), primary_key=True),
-    Column('homologue_id', Integer, ForeignKey('arabidopsis_homologues.id'), primary_key=True)
+    Column('homologue_id', Integer, ForeignKey('arabidopsis_homologues.id'), primary_key=True),
+    # the primary key finds the homologues of a gene, this index the genes of a homologue
+    Index('ix_gene_homologue_association_homologue', 'homologue_id', 'gene_id'),
 )
 
 class Species(Base):
@@ -100,12 +102,17 @@ class ArabidopsisHomologue(Base):
                          secondary=gene_homologue_association,
                         back_populates='arabidopsis_homologues')
 
+    # loci are matched case-insensitively (lower(a_thaliana_locus) IN (...)), which the unique index can not answer
+    __table_args__ = (
+        Index('ix_arabidopsis_homologues_locus_lower', func.lower(a_thaliana_locus)),
+    )
+
 
 # GO Table
 class GO(Base):
     __tablename__ = 'GO'
     id = Column(Integer, primary_key=True)
-    go_id = Column(String, nullable=False)
+    go_id = Column(String, nullable=False, unique=True, index=True)
     go_branch = Column(CHAR, nullable=True) # either (C)ellular Component, Molecular (F)unction or Biological (P)rocess
     go_name = Column(String, nullable=True)
 
@@ -115,7 +122,7 @@ class GO(Base):
 class EnzymeCode(Base):
     __tablename__ = 'enzyme_codes'
     id = Column(Integer, primary_key=True)
-    enzyme_code = Column(String, nullable=False)
+    enzyme_code = Column(String, nullable=False, unique=True, index=True)
     enzyme_name = Column(String, nullable=True)
 
     annotations = relationship("Annotation", secondary=annotations_enzyme_codes, back_populates="enzyme_codes")
@@ -124,12 +131,141 @@ class EnzymeCode(Base):
 class InterPro(Base):
     __tablename__ = 'interpro'
     id = Column(Integer, primary_key=True)
-    interpro_id = Column(String, nullable=False)
+    interpro_id = Column(String, nullable=False, unique=True, index=True)
     interpro_go_id = Column(String, nullable=True)
     interpro_go_name = Column(String, nullable=True)
 
     annotations = relationship("Annotation", secondary=annotations_interpro, back_populates="interpro_ids")
 
+# Gene Ontology terms loaded from go-basic.obo (db_manager.load_go_ontology)
+class GOTerm(Base):
+    __tablename__ = 'go_ontology_terms'
+    go_id = Column(String, primary_key=True)
+    name = Column(String, nullable=True)
+    namespace = Column(String, nullable=True) # biological_process, molecular_function or cellular_component
+    is_obsolete = Column(Boolean, nullable=False, default=False)
+
+# Transitive closure of the GO is_a/part_of graph: one row per (ancestor, descendant) pair,
+# including each term paired with itself at distance 0
+class GOClosure(Base):
+    __tablename__ = 'go_closure'
+    ancestor_id = Column(String, ForeignKey('go_ontology_terms.go_id'), primary_key=True)
+    descendant_id = Column(String, ForeignKey('go_ontology_terms.go_id'), primary_key=True)
+    distance = Column(Integer, nullable=False)
+
+    # the primary key serves subtree lookups (ancestor -> descendants), this index the reverse
+    __table_args__ = (
+        Index('ix_go_closure_descendant', 'descendant_id', 'ancestor_id'),
+    )
+
+# RNA-seq expression values (long format, one row per gene/sample), read by the expression page
+class Gene_expressions(Base):
+    __tablename__ = "gene_expressions"
+
+    id = Column("id",String, primary_key=True)
+    gene_name = Column("gene_name", String, ForeignKey('genes.gene_name'), index=True)
+    treatment_time = Column("treatment_time", Integer)
+    experiment_time = Column("experiment_time", Integer)
+    normalised_expression = Column("normalised_expression", Float)
+    log2_expression = Column("log2_expression", Float)
+    species = Column("species", String)
+    treatment = Column("treatment", String)
+    replicate = Column("replicate", Integer)
+
+# MinHash sketch of each gene's coding sequence (db_manager.build_gene_sketches),
+# used to find similar genes in the other species
+class GeneSketch(Base):
+    __tablename__ = "gene_sketches"
+    gene_id = Column(Integer, ForeignKey('genes.id'), primary_key=True)
+    species_id = Column(Integer, ForeignKey('species.id'), nullable=False)
+    signature = Column(LargeBinary, nullable=False) # minhash.NUM_HASHES little-endian uint32 values
+
+# The individual names of each homologue's free-text a_thaliana_common_name, one row per name
+# (db_manager.build_arabidopsis_synonyms), so names are matched with an indexed exact lookup
+class ArabidopsisSynonym(Base):
+    __tablename__ = "arabidopsis_synonyms"
+    id = Column(Integer, primary_key=True)
+    homologue_id = Column(Integer, ForeignKey('arabidopsis_homologues.id'), nullable=False, index=True)
+    synonym = Column(String, nullable=False) # as written in the common name field, e.g. "ABA1"
+    synonym_folded = Column(String, nullable=False) # lower case, for case-insensitive lookups
+
+    __table_args__ = (
+        UniqueConstraint('synonym_folded', 'homologue_id', name='uq_arabidopsis_synonyms_folded'),
+    )
+
+# Orthogroups: the Xerophyta genes of all species sharing an Arabidopsis homologue, materialized
+# from gene_homologue_association by db_manager.build_orthogroups (one orthogroup per homologue)
+class Orthogroup(Base):
+    __tablename__ = "orthogroups"
+    id = Column(Integer, ForeignKey('arabidopsis_homologues.id'), primary_key=True) # the homologue's ID
+    a_thaliana_locus = Column(String, nullable=False, unique=True)
+    gene_count = Column(Integer, nullable=False)
+    species_count = Column(Integer, nullable=False)
+
+class OrthogroupMember(Base):
+    __tablename__ = "orthogroup_members"
+    orthogroup_id = Column(Integer, ForeignKey('orthogroups.id'), primary_key=True)
+    gene_id = Column(Integer, ForeignKey('genes.id'), primary_key=True)
+    species_id = Column(Integer, ForeignKey('species.id'), nullable=False)
+
+    # the primary key lists the genes of an orthogroup, this index the orthogroups of a gene
+    __table_args__ = (
+        Index('ix_orthogroup_members_gene', 'gene_id', 'orthogroup_id', 'species_id'),
+    )
+
+class OrthogroupSpeciesCount(Base):
+    __tablename__ = "orthogroup_species_counts"
+    orthogroup_id = Column(Integer, ForeignKey('orthogroups.id'), primary_key=True)
+    species_id = Column(Integer, ForeignKey('species.id'), primary_key=True)
+    gene_count = Column(Integer, nullable=False)
+
+# Read-optimized copy of the gene query results, one row per gene and annotation (or per gene
+# without annotations) with all display strings pre-rendered. Rebuilt from the normalized tables
+# by db_manager.build_gene_summary, which remain the source of truth.
+class GeneSummary(Base):
+    __tablename__ = "gene_summary"
+    id = Column(Integer, primary_key=True)
+    gene_id = Column(Integer, ForeignKey('genes.id'), nullable=False, index=True)
+    gene_name = Column(String, nullable=False, index=True)
+    species_id = Column(Integer, ForeignKey('species.id'), nullable=False, index=True)
+    species_name = Column(String, nullable=True)
+    annotation_description = Column(Text, nullable=True)
+    annotation_e_value = Column(Float, nullable=True)
+    arab_locus = Column(String, nullable=True) # e.g. "AT1G01010, AT1G01020"
+    arab_common_name = Column(String, nullable=True)
+    go_terms = Column(Text, nullable=True) # e.g. "GO:0009414(response to water deprivation); ..."
+    enzyme_codes = Column(Text, nullable=True)
+    interpro_ids = Column(Text, nullable=True)
+
+# Differential expression results (e.g. DESeq2), one row per gene for each contrast of a dataset
+class DifferentialExpression(Base):
+    __tablename__ = "differential_expression"
+    id = Column(Integer, primary_key=True)
+    dataset = Column(String, nullable=False) # e.g. "X. elegans time-series"
+    contrast = Column(String, nullable=False) # e.g. "De_T24_vs_De_T0"
+    gene_name = Column(String, ForeignKey('genes.gene_name'), nullable=False)
+    base_mean = Column(Float, nullable=True)
+    log2_fold_change = Column(Float, nullable=True)
+    padj = Column(Float, nullable=True)
+    direction = Column(CHAR, nullable=True) # either (U)p or (D)own regulated
+
+    # The DEG filters are range scans on padj or log2_fold_change within one contrast.
+    # gene_name is included so the filters are answered from the index alone.
+    __table_args__ = (
+        UniqueConstraint('dataset', 'contrast', 'gene_name'),
+        Index('ix_differential_expression_padj', 'dataset', 'contrast', 'padj', 'log2_fold_change', 'gene_name'),
+        Index('ix_differential_expression_log2fc', 'dataset', 'contrast', 'log2_fold_change', 'padj', 'gene_name'),
+    )
+
+# Arabidopsis protein accessions (UniProt, and the RefSeq proteins UniProt maps them to) with their
+# TAIR locus and gene name, imported from a UniProt idmapping dump by db_manager.add_uniprot_idmapping
+class UniprotAccession(Base):
+    __tablename__ = "uniprot_accessions"
+    accession = Column(String, primary_key=True) # e.g. "Q9SZ66", or "NP_683293" (without the version)
+    uniprot_accession = Column(String, nullable=False) # the UniProt entry, the same as accession for UniProt rows
+    a_thaliana_locus = Column(String, nullable=True, index=True) # e.g. "AT4G16750"
+    gene_name = Column(String, nullable=True) # e.g. "ZEP"
+
 
 # # class Species(Base):
 # #     __tablename__ = 'species'
@@ -140,19 +276,6 @@ class InterPro(Base):
 # #     genes = relationship("Gene_info", back_populates="species")
 # #     expressions = relationship("GeneExpressions", back_populates="species")
 
-# class Gene_expressions(Base):
-#     __tablename__ = "gene_expressions"
-
-#     id = Column("id",String, primary_key=True)
-#     gene_name = Column("gene_name", String, ForeignKey('gene_info.gene_name'))
-#     treatment_time = Column("treatment_time", Integer)
-#     experiment_time = Column("experiment_time", Integer)
-#     normalised_expression = Column("normalised_expression", Float)
-#     log2_expression = Column("log2_expression", Float)
-#     species = Column("species", String)
-#     treatment = Column("treatment", String)
-#     replicate = Column("replicate", Integer)
-
 # class Gene_info(Base):
 #     __tablename__ = 'gene_info'
 #     gene_name = Column(String, primary_key=True)
@@ -3,6 +3,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 
+import profiling
+
 mpl.rcParams['font.size'] = 14  # increases the base font size
 mpl.rcParams['axes.labelsize'] = 16  # label font size
 mpl.rcParams['axes.titlesize'] = 18  # title font size
@@ -66,10 +68,11 @@ def test_multi_panel_gene_expression(df):
    
 
 
+@profiling.timed("plot_multi_panel")
 def multi_panel_gene_expression(df, expression_values):
    
     figures = []
-    grouped = df.groupby(['gene_name', 'treatment'])
+    grouped = df.groupby(['gene_name', 'treatment'], observed=True)
 
     # Iterate over the groups and plot each
     for (gene, treatment), group in grouped:
@@ -96,11 +99,12 @@ def multi_panel_gene_expression(df, expression_values):
     return figures
 
 
+@profiling.timed("plot_single_panel")
 def single_panel_gene_expression(df, expression_values):
     figures = []
     
     # Group by treatment (this will group all genes by their treatments)
-    grouped = df.groupby('treatment')
+    grouped = df.groupby('treatment', observed=True)
 
     fig_width, fig_height = 10, 6
 
@@ -110,7 +114,7 @@ def single_panel_gene_expression(df, expression_values):
         fig, ax = plt.subplots(figsize=(fig_width, fig_height))
 
         unique_gene_labels = [] 
-        for gene, gene_group in group.groupby('gene_name'):
+        for gene, gene_group in group.groupby('gene_name', observed=True):
             # Plot points for individual replicates
             ax.scatter(gene_group['treatment_time'], gene_group[expression_values], label=f'{gene}', alpha=0.6)
 
@@ -140,3 +144,58 @@ def single_panel_gene_expression(df, expression_values):
         figures.append(fig)
 
     return figures
+
+
+@profiling.timed("plot_heatmap")
+def expression_heatmap(df, expression_values):
+    """
+    Draws all genes in df as one clustered heatmap.
+
+    Each row is a gene's replicate-mean profile over the time series (dehydration then rehydration),
+    z-scored across the samples so genes with different expression levels are comparable. Rows are
+    ordered by average-linkage hierarchical clustering, so genes with similar profiles sit together.
+    The matrix is drawn with a single imshow call, which stays one rasterised image however many
+    genes are selected.
+    """
+    profiles = df.pivot_table(index='gene_name', columns=['treatment', 'treatment_time'],
+                              values=expression_values, aggfunc='mean', observed=True)
+    # dehydration time points first, then rehydration
+    profiles = profiles.sort_index(axis=1, level=['treatment', 'treatment_time'])
+
+    values = profiles.to_numpy(dtype=float)
+    row_means = np.nanmean(values, axis=1, keepdims=True)
+    values = np.where(np.isnan(values), row_means, values)
+    row_std = values.std(axis=1, keepdims=True)
+    row_std[row_std == 0] = 1
+    zscores = (values - row_means) / row_std
+
+    if len(zscores) > 2:
+        from scipy.cluster import hierarchy
+        order = hierarchy.leaves_list(hierarchy.linkage(zscores, method='average', metric='euclidean'))
+    else:
+        order = np.arange(len(zscores))
+    zscores = zscores[order]
+    genes = profiles.index[order]
+
+    fig_height = min(4 + 0.25 * len(genes), 16)
+    fig, ax = plt.subplots(figsize=(10, fig_height))
+    limit = max(np.abs(zscores).max(), 1e-6)
+    image = ax.imshow(zscores, aspect='auto', interpolation='nearest', cmap='RdBu_r', vmin=-limit, vmax=limit)
+
+    ax.set_xticks(np.arange(profiles.shape[1]))
+    ax.set_xticklabels([f"{treatment} {time}" for treatment, time in profiles.columns], rotation=90)
+    ax.set_xlabel('Treatment Time')
+
+    # gene labels are only readable for small selections
+    if len(genes) <= 60:
+        ax.set_yticks(np.arange(len(genes)))
+        ax.set_yticklabels(genes, fontsize=8)
+    else:
+        ax.set_yticks([])
+        ax.set_ylabel(f'{len(genes)} genes (clustered)')
+
+    fig.colorbar(image, ax=ax, label=f'{expression_values} (z-score)')
+    ax.set_title("Clustered expression profiles")
+    fig.tight_layout()
+
+    return fig
@@ -0,0 +1,197 @@
+"""
+Lightweight phase timers for the page reruns.
+
+A page wraps each rerun in rerun() (or start_rerun() / finish_rerun()) and the stages of interest
+in phase(); plotting functions are decorated with timed(). At the end of the rerun its timings are
+
+- added to the per page and phase histograms in PROFILE_DIR/page_profile.prom, in the Prometheus
+  text format (e.g. for node_exporter's textfile collector or any scraper reading the file),
+  rewritten at most every PROMETHEUS_INTERVAL seconds, and
+- with XEROPHYTA_PROFILE_JSON_LINES=1, appended as one JSON line to PROFILE_DIR/page_profile.jsonl,
+  rotated at JSON_LINES_MAX_BYTES with JSON_LINES_BACKUPS old files kept.
+
+Phases entered several times in one rerun (e.g. rendering each plot) are summed. Timers outside a
+rerun (e.g. in db_manager) are ignored.
+"""
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+PROFILE_DIR = os.environ.get("XEROPHYTA_PROFILE_DIR", "logs")
+JSON_LINES = os.environ.get("XEROPHYTA_PROFILE_JSON_LINES", "0") == "1"
+JSON_LINES_FILE = "page_profile.jsonl"
+JSON_LINES_MAX_BYTES = 10 * 1024 * 1024
+JSON_LINES_BACKUPS = 3
+PROMETHEUS_FILE = "page_profile.prom"
+PROMETHEUS_INTERVAL = 1.0
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_current = threading.local()
+# guards _histograms and _prometheus_rendered
+_lock = threading.Lock()
+# (page, phase) -> {"buckets": [count per bucket], "sum": seconds, "count": observations}
+_histograms = {}
+_prometheus_rendered = 0.0
+# serialises the .prom writes, which happen outside _lock
+_write_lock = threading.Lock()
+_prometheus_written = 0.0
+_json_lines_logger = None
+
+
+class RerunProfile():
+
+    def __init__(self, page):
+        self.page = page
+        self.started = time.time()
+        self.start_counter = time.perf_counter()
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+def start_rerun(page):
+    _current.profile = RerunProfile(page)
+
+
+def finish_rerun():
+    """
+    End the current rerun and write its timings. Does nothing if no rerun was started.
+    """
+    profile = getattr(_current, "profile", None)
+    if profile is None:
+        return
+    _current.profile = None
+    total = time.perf_counter() - profile.start_counter
+
+    record = {
+        "time": datetime.fromtimestamp(profile.started, timezone.utc).isoformat(),
+        "page": profile.page,
+        "total_s": round(total, 6),
+        "phases": {phase: round(seconds, 6) for phase, seconds in profile.phases.items()},
+    }
+    global _prometheus_rendered
+    text = None
+    with _lock:
+        for phase, seconds in [("total", total)] + list(profile.phases.items()):
+            observe(profile.page, phase, seconds)
+        now = time.monotonic()
+        if now - _prometheus_rendered >= PROMETHEUS_INTERVAL:
+            _prometheus_rendered = now
+            text = prometheus_text()
+    write_profile(record, text, now)
+
+
+@contextmanager
+def rerun(page):
+    start_rerun(page)
+    try:
+        yield
+    finally:
+        finish_rerun()
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile = getattr(_current, "profile", None)
+        if profile is not None:
+            profile.add(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as phase name.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(page, phase, seconds):
+    histogram = _histograms.setdefault((page, phase), {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram["buckets"][i] += 1
+    histogram["sum"] += seconds
+    histogram["count"] += 1
+
+
+def prometheus_text():
+    lines = [
+        "# HELP xerophyta_page_phase_seconds Time spent in each phase of a page rerun.",
+        "# TYPE xerophyta_page_phase_seconds histogram",
+    ]
+    for (page, phase), histogram in sorted(_histograms.items()):
+        labels = f'page="{escape_label(page)}",phase="{escape_label(phase)}"'
+        for bound, count in zip(BUCKETS, histogram["buckets"]):
+            lines.append(f'xerophyta_page_phase_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'xerophyta_page_phase_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+        lines.append(f'xerophyta_page_phase_seconds_sum{{{labels}}} {histogram["sum"]:.6f}')
+        lines.append(f'xerophyta_page_phase_seconds_count{{{labels}}} {histogram["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def json_lines_logger():
+    """
+    The logger writing the JSON lines, created on first use (RotatingFileHandler opens the file).
+    """
+    global _json_lines_logger
+    with _write_lock:
+        if _json_lines_logger is None:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(PROFILE_DIR, JSON_LINES_FILE), maxBytes=JSON_LINES_MAX_BYTES, backupCount=JSON_LINES_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("xerophyta.page_profile")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _json_lines_logger = logger
+        return _json_lines_logger
+
+
+def write_profile(record, text=None, rendered=None):
+    """
+    Log record as a JSON line if enabled, and write text (the Prometheus histograms rendered at
+    time.monotonic() rendered) unless a later rendering has been written already.
+    """
+    global _prometheus_written
+    try:
+        if JSON_LINES:
+            json_lines_logger().info(json.dumps(record))
+        if text is None:
+            return
+
+        with _write_lock:
+            if rendered <= _prometheus_written:
+                return
+            _prometheus_written = rendered
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            # write to a temporary file and rename, so a scraper never reads a partial file
+            path = os.path.join(PROFILE_DIR, PROMETHEUS_FILE)
+            with open(f"{path}.tmp", "w") as f:
+                f.write(text)
+            os.replace(f"{path}.tmp", path)
+    except OSError:
+        # profiling must never break a page, e.g. on a read-only file system
+        pass
@@ -0,0 +1,173 @@
+"""
+SQL statement instrumentation for the db.DB engines.
+
+Every statement executed through an instrumented engine is recorded with its latency, the number
+of rows it returned (or changed), a fingerprint (the statement with literals and IN lists
+normalised, so repeated queries group together) and the page and rerun it came from. Only the
+fingerprint is kept, not the statement itself: statements with inlined IN lists can be megabytes
+long and carry other users' inputs. The most recent records are kept in a process-wide ring
+buffer, summarised on the admin page.
+
+Pages call tag_page() at the top of every rerun; statements run from other threads (e.g. db_manager)
+are recorded without a page.
+"""
+import itertools
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+from sqlalchemy import event
+
+BUFFER_SIZE = 5000
+
+# a SELECT fingerprint executed at least this many times in one rerun is reported as an N+1 pattern
+N_PLUS_ONE_THRESHOLD = 10
+
+_records = deque(maxlen=BUFFER_SIZE)
+_lock = threading.Lock()
+_context = threading.local()
+_rerun_ids = itertools.count(1)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_POSTCOMPILE = re.compile(r"\(?__\[POSTCOMPILE_\w+\]\)?")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """
+    Normalise a SQL statement so that executions differing only in their values compare equal, e.g.
+    "SELECT ... WHERE id IN (1, 2, 3) AND name = 'x'" -> "SELECT ... WHERE id IN (?+) AND name = ?".
+    """
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _POSTCOMPILE.sub("(?+)", statement)
+    statement = _IN_LIST.sub("(?+)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def tag_page(page):
+    """
+    Mark the start of a rerun of page in the current (script runner) thread.
+    """
+    _context.page = page
+    _context.rerun_id = next(_rerun_ids)
+
+
+class CountingCursor(sqlite3.Cursor):
+    """
+    sqlite3 cursor counting the rows fetched from it into the record of its last statement
+    (sqlite3 reports no row count for SELECTs).
+    """
+    record = None
+
+    def _count(self, rows):
+        if self.record is not None:
+            self.record["rows"] = (self.record["rows"] or 0) + rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._count(row is not None)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count(len(rows))
+        return rows
+
+
+class CountingConnection(sqlite3.Connection):
+    """
+    sqlite3 connection handing out CountingCursors, passed to create_engine as connect_args={"factory": ...}.
+    """
+
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+
+def instrument(engine):
+    """
+    Record all statements executed on engine. Row counts of SELECTs are only available if the
+    engine's connections are CountingConnections.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start_times"].pop()
+    record = {
+        "time": time.time(),
+        "page": getattr(_context, "page", None),
+        "rerun_id": getattr(_context, "rerun_id", None),
+        "fingerprint": fingerprint(statement),
+        "duration_ms": duration * 1000,
+        "rows": cursor.rowcount if cursor.rowcount >= 0 else None,
+    }
+    if isinstance(cursor, CountingCursor):
+        cursor.record = record
+    with _lock:
+        _records.append(record)
+
+
+def records():
+    """
+    The recorded statements (most recent last) as a DataFrame.
+    """
+    with _lock:
+        rows = list(_records)
+    return pd.DataFrame(rows, columns=["time", "page", "rerun_id", "fingerprint", "duration_ms", "rows"])
+
+
+def clear():
+    with _lock:
+        _records.clear()
+
+
+def slowest_fingerprints(limit=25):
+    """
+    Statement fingerprints ordered by their total time in the buffer.
+    """
+    df = records()
+    summary = (df.groupby("fingerprint")
+        .agg(executions=("duration_ms", "size"),
+             total_ms=("duration_ms", "sum"),
+             mean_ms=("duration_ms", "mean"),
+             p95_ms=("duration_ms", lambda durations: durations.quantile(0.95)),
+             max_ms=("duration_ms", "max"),
+             rows=("rows", "sum"),
+             pages=("page", lambda pages: ", ".join(sorted(pages.dropna().unique()))))
+        .sort_values("total_ms", ascending=False)
+        .reset_index()
+    )
+    return summary.head(limit)
+
+
+def n_plus_one_patterns(threshold=N_PLUS_ONE_THRESHOLD):
+    """
+    SELECT fingerprints executed at least threshold times within a single rerun, typically lazy loads
+    of a relationship issued once per row of an earlier result.
+    """
+    df = records()
+    df = df[df["rerun_id"].notna() & df["fingerprint"].str.upper().str.startswith("SELECT")]
+    patterns = (df.groupby(["rerun_id", "page", "fingerprint"])
+        .agg(executions=("duration_ms", "size"), total_ms=("duration_ms", "sum"), started=("time", "min"))
+        .reset_index()
+    )
+    patterns = patterns[patterns["executions"] >= threshold]
+    patterns["started"] = pd.to_datetime(patterns["started"], unit="s")
+    return patterns.sort_values(["rerun_id", "executions"], ascending=[False, False]).reset_index(drop=True)
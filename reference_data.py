@@ -0,0 +1,64 @@
+"""
+Small reference data read on every rerun of the pages (the species list, which optional tables have
+been built), cached once per process and database version, and the prewarming of the shared indexes.
+
+app.py runs prewarm() on a background thread when the server process starts, so the species, the
+table list, the gene name index, the boolean query index of the annotation vocabularies and the
+sequence sketches are loaded while the first page is shown, and the first search finds them ready.
+"""
+import logging
+
+import sqlalchemy as sq
+import streamlit as st
+
+import boolean_query
+import db
+import gene_index
+import minhash
+
+logger = logging.getLogger(__name__)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_species(db_version):
+    """
+    Returns:
+        dict: species ID -> name, in ID order
+    """
+    database = db.DB()
+    species = dict(database.session.query(db.models.Species.id, db.models.Species.name).order_by(db.models.Species.id))
+    database.close()
+    return species
+
+
+def get_species():
+    return load_species(db.DB.database_version())
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_table_names(db_version):
+    database = db.DB()
+    table_names = frozenset(sq.inspect(database.engine).get_table_names())
+    database.close()
+    return table_names
+
+
+def has_table(model):
+    """
+    Cached equivalent of DB.has_table, for the checks the pages make on every rerun.
+    """
+    return model.__tablename__ in load_table_names(db.DB.database_version())
+
+
+def prewarm():
+    """
+    Load the shared reference data and indexes of the current database into the st.cache_resource caches.
+    """
+    db_version = db.DB.database_version()
+    for loader in (load_species, load_table_names, gene_index.load_gene_name_index,
+                   boolean_query.load_term_bitmap_index, minhash.load_sketch_index):
+        try:
+            loader(db_version)
+        except Exception:
+            # the page will load it (and show the error) when it is needed
+            logger.exception("Prewarming %s failed", loader.__name__)
@@ -0,0 +1,224 @@
+"""
+k-mer index over the coding sequences, for finding the genes that contain a nucleotide motif or primer.
+
+To keep the index small only the minimizers of the sequences are stored: of every WINDOW
+consecutive k-mers, the one with the smallest hash. Any motif of at least K + WINDOW - 1 bases
+contains a full window, and the minimizer of that window is also a minimizer of every sequence
+containing the motif. The genes holding all of the motif's minimizers are therefore a (small)
+superset of the genes containing the motif, and only those candidates are checked against the
+actual sequences.
+
+The index is stored as NumPy arrays in CSR layout: offsets[code]:offsets[code + 1] is the slice of
+postings holding the (sorted) positions in gene_ids of the genes with minimizer code.
+"""
+import logging
+import re
+
+import os
+
+import numpy as np
+import sqlalchemy as sq
+import streamlit as st
+
+import db
+import models
+
+logger = logging.getLogger(__name__)
+
+K = 10
+WINDOW = 8
+MIN_MOTIF_LENGTH = K + WINDOW - 1
+
+# 2-bit encoding of the bases, everything else (N, IUPAC codes) breaks the k-mers
+_ENCODING = np.full(256, 255, dtype=np.uint8)
+for _code, _bases in enumerate(("Aa", "Cc", "Gg", "Tt")):
+    for _base in _bases:
+        _ENCODING[ord(_base)] = _code
+
+# a fixed permutation of the 4**K codes, so minimizers are not biased towards poly-A k-mers
+_HASH_MULTIPLIER = 0x9E3779B1
+_CODE_MASK = (1 << (2 * K)) - 1
+
+IUPAC_CODES = {
+    "A": "A", "C": "C", "G": "G", "T": "T", "U": "T",
+    "R": "[AG]", "Y": "[CT]", "S": "[CG]", "W": "[AT]", "K": "[GT]", "M": "[AC]",
+    "B": "[CGT]", "D": "[AGT]", "H": "[ACT]", "V": "[ACG]", "N": "[ACGT]",
+}
+_COMPLEMENT = str.maketrans("ACGTURYSWKMBDHVN", "TGCAAYRSWMKVHDBN")
+
+
+def index_path(database_name=None):
+    """
+    The k-mer index is stored next to the database file it was built from.
+    """
+    return f"{database_name or db.DB.DATABASE_NAME}.kmers.npz"
+
+
+def kmer_codes(sequence, k=K):
+    """
+    2-bit encoded k-mers of a sequence, as an int64 array with -1 for k-mers containing a non-ACGT base.
+    """
+    encoded = _ENCODING[np.frombuffer(sequence.encode("ascii", "replace"), dtype=np.uint8)]
+    if len(encoded) < k:
+        return np.empty(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(encoded, k)
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.int64)
+    codes = (windows.astype(np.int64) << shifts).sum(axis=1)
+    codes[(windows == 255).any(axis=1)] = -1
+    return codes
+
+
+def minimizers(sequence):
+    """
+    The distinct minimizer codes of a sequence (windows containing an invalid k-mer are skipped).
+    """
+    codes = kmer_codes(sequence)
+    if len(codes) < WINDOW:
+        return np.empty(0, dtype=np.int64)
+    hashes = np.where(codes >= 0, (codes * _HASH_MULTIPLIER) & _CODE_MASK, np.iinfo(np.int64).max)
+    hash_windows = np.lib.stride_tricks.sliding_window_view(hashes, WINDOW)
+    valid = (np.lib.stride_tricks.sliding_window_view(codes, WINDOW) >= 0).all(axis=1)
+    chosen = hash_windows.argmin(axis=1) + np.arange(len(hash_windows))
+    return np.unique(codes[chosen[valid]])
+
+
+class KmerIndex():
+
+    def __init__(self, gene_ids, offsets, postings):
+        self.gene_ids = gene_ids
+        self.offsets = offsets
+        self.postings = postings
+
+    @classmethod
+    def build(cls, sequences):
+        """
+        Build the index from an iterable of (gene_id, coding_sequence) pairs.
+        """
+        gene_ids = []
+        code_chunks = []
+        position_chunks = []
+        for gene_id, sequence in sequences:
+            codes = minimizers(sequence or "")
+            code_chunks.append(codes)
+            position_chunks.append(np.full(len(codes), len(gene_ids), dtype=np.uint32))
+            gene_ids.append(gene_id)
+
+        codes = np.concatenate(code_chunks) if code_chunks else np.empty(0, dtype=np.int64)
+        positions = np.concatenate(position_chunks) if position_chunks else np.empty(0, dtype=np.uint32)
+        # genes were added in order, so a stable sort by code keeps each posting list sorted
+        order = np.argsort(codes, kind="stable")
+        offsets = np.zeros(4 ** K + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum(np.bincount(codes, minlength=4 ** K))
+        return cls(np.asarray(gene_ids, dtype=np.int64), offsets, positions[order])
+
+    def save(self, path):
+        np.savez_compressed(path, gene_ids=self.gene_ids, offsets=self.offsets, postings=self.postings)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(arrays["gene_ids"], arrays["offsets"], arrays["postings"])
+
+    def covers(self, gene_count, max_gene_id):
+        """
+        Whether the index was built from the current genes, i.e. no genes were added or removed since.
+        """
+        if not len(self.gene_ids):
+            return gene_count == 0
+        return len(self.gene_ids) == gene_count and int(self.gene_ids[-1]) == max_gene_id
+
+    def candidates(self, motif):
+        """
+        Gene IDs that contain every minimizer of the unambiguous stretches of motif,
+        or None if the motif has no stretch long enough to be looked up.
+        """
+        found = None
+        for stretch in re.findall(r"[ACGT]+", motif.upper()):
+            if len(stretch) < MIN_MOTIF_LENGTH:
+                continue
+            for code in minimizers(stretch):
+                postings = self.postings[self.offsets[code]:self.offsets[code + 1]]
+                found = postings if found is None else np.intersect1d(found, postings, assume_unique=True)
+        if found is None:
+            return None
+        return self.gene_ids[found]
+
+
+def reverse_complement(motif):
+    return motif.upper().translate(_COMPLEMENT)[::-1]
+
+
+def motif_pattern(motif):
+    """
+    Regular expression matching a nucleotide motif, with IUPAC ambiguity codes expanded.
+    """
+    motif = motif.upper()
+    unknown = set(motif) - set(IUPAC_CODES)
+    if unknown:
+        raise ValueError(f"Not a nucleotide motif, unexpected character(s): {''.join(sorted(unknown))}")
+    return "".join(IUPAC_CODES[base] for base in motif)
+
+
+def find_genes_with_motif(database, index, motif, both_strands=True):
+    """
+    Find the genes whose coding sequence contains motif (IUPAC codes allowed).
+
+    Candidates come from the k-mer index and are verified against their sequences; motifs too short
+    for the index are matched by scanning all coding sequences.
+
+    Returns:
+        list: names of the matching genes
+    """
+    motifs = [motif.upper()]
+    if both_strands and reverse_complement(motif) != motif.upper():
+        motifs.append(reverse_complement(motif))
+    pattern = re.compile("|".join(motif_pattern(m) for m in motifs))
+
+    query = database.session.query(models.Gene.gene_name, models.Gene.coding_sequence)
+    candidate_sets = [index.candidates(m) if index is not None else None for m in motifs]
+    if any(candidates is None for candidates in candidate_sets):
+        rows = query.filter(models.Gene.coding_sequence.isnot(None)).yield_per(1000)
+    else:
+        candidate_ids = np.union1d(*candidate_sets) if len(candidate_sets) > 1 else candidate_sets[0]
+        candidate_ids = [int(gene_id) for gene_id in candidate_ids]
+        rows = []
+        for i in range(0, len(candidate_ids), db.SQL_CHUNK_SIZE):
+            rows.extend(query.filter(models.Gene.id.in_(candidate_ids[i:i + db.SQL_CHUNK_SIZE])))
+
+    return [gene_name for gene_name, sequence in rows if sequence and pattern.search(sequence.upper())]
+
+
+def index_version(path=None):
+    """
+    Changes whenever the index file is rebuilt, None if there is no index.
+    """
+    path = path or index_path()
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+@st.cache_resource(max_entries=1, show_spinner="Loading sequence index...")
+def load_kmer_index(db_version, kmer_index_version):
+    """
+    The k-mer index of the current database, or None if it has not been built or is out of date
+    (genes were added without rebuilding it); motif searches then scan the sequences.
+    """
+    if kmer_index_version is None:
+        return None
+    index = KmerIndex.load(index_path())
+
+    database = db.DB()
+    gene_count, max_gene_id = database.session.query(sq.func.count(models.Gene.id), sq.func.max(models.Gene.id)).one()
+    database.close()
+    if not index.covers(gene_count, max_gene_id):
+        logger.warning("The k-mer index (%d genes) is out of date (%d genes in the database), run "
+                       "db_manager.build_kmer_index; motif searches scan the sequences until then",
+                       len(index.gene_ids), gene_count)
+        return None
+    return index
+
+
+def get_kmer_index():
+    return load_kmer_index(db.DB.database_version(), index_version())
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import models
+
+
+@pytest.fixture
+def annotated_database(tmp_path):
+    """
+    A small database annotated the way the annotation exports are: GO IDs with their branch prefix
+    (P:GO:0009414). Genes 1 and 2 are annotated with GO:0009414, gene 3 with its child term GO:0009819.
+    """
+    database = db.DB(str(tmp_path / "annotated.sqlite"))
+    models.Base.metadata.create_all(database.engine)
+    session = database.session
+    session.add(models.Species(id=1, name="X. elegans"))
+    session.add_all([models.Gene(id=i, gene_name=f"Xele.ptg000001l.{i}", species_id=1, coding_sequence="ATG")
+                     for i in range(1, 5)])
+    response = models.GO(id=1, go_id="P:GO:0009414", go_branch="P", go_name="response to water deprivation")
+    drought = models.GO(id=2, go_id="P:GO:0009819", go_branch="P", go_name="drought recovery")
+    session.add_all([
+        models.Annotation(id=1, gene_id=1, description="a", go_ids=[response]),
+        models.Annotation(id=2, gene_id=2, description="b", go_ids=[response]),
+        models.Annotation(id=3, gene_id=3, description="c", go_ids=[drought]),
+    ])
+    session.commit()
+    yield database
+    database.close()
+
+
+GO_BASIC = """format-version: 1.2
+
+[Term]
+id: GO:0009414
+name: response to water deprivation
+namespace: biological_process
+
+[Term]
+id: GO:0009819
+name: drought recovery
+namespace: biological_process
+is_a: GO:0009414 ! response to water deprivation
+"""
+
+
+@pytest.fixture
+def ontology_database(annotated_database, tmp_path, monkeypatch):
+    """
+    annotated_database with the GO ontology (GO:0009819 a child of GO:0009414) loaded by db_manager.
+    """
+    import db_manager
+
+    obo_file = tmp_path / "go-basic.obo"
+    obo_file.write_text(GO_BASIC)
+    monkeypatch.setattr(db.DB, "DATABASE_NAME", annotated_database.database_name)
+    db_manager.load_go_ontology(str(obo_file))
+    return annotated_database
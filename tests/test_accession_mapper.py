@@ -0,0 +1,190 @@
+"""
+accession_mapper against stub UniProt and NCBI services served by tornado on an ephemeral port.
+"""
+import asyncio
+import json
+import re
+
+import pytest
+import tornado.httpserver
+import tornado.testing
+import tornado.web
+
+import accession_mapper
+
+UNIPROT_ENTRIES = {
+    "Q9SZ66": ("ZEP", "At5g67030"),
+    "P93736": ("GA2OX1", "At1g78440"),
+    "Q9LUD7": ("PP2CA", "At3g11410"),
+}
+REFSEQ_ENTRIES = {
+    "NP_201504": ("ZEP", "AT5G67030"),
+    "NP_177965": (None, "AT1G78440"),
+}
+
+GENPEPT = """LOCUS       {accession}                  10 aa            linear   PLN 01-JAN-2024
+DEFINITION  protein [Arabidopsis thaliana].
+ACCESSION   {accession}
+VERSION     {accession}.1
+FEATURES             Location/Qualifiers
+     source          1..10
+                     /organism="Arabidopsis thaliana"
+     CDS             1..10
+{qualifiers}ORIGIN
+        1 mgstpfcyss
+//
+"""
+
+
+class StubServices():
+    """
+    The requests received, and the failures to answer with: failures[service] is a list of status
+    codes (or "close" to drop the connection) used up one per request; batches containing an
+    accession of rejected always fail with 400.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.failures = {"uniprot": [], "ncbi": []}
+        self.rejected = set()
+
+    def failure(self, service, accessions):
+        if self.rejected & set(accessions):
+            return 400
+        return self.failures[service].pop(0) if self.failures[service] else None
+
+
+class StubHandler(tornado.web.RequestHandler):
+
+    def initialize(self, services):
+        self.services = services
+
+    def respond(self, service, accessions, body):
+        self.services.requests.append((service, accessions))
+        failure = self.services.failure(service, accessions)
+        if failure == "close":
+            self.request.connection.stream.close()
+        elif failure:
+            self.send_error(failure)
+        else:
+            self.finish(body)
+
+
+class UniprotHandler(StubHandler):
+
+    def get(self):
+        accessions = re.findall(r"accession:(\w+)", self.get_query_argument("query"))
+        results = [{"primaryAccession": accession,
+                    "genes": [{"geneName": {"value": UNIPROT_ENTRIES[accession][0]},
+                               "orderedLocusNames": [{"value": UNIPROT_ENTRIES[accession][1]}]}]}
+                   for accession in accessions if accession in UNIPROT_ENTRIES]
+        self.respond("uniprot", accessions, json.dumps({"results": results}))
+
+
+class NcbiHandler(StubHandler):
+
+    def get(self):
+        accessions = self.get_query_argument("id").split(",")
+        records = []
+        for accession in accessions:
+            entry = REFSEQ_ENTRIES.get(accession.split(".")[0])
+            if entry:
+                gene_name, locus = entry
+                qualifiers = (f'                     /gene="{gene_name}"\n' if gene_name else "") \
+                    + f'                     /locus_tag="{locus}"\n'
+                records.append(GENPEPT.format(accession=accession.split(".")[0], qualifiers=qualifiers))
+        self.respond("ncbi", accessions, "".join(records))
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(accession_mapper, "BACKOFF", 0)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = accession_mapper.AccessionCache(str(tmp_path / "accessions.sqlite"))
+    yield cache
+    cache.close()
+
+
+def resolve(services, cache, accessions, **options):
+    """
+    Serve the stub services on an unused port and resolve accessions against them.
+    """
+    async def run():
+        app = tornado.web.Application([
+            (r"/uniprotkb/search", UniprotHandler, {"services": services}),
+            (r"/efetch.fcgi", NcbiHandler, {"services": services}),
+        ])
+        sock, port = tornado.testing.bind_unused_port()
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_sockets([sock])
+        resolver = accession_mapper.AccessionResolver(
+            cache, f"http://127.0.0.1:{port}", f"http://127.0.0.1:{port}",
+            uniprot_rate=1000, ncbi_rate=1000, log=lambda message: None)
+        try:
+            return await resolver.resolve(accessions, **options)
+        finally:
+            resolver.close()
+            server.stop()
+
+    return asyncio.run(run())
+
+
+def test_resolves_uniprot_and_refseq_batches(cache, monkeypatch):
+    monkeypatch.setattr(accession_mapper, "UNIPROT_BATCH_SIZE", 2)
+    services = StubServices()
+    results = resolve(services, cache, ["Q9SZ66", "P93736", "Q9LUD7", "NP_201504.1", "NP_177965"])
+
+    assert results == {
+        "Q9SZ66": ("ZEP", "AT5G67030", "UniProt"),
+        "P93736": ("GA2OX1", "AT1G78440", "UniProt"),
+        "Q9LUD7": ("PP2CA", "AT3G11410", "UniProt"),
+        "NP_201504.1": ("ZEP", "AT5G67030", "NCBI RefSeq"),
+        "NP_177965": ("AT1G78440", "AT1G78440", "NCBI RefSeq"),
+    }
+    assert sorted(service for service, _ in services.requests) == ["ncbi", "uniprot", "uniprot"]
+
+
+def test_retries_rate_limiting_server_and_network_errors(cache):
+    services = StubServices()
+    services.failures["uniprot"] = [429, 503, "close"]
+    services.failures["ncbi"] = [500]
+    results = resolve(services, cache, ["Q9SZ66", "NP_201504"])
+
+    assert results["Q9SZ66"] == ("ZEP", "AT5G67030", "UniProt")
+    assert results["NP_201504"] == ("ZEP", "AT5G67030", "NCBI RefSeq")
+    assert len(services.requests) == 6
+
+
+def test_not_found_is_cached_and_rerun_makes_no_requests(cache):
+    resolve(StubServices(), cache, ["Q9SZ66", "Q00000", "NP_999999"])
+
+    services = StubServices()
+    results = resolve(services, cache, ["Q9SZ66", "Q00000", "NP_999999"])
+    assert services.requests == []
+    assert results["Q9SZ66"] == ("ZEP", "AT5G67030", "UniProt")
+    assert results["Q00000"] == (None, None, accession_mapper.NOT_FOUND)
+    assert results["NP_999999"] == (None, None, accession_mapper.NOT_FOUND)
+
+    services = StubServices()
+    resolve(services, cache, ["Q9SZ66", "Q00000", "NP_999999"], retry_not_found=True)
+    assert sorted(services.requests) == [("ncbi", ["NP_999999"]), ("uniprot", ["Q00000"])]
+
+
+def test_resumes_after_failed_batch(cache, monkeypatch):
+    monkeypatch.setattr(accession_mapper, "UNIPROT_BATCH_SIZE", 1)
+    services = StubServices()
+    services.rejected = {"P93736"}
+    results = resolve(services, cache, ["Q9SZ66", "P93736", "Q9LUD7"])
+
+    assert results["Q9SZ66"][2] == "UniProt"
+    assert results["P93736"] == (None, None, accession_mapper.NOT_FOUND)
+    # a failed batch is not cached as not found
+    assert "P93736" not in cache.get(["P93736"])
+
+    services = StubServices()
+    results = resolve(services, cache, ["Q9SZ66", "P93736", "Q9LUD7"])
+    assert services.requests == [("uniprot", ["P93736"])]
+    assert results["P93736"] == ("GA2OX1", "AT1G78440", "UniProt")
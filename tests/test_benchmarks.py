@@ -0,0 +1,31 @@
+"""
+The benchmark scripts against a tiny generated database, so that they keep up with the schema
+and the derived-table builders.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import db
+import db_manager
+import run_benchmarks
+from generate_db import generate
+
+
+def test_generated_database_runs_a_scenario(tmp_path, monkeypatch):
+    # generate() points the default database of db and db_manager at the generated file
+    monkeypatch.setattr(db.DB, "DATABASE_NAME", db.DB.DATABASE_NAME)
+    monkeypatch.setattr(db_manager, "DATABASE_NAME", db_manager.DATABASE_NAME)
+    path = str(tmp_path / "bench.sqlite")
+    generate(path, 0.01)
+
+    database = db.DB(path)
+    try:
+        fixtures = run_benchmarks.Fixtures(database)
+        scenario = run_benchmarks.SCENARIOS["gene list (50)"]
+        assert scenario(database, fixtures) == 50
+        result = run_benchmarks.run_scenario(scenario, database, fixtures, iterations=1)
+        assert result["p50_ms"] > 0
+    finally:
+        database.close()
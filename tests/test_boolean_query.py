@@ -0,0 +1,21 @@
+import boolean_query
+import models
+
+
+def build_index(database):
+    gene_ids = [gene_id for (gene_id,) in database.session.query(models.Gene.id)]
+    pairs = {field: database.get_gene_term_pairs(field) for field in boolean_query.FIELDS}
+    return boolean_query.TermBitmapIndex.from_pairs(gene_ids, pairs)
+
+
+def test_go_terms_match_branch_prefixed_ids(annotated_database):
+    index = build_index(annotated_database)
+    assert list(index.evaluate("go:GO:0009414")) == [1, 2]
+    assert list(index.evaluate("GO:0009414")) == [1, 2]
+    assert list(index.evaluate("go:0009819")) == [3]
+
+
+def test_go_wildcards_and_negation(annotated_database):
+    index = build_index(annotated_database)
+    assert list(index.evaluate("go:GO:00094*")) == [1, 2]
+    assert list(index.evaluate("NOT go:GO:0009414")) == [3, 4]
@@ -0,0 +1,13 @@
+import enrichment
+
+
+def test_go_associations_propagate_branch_prefixed_ids(ontology_database):
+    associations = ontology_database.get_term_associations("GO", 1)
+    pairs = set(zip(associations["gene_id"], associations["term"]))
+    assert pairs == {(1, "GO:0009414"), (2, "GO:0009414"), (3, "GO:0009414"), (3, "GO:0009819")}
+
+
+def test_go_enrichment_returns_terms(ontology_database):
+    incidence = enrichment.TermIncidence.from_associations(ontology_database.get_term_associations("GO", 1))
+    result = incidence.enrichment([3])
+    assert set(result["Term"]) == {"GO:0009414", "GO:0009819"}
@@ -0,0 +1,32 @@
+import db
+import gene_query
+import models
+
+
+def search_terms(database, terms, include_child_terms):
+    query, _ = gene_query.build_gene_query(database, None, [], [], False, terms, include_child_terms, "", "")
+    return sorted(gene.id for gene in query)
+
+
+def test_child_terms_of_branch_prefixed_go_ids(ontology_database):
+    assert search_terms(ontology_database, ["GO:0009414"], False) == [1, 2]
+    assert search_terms(ontology_database, ["GO:0009414"], True) == [1, 2, 3]
+    assert search_terms(ontology_database, ["GO:0009819"], True) == [3]
+
+
+def results_gene_ids(database):
+    gene_ids = [gene_id for (gene_id,) in database.session.query(models.Gene.id).order_by(models.Gene.id)]
+    return list(gene_query.results_table(database, gene_ids)["Gene ID"])
+
+
+def test_results_of_genes_missing_from_gene_summary(annotated_database, monkeypatch):
+    import db_manager
+
+    # create_all leaves an empty gene_summary table
+    assert results_gene_ids(annotated_database) == [1, 2, 3, 4]
+
+    monkeypatch.setattr(db.DB, "DATABASE_NAME", annotated_database.database_name)
+    db_manager.build_gene_summary()
+    annotated_database.session.add(models.Gene(id=5, gene_name="Xele.ptg000001l.5", species_id=1))
+    annotated_database.session.commit()
+    assert results_gene_ids(annotated_database) == [1, 2, 3, 4, 5]
@@ -0,0 +1,25 @@
+import db
+import db_manager
+import models
+
+
+def test_homologues_without_locus_form_no_orthogroup(annotated_database, monkeypatch):
+    session = annotated_database.session
+    session.add_all([
+        models.ArabidopsisHomologue(id=1, a_thaliana_locus="AT5G67030"),
+        models.ArabidopsisHomologue(id=2, a_thaliana_locus=None, description="No Blast Hit"),
+        models.ArabidopsisHomologue(id=3, a_thaliana_locus=None, description="No Blast Hit"),
+    ])
+    session.execute(models.gene_homologue_association.insert(), [
+        {"gene_id": 1, "homologue_id": 1}, {"gene_id": 2, "homologue_id": 1},
+        {"gene_id": 3, "homologue_id": 2}, {"gene_id": 4, "homologue_id": 3},
+    ])
+    session.commit()
+
+    monkeypatch.setattr(db.DB, "DATABASE_NAME", annotated_database.database_name)
+    db_manager.build_orthogroups()
+
+    orthogroups = session.query(models.Orthogroup.id, models.Orthogroup.a_thaliana_locus, models.Orthogroup.gene_count).all()
+    assert orthogroups == [(1, "AT5G67030", 2)]
+    assert sorted(gene_id for (gene_id,) in session.query(models.OrthogroupMember.gene_id)) == [1, 2]
+    assert session.query(models.OrthogroupSpeciesCount.orthogroup_id).all() == [(1,)]
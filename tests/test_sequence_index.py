@@ -0,0 +1,39 @@
+import random
+
+import db
+import db_manager
+import models
+import sequence_index
+
+MOTIF = "GATTACAGATTACAGATTACA"
+
+
+def random_sequence(rng, length=300):
+    return "".join(rng.choices("ACGT", k=length))
+
+
+def test_out_of_date_index_falls_back_to_scanning(annotated_database, monkeypatch):
+    monkeypatch.setattr(db.DB, "DATABASE_NAME", annotated_database.database_name)
+    session = annotated_database.session
+    rng = random.Random(0)
+    for gene in session.query(models.Gene):
+        gene.coding_sequence = random_sequence(rng)
+    session.query(models.Gene).filter_by(id=2).one().coding_sequence = random_sequence(rng) + MOTIF
+    session.commit()
+    db_manager.build_kmer_index()
+
+    index = sequence_index.get_kmer_index()
+    assert index is not None
+    assert sequence_index.find_genes_with_motif(annotated_database, index, MOTIF) == ["Xele.ptg000001l.2"]
+
+    # genes ingested without rebuilding the index
+    session.add(models.Gene(id=5, gene_name="Xele.ptg000001l.5", species_id=1, coding_sequence=MOTIF + random_sequence(rng)))
+    session.commit()
+    assert sequence_index.get_kmer_index() is None
+    assert sorted(sequence_index.find_genes_with_motif(annotated_database, None, MOTIF)) == ["Xele.ptg000001l.2", "Xele.ptg000001l.5"]
+
+    # a rebuilt index is picked up
+    db_manager.build_kmer_index()
+    index = sequence_index.get_kmer_index()
+    assert index is not None and len(index.gene_ids) == 5
+    assert sorted(sequence_index.find_genes_with_motif(annotated_database, index, MOTIF)) == ["Xele.ptg000001l.2", "Xele.ptg000001l.5"]